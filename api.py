@@ -0,0 +1,220 @@
+"""JSON API, mounted at /api/v1.
+
+Uses the same session login and the same queries as the HTML views.
+Lists come a page at a time: each response has a `next` cursor to pass
+back as `?before=` for the following page (null on the last page).
+`?fields=id,text,timestamp,author` limits which fields are returned.
+
+    GET  /api/v1/timeline                    logged-in user's home timeline
+    GET  /api/v1/users/<id>                  profile
+    GET  /api/v1/users/<id>/messages         messages by a user
+    GET  /api/v1/users/<id>/followers        who follows a user
+    GET  /api/v1/users/<id>/following        who a user follows
+    GET  /api/v1/messages/trending           messages most liked lately
+    POST /api/v1/messages/<id>/like          like or unlike a message
+
+Errors come back as {"error": "..."} with the HTTP status.
+"""
+
+from flask import Blueprint, current_app, g, json, request
+
+import likes
+import timeline
+import trending
+from models import db, User, Message
+from pagination import decode_cursor, split_page
+
+api = Blueprint('api', __name__)
+
+MESSAGE_FIELDS = ['id', 'text', 'timestamp', 'author', 'likes_count', 'liked']
+
+USER_FIELDS = [
+    'id', 'username', 'image_url', 'header_image_url', 'bio', 'location',
+    'messages_count', 'following_count', 'followers_count', 'likes_count',
+    'is_following',
+]
+
+# what a message's `author` contains
+AUTHOR_FIELDS = ['id', 'username', 'image_url']
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def respond(data, status=200):
+    """Compact JSON response, whatever JSONIFY_PRETTYPRINT_REGULAR says."""
+
+    return current_app.response_class(
+        json.dumps(data, separators=(',', ':')),
+        status=status, mimetype='application/json')
+
+
+@api.errorhandler(APIError)
+def api_error(error):
+    return respond({'error': error.message}, error.status)
+
+
+@api.before_request
+def require_login():
+    if not g.user:
+        raise APIError(401, 'Log in first.')
+
+
+def fields(allowed):
+    """Fields asked for with ?fields=, or all of `allowed`."""
+
+    asked = request.args.get('fields')
+    if not asked:
+        return allowed
+
+    asked = asked.split(',')
+    unknown = [name for name in asked if name not in allowed]
+    if unknown:
+        raise APIError(400, f"Unknown fields: {', '.join(unknown)}")
+
+    return asked
+
+
+def cursor():
+    try:
+        return decode_cursor(request.args.get('before'))
+    except ValueError:
+        raise APIError(400, 'Bad cursor.')
+
+
+def message_json(msg, names, liked):
+    values = {
+        'id': lambda: msg.id,
+        'text': lambda: msg.text,
+        'timestamp': lambda: msg.timestamp.isoformat(),
+        'author': lambda: {name: getattr(msg.user, name) for name in AUTHOR_FIELDS},
+        'likes_count': lambda: msg.likes_count,
+        'liked': lambda: msg.id in liked,
+    }
+    return {name: values[name]() for name in names}
+
+
+def user_json(user, names, followed):
+    data = {name: getattr(user, name) for name in names if name != 'is_following'}
+
+    if 'is_following' in names:
+        data['is_following'] = user.id in followed
+
+    return data
+
+
+def message_page(fetch):
+    """Page of messages from `fetch(limit, before)`, as JSON."""
+
+    names = fields(MESSAGE_FIELDS)
+    per_page = current_app.config['MESSAGES_PER_PAGE']
+
+    messages, older = split_page(fetch(per_page + 1, cursor()), per_page,
+                                 lambda msg: (msg.timestamp, msg.id))
+    liked = g.user.liked_ids(messages) if 'liked' in names else set()
+
+    return respond({
+        'messages': [message_json(msg, names, liked) for msg in messages],
+        'next': older,
+    })
+
+
+def user_page(fetch):
+    """Page of users from `fetch(limit, before, columns)`, as JSON."""
+
+    names = fields(USER_FIELDS)
+    per_page = current_app.config['USERS_PER_PAGE']
+
+    before = request.args.get('before')
+    if before and not before.isdigit():
+        raise APIError(400, 'Bad cursor.')
+
+    # only the columns asked for
+    columns = ['id'] + [name for name in names if name not in ('id', 'is_following')]
+
+    users = fetch(per_page + 1, int(before) if before else None, columns)
+    more = len(users) > per_page
+    users = users[:per_page]
+
+    followed = (g.user.following_among([user.id for user in users])
+                if 'is_following' in names else set())
+
+    return respond({
+        'users': [user_json(user, names, followed) for user in users],
+        'next': str(users[-1].id) if more else None,
+    })
+
+
+def get_user(user_id):
+    user = User.active().filter(User.id == user_id).first()
+    if user is None:
+        raise APIError(404, 'No such user.')
+    return user
+
+
+@api.route('/timeline')
+def home_timeline():
+    return message_page(
+        lambda limit, before: timeline.home_timeline(g.user, limit, before))
+
+
+@api.route('/users/<int:user_id>')
+def user_profile(user_id):
+    user = get_user(user_id)
+    followed = g.user.following_among([user.id])
+
+    return respond(user_json(user, fields(USER_FIELDS), followed))
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    user = get_user(user_id)
+
+    return message_page(
+        lambda limit, before: timeline.user_messages(user.id, limit, before))
+
+
+@api.route('/users/<int:user_id>/followers')
+def followers(user_id):
+    user = get_user(user_id)
+
+    return user_page(user.followers_page)
+
+
+@api.route('/users/<int:user_id>/following')
+def following(user_id):
+    user = get_user(user_id)
+
+    return user_page(user.following_page)
+
+
+@api.route('/messages/trending')
+def trending_messages():
+    names = fields(MESSAGE_FIELDS)
+    messages = trending.board.messages(current_app.config['TRENDING_COUNT'])
+    liked = g.user.liked_ids(messages) if 'liked' in names else set()
+
+    # the whole board is one page
+    return respond({
+        'messages': [message_json(msg, names, liked) for msg in messages],
+        'next': None,
+    })
+
+
+@api.route('/messages/<int:message_id>/like', methods=['POST'])
+def toggle_like(message_id):
+    try:
+        liked = likes.toggle(g.user, message_id)
+    except likes.LikeError as error:
+        raise APIError(error.status, error.message)
+
+    likes_count = (db.session
+                   .query(Message.likes_count)
+                   .filter(Message.id == message_id)
+                   .scalar())
+
+    return respond({'liked': liked, 'likes_count': likes_count})
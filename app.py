@@ -1,11 +1,31 @@
+import hmac
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, Response, render_template, request, flash, redirect, session,
+                   g, abort, jsonify, get_flashed_messages, stream_with_context)
 from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
-
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+import caching
+import dbpool
+import fragments
+import identity
+import jobs
+import likes
+import migrations
+import routing
+import purge
+import recommend
+import search
+import sqlstats
+import tasks  # registers the background tasks
+import timeline
+import trending
+from api import api
+from pagination import decode_cursor, split_page
 from forms import UserAddForm, LoginForm, MessageForm, EditUser
-from models import db, connect_db, User, Message
+from models import db, connect_db, AccountPurge, User, Message, Likes
 
 CURR_USER_KEY = "curr_user"
 
@@ -20,9 +40,154 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Home timelines are precomputed when messages are posted (see timeline.py).
+# Authors with more followers than the fan-out limit are merged in at read
+# time instead of being copied onto every follower's timeline. Who counts
+# as one is updated, and timelines trimmed, every TIMELINE_MAINTAIN_SECONDS.
+app.config['TIMELINE_MAX_LENGTH'] = int(
+    os.environ.get('TIMELINE_MAX_LENGTH', 800))
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+app.config['CELEBRITY_CACHE_SECONDS'] = int(
+    os.environ.get('CELEBRITY_CACHE_SECONDS', 300))
+app.config['TIMELINE_MAINTAIN_SECONDS'] = int(
+    os.environ.get('TIMELINE_MAINTAIN_SECONDS', 3600))
+
+# Number of messages per page on the home timeline and user profiles.
+app.config['MESSAGES_PER_PAGE'] = int(
+    os.environ.get('MESSAGES_PER_PAGE', 100))
+
+# bcrypt work factor, and how many processes hash passwords (0 hashes in
+# the request thread). See passwords.py.
+app.config['BCRYPT_LOG_ROUNDS'] = int(
+    os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', max((os.cpu_count() or 2) // 2, 1)))
+
+# Part of every page's ETag (see caching.py), so pages cached before a
+# deploy aren't answered with 304s after it. Unset, a hash of the
+# templates and static files is used.
+app.config['BUILD_VERSION'] = os.environ.get('BUILD_VERSION')
+
+# Number of users per page in lists of followers and following.
+app.config['USERS_PER_PAGE'] = int(
+    os.environ.get('USERS_PER_PAGE', 100))
+
+# Number of results per page when searching users and messages.
+app.config['SEARCH_PER_PAGE'] = int(
+    os.environ.get('SEARCH_PER_PAGE', 50))
+
+# How long the logged-in user's row is cached between requests, and how
+# many users to keep (see identity.py).
+app.config['USER_CACHE_SECONDS'] = int(
+    os.environ.get('USER_CACHE_SECONDS', 30))
+app.config['USER_CACHE_SIZE'] = int(
+    os.environ.get('USER_CACHE_SIZE', 10000))
+
+# Per-request SQL statistics (see sqlstats.py): sent as response headers
+# outside production, and in strict mode a request running the same
+# statement SQL_REPEAT_LIMIT or more times is logged as an N+1 query.
+app.config['SQL_STATS_HEADERS'] = app.env != 'production'
+app.config['SQL_STRICT'] = bool(os.environ.get('SQL_STRICT'))
+app.config['SQL_REPEAT_LIMIT'] = int(
+    os.environ.get('SQL_REPEAT_LIMIT', 3))
+
+# /metrics shows SQL text and other internals. Outside production it's
+# open; in production it needs `Authorization: Bearer <METRICS_TOKEN>`,
+# and without a METRICS_TOKEN it isn't served at all.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+# Rendered message items and user cards are cached per process, up to
+# this many characters of HTML (see fragments.py).
+app.config['FRAGMENT_CACHE_BYTES'] = int(
+    os.environ.get('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Database connection pool (see dbpool.py). Each process opens up to
+# DB_POOL_SIZE + DB_MAX_OVERFLOW connections, waits up to DB_POOL_TIMEOUT
+# seconds for a free one, and replaces them after DB_POOL_RECYCLE seconds.
+# DB_STATEMENT_TIMEOUT_MS cancels slow statements on PostgreSQL (0 is off).
+app.config['DB_POOL_SIZE'] = int(
+    os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_MAX_OVERFLOW'] = int(
+    os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(
+    os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(
+    os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+app.config['DB_STATEMENT_TIMEOUT_MS'] = int(
+    os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dbpool.engine_options(app.config)
+
+# Read replicas, as a comma-separated list of URLs. GET requests read from
+# one of them, except for REPLICA_LAG_SECONDS after the browser last wrote
+# something, so people see their own changes (see routing.py).
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{n}': url for n, url in enumerate(
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url)
+}
+app.config['REPLICA_LAG_SECONDS'] = int(
+    os.environ.get('REPLICA_LAG_SECONDS', 5))
+
+# Background jobs (see jobs.py): timeline fan-out and the like run after
+# the request commits, in JOBS_WORKERS threads ('thread'), from the `jobs`
+# table ('durable'), or straight away ('inline').
+app.config['JOBS_MODE'] = os.environ.get('JOBS_MODE', 'thread')
+app.config['JOBS_WORKERS'] = int(
+    os.environ.get('JOBS_WORKERS', 4))
+app.config['JOBS_MAX_ATTEMPTS'] = int(
+    os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+
+# Deleted accounts are purged PURGE_BATCH_SIZE rows per transaction, for
+# up to PURGE_JOB_SECONDS per job before handing over to a new one (see
+# purge.py).
+app.config['PURGE_BATCH_SIZE'] = int(
+    os.environ.get('PURGE_BATCH_SIZE', 1000))
+app.config['PURGE_JOB_SECONDS'] = int(
+    os.environ.get('PURGE_JOB_SECONDS', 30))
+
+# "Who to follow" on the home page (see recommend.py): RECOMMEND_COUNT
+# users, cached per user for RECOMMEND_CACHE_SECONDS, for up to
+# RECOMMEND_CACHE_SIZE users, from a copy of the follow graph reloaded
+# every RECOMMEND_GRAPH_SECONDS.
+app.config['RECOMMEND_COUNT'] = int(
+    os.environ.get('RECOMMEND_COUNT', 5))
+app.config['RECOMMEND_CACHE_SECONDS'] = int(
+    os.environ.get('RECOMMEND_CACHE_SECONDS', 600))
+app.config['RECOMMEND_CACHE_SIZE'] = int(
+    os.environ.get('RECOMMEND_CACHE_SIZE', 10000))
+app.config['RECOMMEND_GRAPH_SECONDS'] = int(
+    os.environ.get('RECOMMEND_GRAPH_SECONDS', 3600))
+
+# Trending messages (see trending.py): the top TRENDING_COUNT by likes,
+# each worth half as much every TRENDING_HALF_LIFE_SECONDS. The board is
+# kept in memory, up to TRENDING_SIZE messages, and rebuilt from the last
+# TRENDING_WINDOW_SECONDS of likes and messages every
+# TRENDING_REBUILD_SECONDS.
+app.config['TRENDING_COUNT'] = int(
+    os.environ.get('TRENDING_COUNT', 50))
+app.config['TRENDING_SIZE'] = int(
+    os.environ.get('TRENDING_SIZE', 10000))
+app.config['TRENDING_HALF_LIFE_SECONDS'] = int(
+    os.environ.get('TRENDING_HALF_LIFE_SECONDS', 6 * 3600))
+app.config['TRENDING_WINDOW_SECONDS'] = int(
+    os.environ.get('TRENDING_WINDOW_SECONDS', 48 * 3600))
+app.config['TRENDING_REBUILD_SECONDS'] = int(
+    os.environ.get('TRENDING_REBUILD_SECONDS', 600))
+
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+routing.init_app(app)
+sqlstats.init_app(app)
+fragments.init_app(app)
+caching.init_app(app)
+jobs.init_app(app)
+recommend.init_app(app)
+trending.init_app(app)
+
+app.register_blueprint(api, url_prefix='/api/v1')
 
 
 ##############################################################################
@@ -31,15 +196,107 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    Static files never need the user, so they skip the lookup.
+    """
+
+    if CURR_USER_KEY in session and request.endpoint != 'static':
+        g.user = identity.get_user(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def viewer_state(user):
+    """What a page about `user` shows that depends on who's looking: the
+    logged-in user (in the navbar) and whether they follow `user`."""
+
+    if not g.user:
+        return None, None, None
+
+    return g.user.id, g.user.version, g.user.is_following(user)
+
+
+def message_page(fetch):
+    """Get one page of messages, older than the `before` query parameter.
+
+    `fetch(limit, before)` returns messages newest first; we ask it for one
+    more than a page so we know whether to link to older messages.
+    Returns (messages, cursor for the next page).
+    """
+
+    try:
+        before = decode_cursor(request.args.get('before'))
+    except ValueError:
+        abort(400)
+
+    per_page = app.config['MESSAGES_PER_PAGE']
+    messages = fetch(per_page + 1, before)
+
+    return split_page(messages, per_page, lambda msg: (msg.timestamp, msg.id))
+
+
+def follow_page(fetch):
+    """One page of a followers or following list, before the `before`
+    query parameter (a user id).
+
+    `fetch(limit, before)` returns users by id, highest first. Returns
+    template context: the `users`, which of them the viewer `followed`,
+    and `older`, the cursor for the next page.
+    """
+
+    before = request.args.get('before', type=int)
+    per_page = app.config['USERS_PER_PAGE']
+
+    users = fetch(per_page + 1, before)
+    older = users[per_page - 1].id if len(users) > per_page else None
+    users = users[:per_page]
+
+    return {
+        'users': users,
+        'followed': g.user.following_among([user.id for user in users]),
+        'older': older,
+    }
+
+
+def stream_template(template_name, **context):
+    """Like `render_template`, but send the page while it renders.
+
+    The layout goes out straight away and list items as they're rendered,
+    so `context` can hold a streaming query rather than a list.
+    """
+
+    # The session is saved before the body is generated, so take any
+    # flashed messages out of it now (they're kept for the template).
+    get_flashed_messages()
+
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+
+    # send a few dozen template pieces at a time, not each tiny string
+    stream.enable_buffering(50)
+
+    return Response(stream_with_context(stream))
+
+
+def search_page(find, text):
+    """Get the page of search results asked for by the `page` parameter.
+
+    Returns (results, number of the next page or None).
+    """
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = app.config['SEARCH_PER_PAGE']
+
+    results = find(text, per_page + 1, (page - 1) * per_page)
+
+    if len(results) > per_page:
+        return results[:per_page], page + 1
+
+    return results, None
+
+
 def do_login(user):
     """Log in user."""
 
@@ -76,6 +333,7 @@ def signup():
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
             db.session.commit()
+            search.index_user(user)
 
         except IntegrityError:
             flash("Username already taken", 'danger')
@@ -100,6 +358,9 @@ def login():
                                  form.password.data)
 
         if user:
+            # saves the password if authenticate rehashed it
+            db.session.commit()
+
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -125,35 +386,54 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames and bios, and
+    a 'page' param to page through the results.
     """
 
-    search = request.args.get('q')
+    text = request.args.get('q')
+    more = None
 
-    if not search:
-        users = User.query.all()
+    if not text:
+        # rows come from a server-side cursor as the page renders
+        users = User.active().order_by(User.id).yield_per(100)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users, more = search_page(search.search_users, text)
+
+    if g.user:
+        g.user.following_ids()
 
-    return render_template('users/index.html', users=users)
+    return stream_template('users/index.html', users=users, q=text, more=more)
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.active().filter_by(id=user_id).first_or_404()
+
+    # The page changes when the profile or its counts do, or when a
+    # message is posted and another deleted (the newest one changes).
+    newest = (db.session
+              .query(Message.id)
+              .filter(Message.user_id == user_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(1)
+              .scalar())
 
-    # snagging messages in order from the database;
-    # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    likes = [message.id for message in user.likes]
-    return render_template('users/show.html', user=user, messages=messages, likes=likes)
+    tag = caching.etag(
+        user.id, user.version, user.messages_count, user.following_count,
+        user.followers_count, user.likes_count, newest, *viewer_state(user))
+
+    def render():
+        # snagging messages in order from the database;
+        # user.messages won't be in order by default
+        messages, older = message_page(
+            lambda limit, before: timeline.user_messages(user_id, limit, before))
+
+        return render_template('users/show.html', user=user, messages=messages,
+                               older=older)
+
+    return caching.conditional(tag, render)
 
 
 @app.route('/users/<int:user_id>/following')
@@ -164,8 +444,9 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    return render_template('users/following.html', user=user,
+                           **follow_page(user.following_page))
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -176,8 +457,9 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.active().filter_by(id=user_id).first_or_404()
+    return render_template('users/followers.html', user=user,
+                           **follow_page(user.followers_page))
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -188,9 +470,19 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
+    # following yourself would put your messages on your timeline twice
+    if follow_id == g.user.id:
+        abort(403)
+
+    followed_user = User.active().filter_by(id=follow_id).first_or_404()
     g.user.following.append(followed_user)
+    User.adjust_counts(g.user.id, following_count=1)
+    User.adjust_counts(followed_user.id, followers_count=1)
     db.session.commit()
+    identity.forget(g.user.id)
+    identity.forget(followed_user.id)
+    recommend.recommender.followed(g.user.id, followed_user.id)
+    jobs.enqueue('backfill', user_id=g.user.id, author_id=followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -205,7 +497,13 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    User.adjust_counts(g.user.id, following_count=-1)
+    User.adjust_counts(followed_user.id, followers_count=-1)
     db.session.commit()
+    identity.forget(g.user.id)
+    identity.forget(followed_user.id)
+    recommend.recommender.unfollowed(g.user.id, followed_user.id)
+    jobs.enqueue('remove_author', user_id=g.user.id, author_id=followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -217,8 +515,11 @@ def show_user_likes(user_id):
         flash('Access unauthorized.', 'danger')
         return redirect('/')
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, likes=user.likes)
+    user = User.active().filter_by(id=user_id).first_or_404()
+
+    likes = Message.liked_by(user_id).all()
+
+    return render_template('users/likes.html', user=user, likes=likes)
 
 
 @app.route('/users/add_like/<int:message_id>', methods=['POST'])
@@ -229,18 +530,10 @@ def toggle_like(message_id):
         flash('Access unauthorized', 'danger')
         return redirect('/')
 
-    liked_message = Message.query.get_or_404(message_id)
-    if liked_message.user_id == g.user.id:
-        return abort(403)
-
-    user_likes = g.user.likes
-
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
-    else:
-        g.user.likes.append(liked_message)
-
-    db.session.commit()
+    try:
+        likes.toggle(g.user, message_id)
+    except likes.LikeError as error:
+        abort(error.status)
 
     return redirect('/')
 
@@ -263,8 +556,12 @@ def profile():
             user.image_url = form.image_url.data or "/static/images/default-pic.png"
             user.header_image_url = form.header_image_url.data or "/static/images/warbler-hero.jpg"
             user.bio = form.bio.data
+            user.version = User.version + 1
 
             db.session.commit()
+            identity.forget(user.id)
+            fragments.forget_user(user.id)
+            search.index_user(user)
             return redirect(f"/users/{user.id}")
 
         flash("Incorrect password, please try again.", 'danger')
@@ -282,8 +579,12 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    purge.tombstone(g.user)
     db.session.commit()
+    identity.forget(g.user.id)
+    fragments.forget_user(g.user.id)
+    search.forget_user(g.user.id)
+    jobs.enqueue('purge_user', key=f'purge_user:{g.user.id}', user_id=g.user.id)
 
     return redirect("/signup")
 
@@ -307,19 +608,51 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        User.adjust_counts(g.user.id, messages_count=1)
         db.session.commit()
+        identity.forget(g.user.id)
+        search.index_message(msg)
+        trending.board.posted(msg.id)
+        jobs.enqueue('fan_out', key=f'fan_out:{msg.id}', message_id=msg.id)
+        timeline.schedule_maintenance()
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search messages by the words in the 'q' querystring param."""
+
+    text = request.args.get('q', '')
+    messages, more = search_page(search.search_messages, text)
+
+    return render_template('messages/search.html', messages=messages, q=text,
+                           more=more)
+
+
+@app.route('/messages/trending')
+def messages_trending():
+    """Show the messages most liked lately."""
+
+    messages = trending.board.messages(app.config['TRENDING_COUNT'])
+
+    return render_template('messages/trending.html', messages=messages)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message.visible()
+           .filter(Message.id == message_id)
+           .first_or_404())
+
+    tag = caching.etag(msg.id, msg.user.version, *viewer_state(msg.user))
+
+    return caching.conditional(
+        tag, lambda: render_template('messages/show.html', message=msg))
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -331,9 +664,23 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+
+    likers = [user_id for user_id, in db.session
+              .query(Likes.user_id)
+              .filter(Likes.message_id == msg.id)]
+    User.adjust_counts(likers, likes_count=-1)
+    User.adjust_counts(msg.user_id, messages_count=-1)
+    fragments.forget_message(msg.id)
+    search.forget_message(msg.id)
+    trending.board.forget(msg.id)
+
     db.session.delete(msg)
     db.session.commit()
 
+    # their cached like counts, and the author's message count, are stale
+    for user_id in [msg.user_id] + likers:
+        identity.forget(user_id)
+
     return redirect(f"/users/{g.user.id}")
 
 
@@ -346,22 +693,18 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: a page of the most recent messages of followed_users
     """
 
     if g.user:
-        following_users = [u.id for u in g.user.following] + [g.user.id]
+        messages, older = message_page(
+            lambda limit, before: timeline.home_timeline(g.user, limit, before))
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_users))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        liked_msgs = g.user.liked_ids(messages)
 
-        liked_msgs = [msg.id for msg in g.user.likes]
-
-        return render_template('home.html', messages=messages, likes=liked_msgs)
+        return stream_template('home.html', messages=messages, likes=liked_msgs,
+                               older=older,
+                               suggestions=recommend.recommender.suggestions(g.user))
 
     else:
         return render_template('home-anon.html')
@@ -374,18 +717,172 @@ def page_not_found(e):
     return render_template('404.html'), 404
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Metrics
+
+
+@app.route('/metrics')
+def metrics():
+    """Statistics gathered since startup, as JSON."""
+
+    token = app.config['METRICS_TOKEN']
+
+    if token:
+        given = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(given.encode(), f'Bearer {token}'.encode()):
+            abort(404)
+    elif app.env == 'production':
+        abort(404)
+
+    return jsonify(sql=sqlstats.summary(), fragments=fragments.cache.stats(),
+                   db_pool={name: dbpool.status(engine)
+                            for name, engine in routing.engines(app).items()},
+                   jobs=jobs.queue.stats(), purges=purge.status(),
+                   recommend=recommend.recommender.stats(),
+                   trending=trending.board.stats())
+
+
+@app.route('/health/ready')
+def ready():
+    """Whether the primary and replica databases answer, with the state of
+    their connection pools.
+
+    503 if any doesn't, so a load balancer stops sending requests here.
+    """
+
+    pools = {}
+    errors = {}
+
+    for name, engine in routing.engines(app).items():
+        try:
+            engine.execute('SELECT 1')
+        except SQLAlchemyError as e:
+            errors[name] = str(e).splitlines()[0]
+
+        pools[name] = dbpool.status(engine)
+
+    if errors:
+        return jsonify(ready=False, errors=errors, db_pool=pools), 503
+
+    return jsonify(ready=True, db_pool=pools)
+
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply pending schema migrations."""
+
+    if not migrations.upgrade(db.engine, click.echo):
+        click.echo("Already up to date.")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List schema migrations and whether each has been applied."""
+
+    done = migrations.applied(db.engine)
+
+    for name in migrations.available():
+        click.echo(f"{'applied' if name in done else 'pending'}  {name}")
+
+
+@app.cli.command('explain-hot-queries')
+def explain_hot_queries():
+    """Show query plans for the hot queries; fail if any scan a table."""
+
+    from migrations import explain
+
+    scanned = False
+
+    for name, plan, scans in explain.check():
+        click.echo(f"{name}: {'TABLE SCAN' if scans else 'ok'}")
+        for line in plan:
+            click.echo(f"    {line}")
+        scanned = scanned or bool(scans)
+
+    if scanned:
+        raise SystemExit(1)
+
+
+@app.cli.command('reconcile-counts')
+def reconcile_counts():
+    """Recompute user counters that have drifted from the real counts."""
+
+    drifted = User.reconcile_counts()
+    drifted_messages = Message.reconcile_counts()
+    db.session.commit()
+
+    click.echo(f"Fixed counts for {drifted} users and {drifted_messages} messages.")
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every user's home timeline (e.g. after seeding)."""
+
+    for user_id, in db.session.query(User.id).all():
+        timeline.rebuild(user_id)
+
+    db.session.commit()
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Cut home timelines back to TIMELINE_MAX_LENGTH entries."""
+
+    removed = timeline.trim()
+    db.session.commit()
+
+    click.echo(f"Removed {removed} timeline entries.")
+
+
+@app.cli.command('update-celebrities')
+def update_celebrities():
+    """Mark and unmark authors as celebrities by their follower counts."""
+
+    marked, unmarked = timeline.update_celebrities()
+    db.session.commit()
+
+    click.echo(f"Marked {marked} celebrities; unmarked {unmarked}.")
+
+
+@app.cli.command('purge-accounts')
+def purge_accounts():
+    """Finish purging deleted accounts, e.g. after an interruption."""
+
+    for progress in purge.unfinished():
+        user_id = progress.user_id
+        while purge.purge_batch(user_id, app.config['PURGE_BATCH_SIZE']):
+            pass
+
+        click.echo(f"Purged user {user_id}: "
+                   f"{AccountPurge.query.get(user_id).rows_deleted} rows.")
+
+
+@app.cli.command('run-jobs')
+def run_jobs():
+    """Run the due jobs in the durable queue, until none are left, then
+    delete old done ones."""
+
+    ran = 0
+    while jobs.queue.work_one():
+        ran += 1
+
+    click.echo(f"Ran {ran} jobs; deleted {jobs.queue.prune()} old ones.")
+
+##############################################################################
+# Turn off caching for pages that don't say how to cache themselves
+#   (static files and pages with ETags do; see caching.py)
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to responses without a Cache-Control."""
+
+    if 'Cache-Control' not in req.headers:
+        req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        req.headers["Pragma"] = "no-cache"
+        req.headers["Expires"] = "0"
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
     return req
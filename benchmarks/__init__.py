@@ -0,0 +1,7 @@
+"""Benchmarks for Warbler.
+
+Run these from the project root, e.g.:
+
+    python -m benchmarks.bench_passwords
+    python -m benchmarks.bench_routes
+"""
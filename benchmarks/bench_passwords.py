@@ -0,0 +1,64 @@
+"""Benchmark password checks (logins) per second.
+
+    python -m benchmarks.bench_passwords --rounds 12 --workers 1 2 4
+
+For each worker count, runs a burst of checks through a PasswordHasher
+from several client threads (like concurrent login requests) and reports
+logins/sec overall and per core used.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passwords import PasswordHasher
+
+
+def run(workers, rounds, logins, clients):
+    """Time `logins` checks from `clients` threads; returns logins/sec."""
+
+    hasher = PasswordHasher(workers=workers, rounds=rounds)
+    hashed = hasher.hash('hunter22')
+
+    # warm up the worker processes so startup isn't timed
+    list(ThreadPoolExecutor(clients).map(
+        lambda _: hasher.check(hashed, 'hunter22'), range(max(workers, 1))))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda _: hasher.check(hashed, 'hunter22'),
+                                range(logins)))
+    elapsed = time.perf_counter() - start
+
+    hasher.shutdown()
+    assert all(results)
+
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=12,
+                        help='bcrypt work factor (BCRYPT_LOG_ROUNDS)')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[0, 1, os.cpu_count() or 1],
+                        help='worker process counts to try (0 = inline)')
+    parser.add_argument('--logins', type=int, default=50,
+                        help='checks per run')
+    parser.add_argument('--clients', type=int, default=16,
+                        help='concurrent client threads')
+    args = parser.parse_args()
+
+    print(f"bcrypt rounds={args.rounds}, {args.logins} logins, "
+          f"{args.clients} clients, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'logins/sec':>12} {'per core':>10}")
+
+    for workers in args.workers:
+        rate = run(workers, args.rounds, args.logins, args.clients)
+        cores = min(max(workers, 1), os.cpu_count() or 1)
+        print(f"{workers:>8} {rate:>12.1f} {rate / cores:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
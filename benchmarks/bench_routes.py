@@ -0,0 +1,283 @@
+"""Benchmark the busiest pages end to end.
+
+    python -m benchmarks.bench_routes --preset small --requests 2000
+    python -m benchmarks.bench_routes --save before.json
+    python -m benchmarks.bench_routes --no-seed --baseline before.json
+
+Seeds a database (BENCH_DATABASE_URL, default postgresql:///warbler-bench)
+from the sample-data generator, then drives a mix of requests from
+logged-in users through the Flask test client:
+
+    GET  /                        home timeline
+    GET  /users                   user list
+    GET  /users/<id>              profile
+    POST /messages/new            post a message
+    POST /users/add_like/<id>     like or unlike
+
+For each route it reports requests/sec, p50/p95/p99 latency and SQL
+statements per request. A request is timed until its whole body has been
+read, as streamed pages render while they're read. --save writes the results as JSON; --baseline
+compares this run against a saved one.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# (route, share of requests)
+MIX = [
+    ('GET /', 0.5),
+    ('GET /users', 0.1),
+    ('GET /users/<id>', 0.2),
+    ('POST /messages/new', 0.1),
+    ('POST /users/add_like/<id>', 0.1),
+]
+
+_local = threading.local()
+
+
+def count_statements(engine):
+    """Count SQL statements per thread in `_local.statements`."""
+
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, parameters, context, executemany):
+        _local.statements = getattr(_local, 'statements', 0) + 1
+
+
+def seed(preset, seed_value):
+    """Generate a `preset` dataset and load it into the benchmark database."""
+
+    from app import app, db
+    import loader
+    import migrations
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, 'generator/create_csvs.py',
+                        '--preset', preset, '--seed', str(seed_value),
+                        '--out', directory], check=True)
+
+        migrations.reset(db.engine, report=lambda line: None)
+
+        with app.app_context():
+            loader.load(directory, report=lambda line: None)
+
+
+def plan(rng, count):
+    """`count` (route, viewer id, target id) requests in a realistic mix."""
+
+    from models import db, User, Message
+
+    # active users (those following many) browse the most
+    viewers, weights = zip(*db.session.query(User.id, User.following_count + 1))
+    weights = np.array(weights, dtype=float)
+    viewers = rng.choice(viewers, count, p=weights / weights.sum())
+
+    recent = (db.session
+              .query(Message.id, Message.user_id)
+              .order_by(Message.id.desc())
+              .limit(10000)
+              .all())
+    routes = [route for route, _ in MIX]
+    shares = np.array([share for _, share in MIX])
+    picks = rng.choice(len(routes), count, p=shares / shares.sum())
+
+    requests = []
+
+    for viewer, pick in zip(viewers.tolist(), picks.tolist()):
+        route = routes[pick]
+
+        if route == 'GET /users/<id>':
+            target = int(rng.choice(viewers))
+        elif route == 'POST /users/add_like/<id>':
+            # you can't like your own messages
+            target = next(message_id for message_id, author in
+                          (recent[i] for i in rng.integers(0, len(recent), 20))
+                          if author != viewer)
+        else:
+            target = None
+
+        requests.append((route, viewer, target))
+
+    db.session.remove()
+    return requests
+
+
+def send(client, route, target, serial):
+    """Send one request, read its body and close it."""
+
+    method, path = route.split(' ')
+    path = path.replace('<id>', str(target))
+
+    if method == 'GET':
+        resp = client.get(path)
+    else:
+        resp = client.post(path, data={'text': f'Benchmark message {serial}'})
+
+    # a streamed page's template renders as the body is read, and its
+    # queries are finished off when it's closed
+    resp.get_data()
+    resp.close()
+    return resp
+
+
+def run(requests, clients):
+    """Send `requests` from `clients` threads; returns per-route samples."""
+
+    from app import app, CURR_USER_KEY
+
+    samples = {route: [] for route, _ in MIX}
+    lock = threading.Lock()
+
+    def worker(batch):
+        client = app.test_client()
+        mine = []
+
+        for serial, (route, viewer, target) in batch:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer
+
+            _local.statements = 0
+            start = time.perf_counter()
+            resp = send(client, route, target, serial)
+            elapsed = time.perf_counter() - start
+
+            assert resp.status_code < 400, (route, resp.status_code)
+            mine.append((route, elapsed, _local.statements))
+
+        with lock:
+            for route, elapsed, statements in mine:
+                samples[route].append((elapsed, statements))
+
+    numbered = list(enumerate(requests))
+    batches = [numbered[i::clients] for i in range(clients)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(worker, batches))
+    elapsed = time.perf_counter() - start
+
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles (ms) and SQL per request by route."""
+
+    results = {}
+    everything = []
+
+    for route, rows in samples.items():
+        everything += rows
+        if rows:
+            results[route] = _stats(rows, elapsed)
+
+    results['all'] = _stats(everything, elapsed)
+    return results
+
+
+def _stats(rows, elapsed):
+    latencies = np.array([latency for latency, _ in rows]) * 1000
+    statements = np.array([count for _, count in rows])
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+
+    return {
+        'requests': len(rows),
+        'requests_per_sec': round(len(rows) / elapsed, 1),
+        'p50_ms': round(p50, 2),
+        'p95_ms': round(p95, 2),
+        'p99_ms': round(p99, 2),
+        'sql_per_request': round(float(statements.mean()), 2),
+        'sql_max': int(statements.max()),
+    }
+
+
+def report(results, baseline=None):
+    print(f"{'route':<28} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'SQL/req':>8}")
+
+    for route, stats in results.items():
+        print(f"{route:<28} {stats['requests_per_sec']:>8.1f} "
+              f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+              f"{stats['p99_ms']:>8.2f} {stats['sql_per_request']:>8.2f}")
+
+        before = (baseline or {}).get(route)
+        if before:
+            print(f"{'  vs baseline':<28} "
+                  + ' '.join(f"{_change(before[key], stats[key]):>8}"
+                             for key in ('requests_per_sec', 'p50_ms', 'p95_ms',
+                                         'p99_ms', 'sql_per_request')))
+
+
+def _change(before, after):
+    if not before:
+        return '-'
+
+    return f"{(after - before) / before:+.0%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--preset', default='small',
+                        help='generator preset to seed (see generator/create_csvs.py)')
+    parser.add_argument('--no-seed', action='store_true',
+                        help='reuse the data already in the benchmark database')
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='timed requests')
+    parser.add_argument('--warmup', type=int, default=100,
+                        help='untimed requests sent first')
+    parser.add_argument('--clients', type=int, default=1,
+                        help='concurrent client threads')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='FILE', help='write results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare against results saved with --save')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = os.environ.get(
+        'BENCH_DATABASE_URL', 'postgresql:///warbler-bench')
+
+    from app import app, db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+    count_statements(db.engine)
+
+    if not args.no_seed:
+        seed(args.preset, args.seed)
+
+    rng = np.random.default_rng(args.seed)
+    warmup = plan(rng, args.warmup)
+    timed = plan(rng, args.requests)
+
+    run(warmup, args.clients)
+    results = summarize(*run(timed, args.clients))
+
+    print(f"{args.requests} requests, {args.clients} clients, "
+          f"{db.engine.dialect.name}, preset {args.preset}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as saved:
+            baseline = json.load(saved)['results']
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as out:
+            json.dump({
+                'config': {key: getattr(args, key) for key in
+                           ('preset', 'requests', 'warmup', 'clients', 'seed')},
+                'database': db.engine.dialect.name,
+                'results': results,
+            }, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""HTTP caching: fingerprinted static files and conditional GETs.
+
+`url_for('static', ...)` adds a `v=` fingerprint of the file's contents,
+so a changed file gets a new URL. Requests carrying the current
+fingerprint are served as immutable for a year; anything else (such as
+the default profile images, whose paths are stored in the database)
+keeps Flask's usual short max-age and ETag.
+
+For pages, `conditional` sets an ETag computed from the versions of
+everything shown on the page, and answers a matching If-None-Match with
+304 Not Modified before the template is rendered. The ETag includes the
+build (BUILD_VERSION, or a hash of the templates and static files), so a
+deploy that changes how pages look doesn't keep answering 304.
+"""
+
+import hashlib
+import os
+
+from flask import current_app, make_response, request, session
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+_fingerprints = {}
+
+# hash of the templates and static files, worked out once per process
+_build = {}
+
+
+def fingerprint(filename):
+    """Short hash of static file `filename`'s contents (None if missing)."""
+
+    path = os.path.join(current_app.static_folder, filename)
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'rb') as static_file:
+        digest = hashlib.md5(static_file.read()).hexdigest()[:12]
+
+    _fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+def _add_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        digest = fingerprint(values['filename'])
+        if digest:
+            values['v'] = digest
+
+
+def _cache_static(response):
+    if (request.endpoint == 'static' and response.status_code == 200
+            and request.args.get('v')
+            and request.args['v'] == fingerprint(request.view_args['filename'])):
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+
+    return response
+
+
+def build_version():
+    """BUILD_VERSION, or if that isn't set a short hash of every template
+    and static file."""
+
+    version = current_app.config['BUILD_VERSION']
+    if version:
+        return version
+
+    if 'digest' not in _build:
+        digest = hashlib.md5()
+        folders = [os.path.join(current_app.root_path, current_app.template_folder),
+                   current_app.static_folder]
+
+        for folder in folders:
+            for directory, subdirectories, filenames in os.walk(folder):
+                subdirectories.sort()
+                for filename in sorted(filenames):
+                    path = os.path.join(directory, filename)
+                    digest.update(os.path.relpath(path, folder).encode('utf-8'))
+                    with open(path, 'rb') as built_file:
+                        digest.update(built_file.read())
+
+        _build['digest'] = digest.hexdigest()[:12]
+
+    return _build['digest']
+
+
+def etag(*parts):
+    """ETag for a page built from `parts` (ids, version stamps, counts),
+    in this build."""
+
+    return hashlib.sha1(repr((build_version(),) + parts).encode('utf-8')).hexdigest()
+
+
+def conditional(tag, render):
+    """Response for a page whose content is identified by `tag`.
+
+    If the browser already has that version, returns 304 without calling
+    `render`. Otherwise calls `render()` for the page. Pages showing
+    flashed messages aren't tagged, as the flashes aren't in `tag`.
+    """
+
+    if session.get('_flashes'):
+        return make_response(render())
+
+    if request.if_none_match.contains(tag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(render())
+
+    response.set_etag(tag)
+    # cache, but always check back; the page depends on who's logged in
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def init_app(app):
+    app.url_defaults(_add_fingerprint)
+    app.after_request(_cache_static)
@@ -0,0 +1,125 @@
+"""Database connection pool settings and statistics.
+
+`engine_options` turns the DB_* settings into SQLALCHEMY_ENGINE_OPTIONS:
+pool size and overflow, how long to wait for a free connection, when to
+recycle connections, whether to test them before use, and (on
+PostgreSQL) a per-statement timeout. SQLite gets none of these, as it
+doesn't use a queue pool.
+
+The pool is a QueuePool that also times how long each checkout takes,
+so `status()` can report connections checked out and idle alongside
+time spent waiting for one. Each process holds up to
+DB_POOL_SIZE + DB_MAX_OVERFLOW connections; size the number of workers
+so that adds up to less than the database's max_connections.
+"""
+
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+
+
+class WaitStats:
+    """How long checkouts from a pool have taken."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.timeouts += timed_out
+
+    def summary(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'seconds': round(self.seconds, 4),
+                'avg_ms': round(self.seconds * 1000 / self.checkouts, 3)
+                          if self.checkouts else 0.0,
+                'max_ms': round(self.max_seconds * 1000, 3),
+                'timeouts': self.timeouts,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool keeping WaitStats for its checkouts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = WaitStats()
+
+    def _timed(self, checkout):
+        start = time.perf_counter()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            self.waits.record(time.perf_counter() - start, timed_out=True)
+            raise
+
+        self.waits.record(time.perf_counter() - start)
+        return connection
+
+    def connect(self):
+        return self._timed(super().connect)
+
+    def unique_connection(self):
+        # what Engine.connect() uses on SQLAlchemy 1.3
+        return self._timed(super().unique_connection)
+
+    def recreate(self):
+        # keep counting across engine.dispose()
+        pool = super().recreate()
+        pool.waits = self.waits
+        return pool
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the DB_* settings in `config`."""
+
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite':
+        return {}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+    timeout = config['DB_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={timeout}'}
+
+    return options
+
+
+def status(engine):
+    """Connections checked out and idle in `engine`'s pool, and waits."""
+
+    pool = engine.pool
+    data = {'pool': type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        data.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+        })
+
+    if isinstance(pool, TimedQueuePool):
+        data['wait'] = pool.waits.summary()
+
+    return data
@@ -0,0 +1,141 @@
+"""Cache of rendered message items and user cards.
+
+Timelines, profiles and user lists render the same messages and users
+over and over. The HTML for each is cached here, keyed by message or user
+id and checked against a version stamp: a message item is stale once its
+author's `User.version` moves on (the author's name and picture are in
+it), and so is a user card. Profile edits bump the version; deleting a
+message or user drops its entry.
+
+Anything that depends on who is looking stays out of the cache. The like
+button goes after the cached message item. A user card is cached in two
+halves around the spot where the follow button goes, marked `HOLE` in
+users/_card.html.
+
+The cache is per process, least recently used first out, and capped at
+FRAGMENT_CACHE_BYTES characters of HTML.
+"""
+
+import threading
+from collections import OrderedDict, namedtuple
+
+from flask import render_template
+from markupsafe import Markup
+
+# where the viewer's own controls go in a cached fragment
+HOLE = '<!-- viewer -->'
+
+Fragment = namedtuple('Fragment', 'before after')
+
+
+class FragmentCache:
+    """LRU map of (kind, id) to a version stamp and a Fragment."""
+
+    def __init__(self, max_bytes=0):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, key, version):
+        """The Fragment cached for `key` at `version`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, fragment):
+        size = len(fragment.before) + len(fragment.after)
+
+        with self._lock:
+            self._remove(key)
+
+            if size > self.max_bytes:
+                return
+
+            while self.size + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+            self._entries[key] = (version, fragment)
+            self.size += size
+
+    def forget(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[1].before) + len(entry[1].after)
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+cache = FragmentCache()
+
+
+def _cached(kind, item_id, version, template, **context):
+    key = (kind, item_id)
+    fragment = cache.get(key, version)
+
+    if fragment is None:
+        before, _, after = render_template(template, **context).partition(HOLE)
+        fragment = Fragment(Markup(before), Markup(after))
+        cache.put(key, version, fragment)
+
+    return fragment
+
+
+def message_item(msg):
+    """Contents of the <li> for `msg` (author, date and text)."""
+
+    return _cached('message', msg.id, msg.user.version,
+                   'messages/_item.html', msg=msg).before
+
+
+def user_card(user):
+    """`user`'s card, as a Fragment split where the follow button goes."""
+
+    return _cached('user', user.id, user.version, 'users/_card.html', user=user)
+
+
+def forget_message(message_id):
+    """Drop a deleted message's item."""
+
+    cache.forget(('message', message_id))
+
+
+def forget_user(user_id):
+    """Drop a changed or deleted user's card.
+
+    Their messages' items are re-rendered anyway once `User.version`
+    moves on, so those are left to age out.
+    """
+
+    cache.forget(('user', user_id))
+
+
+def init_app(app):
+    """Size the cache from `app`'s config and make the helpers available
+    to its templates."""
+
+    cache.max_bytes = app.config.setdefault('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024)
+
+    app.add_template_global(message_item)
+    app.add_template_global(user_card)
@@ -3,75 +3,236 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+    python generator/create_csvs.py                      300 users, as checked in
+    python generator/create_csvs.py --preset large --out /tmp/warbler
+    python seed.py --data-dir /tmp/warbler
+
+Nothing is fetched over the network, and the same --seed always gives the
+same files. Rows are generated with NumPy and written CHUNK_SIZE at a time,
+so the biggest presets run in bounded memory:
+
+- who follows whom is a power-law graph: most users have a handful of
+  followers and a few have a large share of them;
+- how much users post, follow and like is heavy-tailed too;
+- message timestamps come in bursts rather than evenly spread;
+- likes lean towards recent messages.
+
+Users and messages are referred to by row number (the first user is 1),
+which is the id `seed.py` gives them.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import time
+
+import numpy as np
+
+from helpers import (bursty_timestamps, format_timestamps, power_law_weights,
+                     sentences, weighted_choice)
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
+
+PRESETS = {
+    'small': dict(users=300, messages=1000, follows=5000, likes=3000),
+    'medium': dict(users=10_000, messages=200_000, follows=500_000, likes=1_000_000),
+    'large': dict(users=100_000, messages=2_000_000, follows=5_000_000, likes=10_000_000),
+    'huge': dict(users=2_000_000, messages=10_000_000, follows=100_000_000, likes=50_000_000),
+}
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+CHUNK_SIZE = 100_000
 
-fake = Faker()
+# messages span the two years before this
+UNTIL = np.datetime64('2026-01-01')
+SPAN = np.timedelta64(730, 'D').astype('timedelta64[us]')
 
-# Generate random profile image URLs to use for users
+# every user shares this hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-image_urls = [
+HEADER_IMAGE_URL = '/static/images/warbler-hero.jpg'
+
+IMAGE_URLS = np.array([
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+])
+
+VOCABULARY = np.array("""
+    able about across after again against almost along already always among
+    answer around away back bird bring build call carry change city close cold
+    color come common could country cover cross dark deep different door down
+    draw drive early earth east easy enough even every face fact family field
+    fire first follow food forest free friend front full garden give good great
+    green ground group grow half hand happy hard head hear heart heavy help high
+    hold home hope hour house idea island keep kind land large late learn leave
+    light line little live long look love make many measure might morning mountain
+    move music name near never next night north note number ocean open order
+    other over paper part people picture place plan plant play point present
+    quick quiet rain reach read ready river road rock room round run school sea
+    season second seem short show side simple since sing small snow song sound
+    south space spring stand star start still stone story street strong summer
+    sun sure table take talk tell think through today together town tree true
+    turn under until upon valley very voice walk warm watch water west while
+    white whole wind window winter wonder wood word work world write year yellow
+    young
+""".split())
+
+PLACES = np.array("North South East West New Port Lake Fort Mount Glen".split())
+PLACE_ENDINGS = np.array("haven field ford burgh ville wood ton bridge view mouth".split())
+
+
+def write(path, headers, chunks):
+    """Write the rows from each chunk in `chunks` to a CSV at `path`."""
+
+    rows = 0
+    started = time.monotonic()
+
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(headers)
+
+        for columns in chunks:
+            writer.writerows(zip(*columns))
+            rows += len(columns[0])
+
+    print(f"{os.path.basename(path)}: {rows:,} rows in {time.monotonic() - started:.1f}s")
+
+
+def ranges(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def users(rng, num_users, chunk_size):
+    for start, stop in ranges(num_users, chunk_size):
+        n = stop - start
+        ids = np.arange(start + 1, stop + 1).astype(str)
+
+        usernames = np.char.add(VOCABULARY[rng.integers(0, len(VOCABULARY), n)], ids)
+        places = np.char.add(np.char.add(PLACES[rng.integers(0, len(PLACES), n)], ' '),
+                             np.char.capitalize(
+                                 VOCABULARY[rng.integers(0, len(VOCABULARY), n)]))
+        places = np.char.add(places, PLACE_ENDINGS[rng.integers(0, len(PLACE_ENDINGS), n)])
+
+        yield (np.char.add(usernames, '@example.com'),
+               usernames,
+               IMAGE_URLS[rng.integers(0, len(IMAGE_URLS), n)],
+               [PASSWORD] * n,
+               sentences(rng, VOCABULARY, n, 3, 12, MAX_WARBLER_LENGTH),
+               [HEADER_IMAGE_URL] * n,
+               places)
+
+
+def messages(rng, num_messages, posting, authors, chunk_size):
+    """Messages in time order: each chunk covers the next slice of time.
+
+    Each message's author is also stored in `authors` (message id - 1).
+    """
+
+    cumulative = np.cumsum(posting)
+    start = UNTIL - SPAN
+    step = SPAN / max(-(-num_messages // chunk_size), 1)
+
+    for index, (lo, hi) in enumerate(ranges(num_messages, chunk_size)):
+        n = hi - lo
+        stamps = bursty_timestamps(rng, n, start + index * step, start + (index + 1) * step)
+        texts = sentences(rng, VOCABULARY, n, 4, 24, MAX_WARBLER_LENGTH)
+        authors[lo:hi] = weighted_choice(rng, cumulative, n) + 1
+
+        yield texts, format_timestamps(stamps), authors[lo:hi]
+
+
+def pairs(rng, activity, total, targets, chunk_size):
+    """(actor, target) pairs, about `total` of them, without duplicates.
+
+    How many pairs each user starts is in proportion to `activity`; each
+    target is `targets(n)` ids. Users are handled a chunk at a time, so
+    duplicates only need removing within a chunk.
+    """
+
+    num_users = len(activity)
+    expected = activity * (total / activity.sum())
+    users_per_chunk = max(int(chunk_size * num_users / max(total, 1)), 1)
+
+    for lo, hi in ranges(num_users, users_per_chunk):
+        counts = rng.poisson(expected[lo:hi])
+        actors = np.repeat(np.arange(lo + 1, hi + 1), counts)
+
+        keys = np.unique(actors.astype(np.int64) * (1 << 32) + targets(len(actors)))
+        yield keys >> 32, keys & 0xFFFFFFFF
+
+
+def follows(rng, following, popularity, num_follows, chunk_size):
+    cumulative = np.cumsum(popularity)
+
+    for follower, followed in pairs(
+            rng, following, num_follows,
+            lambda n: weighted_choice(rng, cumulative, n) + 1, chunk_size):
+        keep = follower != followed
+        yield followed[keep], follower[keep]
+
+
+def likes(rng, liking, num_likes, authors, chunk_size):
+    num_messages = len(authors)
+
+    def recent_messages(n):
+        # raising a uniform draw to a power piles it up near 0, i.e. the
+        # newest ids
+        return num_messages - (num_messages * rng.random(n) ** 1.5).astype(np.int64)
+
+    for liker, message in pairs(rng, liking, num_likes, recent_messages, chunk_size):
+        # the app doesn't let users like their own messages
+        keep = authors[message - 1] != liker
+        yield liker[keep], message[keep]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler sample data.")
+    parser.add_argument('--preset', choices=PRESETS, default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='generator')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    for name in PRESETS['small']:
+        parser.add_argument(f'--{name}', type=int, help=f"override the preset's {name}")
+
+    args = parser.parse_args()
+    sizes = {name: getattr(args, name) or default
+             for name, default in PRESETS[args.preset].items()}
+
+    # one independent stream per file, so changing one size leaves the
+    # other files as they were
+    weights_rng, users_rng, messages_rng, follows_rng, likes_rng = (
+        np.random.default_rng(seed)
+        for seed in np.random.SeedSequence(args.seed).spawn(5))
+
+    popularity = power_law_weights(weights_rng, sizes['users'], 1.2)
+    posting = power_law_weights(weights_rng, sizes['users'], 1.5)
+    following = power_law_weights(weights_rng, sizes['users'], 2.0)
+
+    os.makedirs(args.out, exist_ok=True)
+
+    write(os.path.join(args.out, 'users.csv'), USERS_CSV_HEADERS,
+          users(users_rng, sizes['users'], args.chunk_size))
+
+    # who wrote each message, so likes can leave out self-likes
+    authors = np.empty(sizes['messages'], dtype=np.int64)
+
+    write(os.path.join(args.out, 'messages.csv'), MESSAGES_CSV_HEADERS,
+          messages(messages_rng, sizes['messages'], posting, authors, args.chunk_size))
+
+    write(os.path.join(args.out, 'follows.csv'), FOLLOWS_CSV_HEADERS,
+          follows(follows_rng, following, popularity, sizes['follows'], args.chunk_size))
+
+    write(os.path.join(args.out, 'likes.csv'), LIKES_CSV_HEADERS,
+          likes(likes_rng, following, sizes['likes'], authors, args.chunk_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,65 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything here works on whole NumPy arrays at once and draws from the
+`numpy.random.Generator` it is given, so output depends only on the seed.
+"""
 
+import numpy as np
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+def power_law_weights(rng, n, exponent):
+    """`n` positive weights with a heavy (Pareto) tail.
 
-    return datetime.fromtimestamp(random_timestamp)
+    A few get most of the total, like followers or posting activity on a
+    real network. Smaller exponents give heavier tails.
+    """
+
+    return rng.pareto(exponent, n) + 1
+
+
+def weighted_choice(rng, cumulative, size):
+    """`size` indices drawn with probability proportional to the weights
+    whose running total is `cumulative`."""
+
+    draws = rng.random(size) * cumulative[-1]
+    return np.searchsorted(cumulative, draws, side='right')
+
+
+def bursty_timestamps(rng, n, start, end, burst_size=40, burst_seconds=1800):
+    """`n` sorted datetime64[us] timestamps between `start` and `end`.
+
+    Posts cluster around bursts (a news event, an evening online) rather
+    than being spread evenly: burst times are uniform over the range, the
+    number of posts per burst varies widely, and posts trail off
+    exponentially after the start of their burst.
+    """
+
+    start = np.datetime64(start, 'us').astype(np.int64)
+    end = np.datetime64(end, 'us').astype(np.int64)
+
+    bursts = max(n // burst_size, 1)
+    centres = rng.integers(start, end, bursts)
+    sizes = power_law_weights(rng, bursts, 1.5)
+    which = weighted_choice(rng, np.cumsum(sizes), n)
+
+    delays = rng.exponential(burst_seconds * 1e6, n).astype(np.int64)
+    stamps = np.minimum(centres[which] + delays, end - 1)
+    stamps.sort()
+
+    return stamps.astype('datetime64[us]')
+
+
+def format_timestamps(stamps):
+    """ISO strings for datetime64 timestamps, as the database expects them."""
+
+    return np.char.replace(np.datetime_as_string(stamps, unit='us'), 'T', ' ')
+
+
+def sentences(rng, vocabulary, n, min_words, max_words, max_length):
+    """`n` strings of random words from `vocabulary`."""
+
+    lengths = rng.integers(min_words, max_words + 1, n)
+    words = vocabulary[rng.integers(0, len(vocabulary), (n, max_words))]
+
+    return [' '.join(row[:length]).capitalize()[:max_length - 1] + '.'
+            for row, length in zip(words, lengths)]
@@ -0,0 +1,72 @@
+"""Short-lived cache of the logged-in user's row.
+
+`add_user_to_g` needs the current user on every request, but the columns
+the templates show change rarely. We keep them for USER_CACHE_SECONDS and
+rebuild the `User` from the cache without a query.
+
+The cache is per process: views that change the user call `forget`, and
+changes made elsewhere show up once the entry expires.
+"""
+
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+# everything but the password hash, which is loaded on demand if needed
+CACHED_COLUMNS = [
+    'id', 'email', 'username', 'image_url', 'header_image_url', 'bio',
+    'location', 'messages_count', 'following_count', 'followers_count',
+    'likes_count', 'version',
+]
+
+_cache = {}
+
+# held while the cache is changed, so `_evict` can iterate it safely
+_lock = threading.Lock()
+
+
+def get_user(user_id):
+    """The `User` with `user_id`, or None if there isn't one."""
+
+    now = time.monotonic()
+    cached = _cache.get(user_id)
+
+    if cached and cached[0] > now:
+        user = User(**cached[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = User.active().filter(User.id == user_id).first()
+
+    if user:
+        columns = {name: getattr(user, name) for name in CACHED_COLUMNS}
+
+        with _lock:
+            if len(_cache) >= current_app.config['USER_CACHE_SIZE']:
+                _evict(now)
+
+            _cache[user_id] = (now + current_app.config['USER_CACHE_SECONDS'], columns)
+
+    return user
+
+
+def forget(user_id):
+    """Drop `user_id` from the cache after their row changes."""
+
+    with _lock:
+        _cache.pop(user_id, None)
+
+
+def _evict(now):
+    """Make room: drop expired entries, or the oldest if none have expired.
+    Call with `_lock` held."""
+
+    expired = [user_id for user_id, (expires, _) in _cache.items()
+               if expires <= now]
+
+    for user_id in expired or list(_cache)[:1]:
+        del _cache[user_id]
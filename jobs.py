@@ -0,0 +1,408 @@
+"""Background jobs: work a write causes that needn't hold up its response.
+
+A view commits its own change, then hands the rest to a task by name,
+as in `jobs.enqueue('fan_out', message_id=msg.id)`. Tasks are functions
+registered with `@jobs.task` (see tasks.py); their arguments must be
+JSON. Each runs in its own transaction, committed when it returns.
+
+JOBS_MODE picks where tasks run:
+
+- thread: a pool of JOBS_WORKERS threads in this process. Jobs still
+  queued when the process stops are lost.
+- durable: jobs are rows in the `jobs` table, claimed by the same pool
+  of threads polling it, or by `flask run-jobs`. A claim is a lease of
+  JOBS_LEASE_SECONDS, so a job whose worker died runs again once the
+  lease runs out (or is marked failed, if that was its last attempt).
+  Done rows are kept for JOBS_KEEP_SECONDS, then deleted by the pollers
+  or `flask run-jobs`.
+- inline: straight away, in the caller. For tests and scripts.
+
+A task that raises is retried up to JOBS_MAX_ATTEMPTS times, waiting
+JOBS_RETRY_SECONDS and doubling the wait each time. Enqueueing with
+`key=` is idempotent: a job with the same key as one already queued or
+running is dropped, and in durable mode so is one whose row is still
+kept. Tasks may run more than once (a lease can run out), so they
+should check the state they're about to change.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql
+
+from models import db, Job
+
+log = logging.getLogger(__name__)
+
+TASKS = {}
+
+# how often, at most, a poller deletes old done jobs
+PRUNE_SECONDS = 60
+
+OUTCOMES = ['enqueued', 'duplicate', 'done', 'retried', 'failed']
+
+
+def task(fn):
+    """Register `fn` as a task, under its own name."""
+
+    TASKS[fn.__name__] = fn
+    return fn
+
+
+class JobQueue:
+    """Runs tasks in the background, in the way JOBS_MODE says.
+
+    Set up like a Flask extension: create it, then call `init_app`.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._executor = None
+        self._pollers = []
+        self._wake = threading.Event()
+        self._pruned_at = None
+        self._keys = set()
+        self._counts = {}
+        self.queued = 0
+        self.running = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_MODE', 'thread')
+        app.config.setdefault('JOBS_WORKERS', 4)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 3)
+        app.config.setdefault('JOBS_RETRY_SECONDS', 1.0)
+        app.config.setdefault('JOBS_LEASE_SECONDS', 300)
+        app.config.setdefault('JOBS_POLL_SECONDS', 1.0)
+        app.config.setdefault('JOBS_KEEP_SECONDS', 24 * 3600)
+        self.app = app
+
+    @property
+    def mode(self):
+        return self.app.config['JOBS_MODE']
+
+    def enqueue(self, name, key=None, **kwargs):
+        """Run task `name` with `kwargs` in the background.
+
+        Call this after committing whatever the task depends on. Returns
+        False if a job with the same `key` was already queued.
+        """
+
+        if name not in TASKS:
+            raise KeyError(f'No task named {name!r}.')
+
+        args = json.dumps(kwargs)
+        mode = self.mode
+
+        if mode == 'durable':
+            added = self._insert(name, args, key)
+        elif mode == 'thread':
+            added = self._claim_key(key)
+        else:
+            added = True
+
+        self._count(name, 'enqueued' if added else 'duplicate')
+        if not added:
+            return False
+
+        if mode == 'inline':
+            self._attempt_all(name, json.loads(args), sleep=lambda seconds: None)
+
+        elif mode == 'thread':
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.app.config['JOBS_WORKERS'],
+                        thread_name_prefix='jobs')
+                self.queued += 1
+            self._executor.submit(self._work, name, json.loads(args), key)
+
+        else:
+            self._start_pollers()
+            self._wake.set()
+
+        return True
+
+    def _count(self, name, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(name, dict.fromkeys(OUTCOMES, 0))
+            counts[outcome] += 1
+
+    def _backoff(self, attempt):
+        return self.app.config['JOBS_RETRY_SECONDS'] * 2 ** (attempt - 1)
+
+    def _run(self, name, kwargs, *also):
+        """Run one attempt of a task, then any `also` statements, and commit."""
+
+        try:
+            TASKS[name](**kwargs)
+            for statement in also:
+                db.session.execute(statement)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    ##########################################################################
+    # inline and thread modes
+
+    def _claim_key(self, key):
+        if key is None:
+            return True
+
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            return True
+
+    def _attempt_all(self, name, kwargs, sleep=time.sleep):
+        attempts = self.app.config['JOBS_MAX_ATTEMPTS']
+
+        for attempt in range(1, attempts + 1):
+            try:
+                self._run(name, kwargs)
+            except Exception:
+                if attempt == attempts:
+                    self._count(name, 'failed')
+                    log.exception('Job %s%r failed after %d attempts.',
+                                  name, kwargs, attempts)
+                    raise
+
+                self._count(name, 'retried')
+                sleep(self._backoff(attempt))
+            else:
+                self._count(name, 'done')
+                return
+
+    def _work(self, name, kwargs, key):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+
+        try:
+            with self.app.app_context():
+                self._attempt_all(name, kwargs)
+        except Exception:
+            pass  # logged in _attempt_all
+        finally:
+            with self._idle:
+                self.running -= 1
+                self._keys.discard(key)
+                self._idle.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until no jobs are queued or running in this process's
+        threads. False if `timeout` seconds pass first."""
+
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: not self.queued and not self.running, timeout)
+
+    ##########################################################################
+    # durable mode
+
+    def _insert(self, name, args, key):
+        jobs = Job.__table__
+
+        if db.engine.dialect.name == 'postgresql':
+            insert = postgresql.insert(jobs).on_conflict_do_nothing()
+        else:
+            insert = jobs.insert().prefix_with('OR IGNORE')
+
+        now = datetime.utcnow()
+
+        with db.engine.begin() as conn:
+            result = conn.execute(insert.values(
+                name=name, args=args, key=key, status='queued', attempts=0,
+                run_at=now, created_at=now))
+
+        return bool(result.rowcount)
+
+    def _claim(self):
+        """The next due job, leased to the caller, or None.
+
+        A running job is due once its lease runs out; if it has had all
+        its attempts, it is marked failed rather than claimed.
+        """
+
+        jobs = Job.__table__
+        lease = timedelta(seconds=self.app.config['JOBS_LEASE_SECONDS'])
+        max_attempts = self.app.config['JOBS_MAX_ATTEMPTS']
+
+        while True:
+            now = datetime.utcnow()
+
+            with db.engine.begin() as conn:
+                row = conn.execute(
+                    select([jobs])
+                    .where(jobs.c.status.in_(['queued', 'running']))
+                    .where(jobs.c.run_at <= now)
+                    .order_by(jobs.c.run_at)
+                    .limit(1)
+                    .with_for_update(skip_locked=True)).first()
+
+                if row is None:
+                    return None
+
+                expired = row.status == 'running' and row.attempts >= max_attempts
+                if expired:
+                    values = dict(status='failed', run_at=now,
+                                  error='Lease ran out on the last attempt.')
+                else:
+                    values = dict(status='running', attempts=row.attempts + 1,
+                                  run_at=now + lease)
+
+                # only if it's as we read it: SQLite doesn't lock the row,
+                # so another worker may have claimed it since
+                claimed = conn.execute(
+                    jobs.update()
+                    .where(jobs.c.id == row.id)
+                    .where(jobs.c.status == row.status)
+                    .where(jobs.c.attempts == row.attempts)
+                    .values(**values)).rowcount
+
+            if not claimed:
+                continue
+
+            if expired:
+                log.error('Job %d (%s) failed: its lease ran out on attempt %d.',
+                          row.id, row.name, row.attempts)
+                self._count(row.name, 'failed')
+                continue
+
+            return row
+
+    def work_one(self):
+        """Claim and run one due job from the table. False if none was due.
+
+        Needs an app context.
+        """
+
+        row = self._claim()
+        if row is None:
+            return False
+
+        jobs = Job.__table__
+        finish = jobs.update().where(jobs.c.id == row.id)
+        attempt = row.attempts + 1
+
+        try:
+            # marked done in the task's own transaction, so it can't run twice
+            self._run(row.name, json.loads(row.args),
+                      finish.values(status='done', error=None,
+                                    run_at=datetime.utcnow()))
+        except Exception as e:
+            failed = attempt >= self.app.config['JOBS_MAX_ATTEMPTS']
+            log.exception('Job %d (%s) failed, attempt %d.', row.id, row.name, attempt)
+
+            retry_at = datetime.utcnow() + timedelta(seconds=self._backoff(attempt))
+            with db.engine.begin() as conn:
+                conn.execute(finish.values(
+                    status='failed' if failed else 'queued',
+                    run_at=retry_at, error=repr(e)))
+
+            self._count(row.name, 'failed' if failed else 'retried')
+        else:
+            self._count(row.name, 'done')
+
+        return True
+
+    def prune(self):
+        """Delete jobs done more than JOBS_KEEP_SECONDS ago; returns how
+        many.
+
+        Needs an app context.
+        """
+
+        jobs = Job.__table__
+        before = datetime.utcnow() - timedelta(
+            seconds=self.app.config['JOBS_KEEP_SECONDS'])
+
+        with db.engine.begin() as conn:
+            return conn.execute(jobs.delete()
+                                .where(jobs.c.status == 'done')
+                                .where(jobs.c.run_at < before)).rowcount
+
+    def _maybe_prune(self):
+        """Prune, if no poller has in the last PRUNE_SECONDS."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            due = self._pruned_at is None or now - self._pruned_at >= PRUNE_SECONDS
+            if due:
+                self._pruned_at = now
+
+        if due:
+            self.prune()
+
+    def _start_pollers(self):
+        with self._lock:
+            if self._pollers:
+                return
+
+            for n in range(self.app.config['JOBS_WORKERS']):
+                poller = threading.Thread(target=self._poll, name=f'jobs-{n}',
+                                          daemon=True)
+                poller.start()
+                self._pollers.append(poller)
+
+    def _poll(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    worked = self.work_one()
+                    if not worked:
+                        self._maybe_prune()
+            except Exception:
+                log.exception('Claiming a job failed.')
+                worked = False
+
+            if not worked:
+                self._wake.wait(self.app.config['JOBS_POLL_SECONDS'])
+                self._wake.clear()
+
+    ##########################################################################
+
+    def stats(self):
+        """Jobs by task and outcome since startup, and the queue's depth."""
+
+        with self._lock:
+            data = {
+                'mode': self.mode,
+                'tasks': {name: dict(counts) for name, counts in self._counts.items()},
+                'depth': {'queued': self.queued, 'running': self.running},
+            }
+
+        if self.mode == 'durable':
+            jobs = Job.__table__
+            rows = db.engine.execute(
+                select([jobs.c.status, func.count()]).group_by(jobs.c.status))
+            data['depth'] = dict.fromkeys(['queued', 'running', 'failed'], 0)
+            data['depth'].update(
+                {status: count for status, count in rows if status != 'done'})
+
+        return data
+
+
+queue = JobQueue()
+
+
+def init_app(app):
+    queue.init_app(app)
+
+
+def enqueue(name, key=None, **kwargs):
+    """Run task `name` in the background; see `JobQueue.enqueue`."""
+
+    return queue.enqueue(name, key, **kwargs)
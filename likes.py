@@ -0,0 +1,42 @@
+"""Liking and unliking messages, shared by the HTML views and the API."""
+
+import identity
+import trending
+from models import db, Likes, Message, User
+
+
+class LikeError(Exception):
+    """The like can't be toggled; `status` is the HTTP status to answer."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def toggle(user, message_id):
+    """Like the message for `user`, or unlike it if they already do, and
+    commit. Returns True if the message is now liked.
+
+    Raises LikeError for a missing message (or one by a deleted account)
+    and for the user's own messages.
+    """
+
+    author_id = (db.session
+                 .query(Message.user_id)
+                 .join(User, User.id == Message.user_id)
+                 .filter(Message.id == message_id, User.deleted_at.is_(None))
+                 .scalar())
+
+    if author_id is None:
+        raise LikeError(404, 'No such message.')
+
+    if author_id == user.id:
+        raise LikeError(403, "You can't like your own message.")
+
+    liked = Likes.toggle(user.id, message_id)
+    db.session.commit()
+    identity.forget(user.id)
+    trending.board.liked(message_id, user.id, liked)
+
+    return liked
@@ -0,0 +1,198 @@
+"""Streaming bulk loader for the seed CSVs.
+
+Each CSV is read and written CHUNK_SIZE rows at a time, so memory stays
+flat however big the files are, and every chunk is its own transaction.
+Rows go in by the fastest path the database has: COPY on Postgres,
+executemany on everything else (through SQLAlchemy, so in whatever
+paramstyle the driver takes).
+
+Users and messages get their id from their row number in the CSV (the
+first user is 1), which is what the other files refer to them by. That
+also makes a load resumable: the rows committed so far for each file are
+recorded in `load_progress` with the chunk that wrote them, so after a
+failure `load(..., resume=True)` skips exactly those rows and carries on.
+"""
+
+import csv
+import io
+import itertools
+import os
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, select
+from sqlalchemy.sql import column, table as untyped
+
+from models import db, User, Message, Follows, Likes
+import timeline
+
+CHUNK_SIZE = 10000
+
+PROGRESS = Table(
+    'load_progress', MetaData(),
+    Column('name', String, primary_key=True),
+    Column('rows', Integer, nullable=False),
+)
+
+# (file name, table, whether ids come from the row number), in load order
+FILES = [
+    ('users.csv', User.__table__, True),
+    ('messages.csv', Message.__table__, True),
+    ('follows.csv', Follows.__table__, False),
+    ('likes.csv', Likes.__table__, False),
+]
+
+
+def _progress(engine, name):
+    """Rows of `name` already loaded."""
+
+    rows = engine.execute(
+        select([PROGRESS.c.rows]).where(PROGRESS.c.name == name)).scalar()
+    return rows or 0
+
+
+def _record(conn, name, rows):
+    updated = conn.execute(
+        PROGRESS.update().where(PROGRESS.c.name == name).values(rows=rows))
+
+    if not updated.rowcount:
+        conn.execute(PROGRESS.insert().values(name=name, rows=rows))
+
+
+def _chunks(reader, size):
+    while True:
+        chunk = list(itertools.islice(reader, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy(conn, table, columns, rows):
+    """Postgres: stream `rows` in with COPY ... FROM STDIN."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer)
+    finally:
+        cursor.close()
+
+
+def _executemany(conn, table, columns, rows):
+    # untyped columns, so the CSV's strings go to the database as they are,
+    # as they do with COPY, rather than through the model's types
+    target = untyped(table.name, *(column(name) for name in columns))
+
+    conn.execute(target.insert(), [dict(zip(columns, row)) for row in rows])
+
+
+def load_file(engine, path, table, numbered, chunk_size=CHUNK_SIZE,
+              resume=False, report=print):
+    """Load one CSV into `table`. Returns the number of rows loaded."""
+
+    name = os.path.basename(path)
+    insert = _copy if engine.dialect.name == 'postgresql' else _executemany
+    done = _progress(engine, name) if resume else 0
+    loaded = 0
+    started = time.monotonic()
+
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        columns = next(reader)
+
+        if numbered:
+            columns = ['id'] + columns
+            reader = ([row_id] + row for row_id, row in enumerate(reader, 1))
+
+        for _ in itertools.islice(reader, done):
+            pass
+
+        for chunk in _chunks(reader, chunk_size):
+            # empty fields are NULLs
+            chunk = [[value if value != '' else None for value in row]
+                     for row in chunk]
+
+            with engine.begin() as conn:
+                insert(conn, table, columns, chunk)
+                _record(conn, name, done + loaded + len(chunk))
+
+            loaded += len(chunk)
+            rate = loaded / max(time.monotonic() - started, 1e-6)
+            report(f"{name}: {done + loaded:,} rows ({rate:,.0f} rows/sec)")
+
+    return loaded
+
+
+def _reset_sequences(engine):
+    """Move Postgres id sequences past the ids we set explicitly."""
+
+    if engine.dialect.name != 'postgresql':
+        return
+
+    for _, table, numbered in FILES:
+        if numbered:
+            engine.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"coalesce(max(id), 0) + 1, false) FROM {table.name}")
+
+
+def rebuild_timelines(engine, chunk_size=CHUNK_SIZE, resume=False,
+                      report=print):
+    """Build every user's timeline, committing every `chunk_size` users."""
+
+    after = _progress(engine, 'timelines') if resume else 0
+    started = time.monotonic()
+    built = 0
+
+    while True:
+        user_ids = [user_id for user_id, in db.session
+                    .query(User.id)
+                    .filter(User.id > after)
+                    .order_by(User.id)
+                    .limit(chunk_size)]
+        if not user_ids:
+            return built
+
+        for user_id in user_ids:
+            timeline.rebuild(user_id)
+
+        after = user_ids[-1]
+        _record(db.session, 'timelines', after)
+        db.session.commit()
+
+        built += len(user_ids)
+        rate = built / max(time.monotonic() - started, 1e-6)
+        report(f"timelines: {built:,} users ({rate:,.0f} users/sec)")
+
+
+def load(directory, chunk_size=CHUNK_SIZE, resume=False, report=print):
+    """Load every CSV in `directory`, then derive counters and timelines.
+
+    Needs an app context. Without `resume`, the tables should be empty.
+    """
+
+    engine = db.engine
+    PROGRESS.create(engine, checkfirst=True)
+
+    if not resume:
+        engine.execute(PROGRESS.delete())
+
+    for name, table, numbered in FILES:
+        path = os.path.join(directory, name)
+
+        if os.path.exists(path):
+            load_file(engine, path, table, numbered, chunk_size, resume, report)
+
+    _reset_sequences(engine)
+
+    # bulk loading skips the views that keep these up to date
+    User.reconcile_counts()
+    Message.reconcile_counts()
+    db.session.commit()
+    report("counts: reconciled")
+
+    rebuild_timelines(engine, max(chunk_size // 10, 1), resume, report)
@@ -0,0 +1,141 @@
+"""Initial schema: users, follows, messages, likes and home timelines.
+
+Tables are spelled out here rather than taken from models.py, so this
+migration keeps creating the same schema as the models change.
+
+A database created before migrations existed (by `db.create_all()` from
+the original models) already has users, follows, messages and likes, but
+no counter columns, and likes are unique per message rather than per
+user and message. Those are brought up to date here, counters filled in
+from the rows. Timelines start empty there: run `flask rebuild-timelines`
+after upgrading.
+"""
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer, MetaData,
+                        String, Table, Text, UniqueConstraint, inspect)
+
+COUNTERS = {
+    'users': ['messages_count', 'following_count', 'followers_count', 'likes_count'],
+    'messages': ['likes_count'],
+}
+
+# what each counter counts: (table, column matching the counted row's id)
+COUNTED = {
+    ('users', 'messages_count'): ('messages', 'user_id'),
+    ('users', 'following_count'): ('follows', 'user_following_id'),
+    ('users', 'followers_count'): ('follows', 'user_being_followed_id'),
+    ('users', 'likes_count'): ('likes', 'user_id'),
+    ('messages', 'likes_count'): ('likes', 'message_id'),
+}
+
+
+def _baseline(conn):
+    """Whether this is a database from before migrations."""
+
+    return 'users' in inspect(conn).get_table_names()
+
+
+def _add_counters(conn):
+    for table, columns in COUNTERS.items():
+        for column in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} "
+                         f"INTEGER NOT NULL DEFAULT 0")
+
+    for (table, column), (counted, key) in COUNTED.items():
+        conn.execute(f"UPDATE {table} SET {column} = (SELECT count(*) FROM {counted} "
+                     f"WHERE {counted}.{key} = {table}.id)")
+
+
+def _replace_likes_unique(conn):
+    """Likes were unique per message: make them unique per user and message."""
+
+    if conn.dialect.name == 'sqlite':
+        # SQLite can't drop a constraint; copy into a new table instead
+        conn.execute("ALTER TABLE likes RENAME TO likes_baseline")
+        return
+
+    for constraint in inspect(conn).get_unique_constraints('likes'):
+        if constraint['column_names'] == ['message_id']:
+            conn.execute(f"ALTER TABLE likes DROP CONSTRAINT {constraint['name']}")
+
+    conn.execute("ALTER TABLE likes ADD CONSTRAINT likes_user_id_message_id_key "
+                 "UNIQUE (user_id, message_id)")
+
+
+def upgrade(conn):
+    baseline = _baseline(conn)
+
+    if baseline:
+        _add_counters(conn)
+        _replace_likes_unique(conn)
+
+    meta = MetaData()
+
+    Table(
+        'users', meta,
+        Column('id', Integer, primary_key=True),
+        Column('email', Text, nullable=False, unique=True),
+        Column('username', Text, nullable=False, unique=True),
+        Column('image_url', Text),
+        Column('header_image_url', Text),
+        Column('bio', Text),
+        Column('location', Text),
+        Column('password', Text, nullable=False),
+        Column('messages_count', Integer, nullable=False, server_default='0'),
+        Column('following_count', Integer, nullable=False, server_default='0'),
+        Column('followers_count', Integer, nullable=False, server_default='0'),
+        Column('likes_count', Integer, nullable=False, server_default='0'),
+    )
+
+    Table(
+        'follows', meta,
+        Column('user_being_followed_id', Integer,
+               ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+        Column('user_following_id', Integer,
+               ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    )
+
+    Table(
+        'messages', meta,
+        Column('id', Integer, primary_key=True),
+        Column('text', String(140), nullable=False),
+        Column('timestamp', DateTime, nullable=False),
+        Column('user_id', Integer,
+               ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        Column('likes_count', Integer, nullable=False, server_default='0'),
+    )
+
+    Table(
+        'likes', meta,
+        Column('id', Integer, primary_key=True),
+        Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+        Column('message_id', Integer,
+               ForeignKey('messages.id', ondelete='cascade')),
+        UniqueConstraint('user_id', 'message_id'),
+    )
+
+    Table(
+        'timeline_entries', meta,
+        Column('user_id', Integer,
+               ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+        Column('message_id', Integer,
+               ForeignKey('messages.id', ondelete='cascade'), primary_key=True),
+        Column('timestamp', DateTime, nullable=False),
+        Index('ix_timeline_entries_user_id_timestamp', 'user_id', 'timestamp'),
+    )
+
+    meta.create_all(conn)
+
+    if baseline and conn.dialect.name == 'sqlite':
+        conn.execute("INSERT INTO likes (id, user_id, message_id) "
+                     "SELECT id, user_id, message_id FROM likes_baseline")
+        conn.execute("DROP TABLE likes_baseline")
+
+    if conn.dialect.name == 'postgresql':
+        # full-text search documents; must match search.py
+        conn.execute(
+            "CREATE INDEX ix_users_search ON users USING gin "
+            "((to_tsvector('simple', username || ' ' || coalesce(bio, ''))))")
+        conn.execute(
+            "CREATE INDEX ix_messages_search ON messages USING gin "
+            "((to_tsvector('simple', text)))")
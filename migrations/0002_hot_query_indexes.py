@@ -0,0 +1,27 @@
+"""Indexes for the hot queries in app.py.
+
+- messages (user_id, timestamp): profile pages and celebrity timelines,
+  newest first for one author.
+- follows (user_following_id, user_being_followed_id): who a user
+  follows. The primary key leads with the followed user, so it only
+  serves the followers direction.
+- likes (user_id, id): a user's likes page, most recent first.
+"""
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, Table
+
+
+def upgrade(conn):
+    meta = MetaData()
+
+    messages = Table('messages', meta, Column('user_id', Integer),
+                     Column('timestamp', DateTime))
+    follows = Table('follows', meta, Column('user_following_id', Integer),
+                    Column('user_being_followed_id', Integer))
+    likes = Table('likes', meta, Column('user_id', Integer), Column('id', Integer))
+
+    Index('ix_messages_user_id_timestamp',
+          messages.c.user_id, messages.c.timestamp).create(conn)
+    Index('ix_follows_user_following_id',
+          follows.c.user_following_id, follows.c.user_being_followed_id).create(conn)
+    Index('ix_likes_user_id_id', likes.c.user_id, likes.c.id).create(conn)
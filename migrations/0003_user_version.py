@@ -0,0 +1,7 @@
+"""users.version: bumped on every profile edit, so anything cached from
+a user's profile (see fragments.py) can tell it is out of date."""
+
+
+def upgrade(conn):
+    conn.execute(
+        "ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
@@ -0,0 +1,23 @@
+"""jobs: the durable background job queue (see jobs.py)."""
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, Table, Text
+
+
+def upgrade(conn):
+    meta = MetaData()
+
+    Table(
+        'jobs', meta,
+        Column('id', Integer, primary_key=True),
+        Column('name', Text, nullable=False),
+        Column('args', Text, nullable=False),
+        Column('key', Text, unique=True),
+        Column('status', Text, nullable=False),
+        Column('attempts', Integer, nullable=False),
+        Column('run_at', DateTime, nullable=False),
+        Column('error', Text),
+        Column('created_at', DateTime, nullable=False),
+        Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    meta.create_all(conn)
@@ -0,0 +1,34 @@
+"""Deleting accounts in the background (see purge.py).
+
+- users.deleted_at: the tombstone, set when an account is deleted.
+- account_purges: progress purging each deleted account's rows.
+- likes (message_id) and timeline_entries (message_id): deleting a
+  message's likes and timeline entries, whether directly or by the
+  foreign key cascade, otherwise scans the whole table.
+"""
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, Table, Text
+
+
+def upgrade(conn):
+    timestamp = DateTime().compile(dialect=conn.dialect)
+    conn.execute(f"ALTER TABLE users ADD COLUMN deleted_at {timestamp}")
+
+    meta = MetaData()
+
+    Table(
+        'account_purges', meta,
+        Column('user_id', Integer, primary_key=True, autoincrement=False),
+        Column('step', Text, nullable=False),
+        Column('rows_deleted', Integer, nullable=False),
+        Column('started_at', DateTime, nullable=False),
+        Column('finished_at', DateTime),
+    )
+
+    meta.create_all(conn)
+
+    likes = Table('likes', meta, Column('message_id', Integer))
+    entries = Table('timeline_entries', meta, Column('message_id', Integer))
+
+    Index('ix_likes_message_id', likes.c.message_id).create(conn)
+    Index('ix_timeline_entries_message_id', entries.c.message_id).create(conn)
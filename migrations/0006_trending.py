@@ -0,0 +1,22 @@
+"""Trending messages (see trending.py).
+
+- likes.timestamp: when the like was made. It is left NULL for likes
+  already there rather than rewriting the whole table; the trending
+  board only looks back a few days, so they'd soon stop counting anyway.
+- likes (timestamp) and messages (timestamp): reading the last few days'
+  likes and messages to rebuild the trending board.
+"""
+
+from sqlalchemy import Column, DateTime, Index, MetaData, Table
+
+
+def upgrade(conn):
+    timestamp = DateTime().compile(dialect=conn.dialect)
+    conn.execute(f"ALTER TABLE likes ADD COLUMN timestamp {timestamp}")
+
+    meta = MetaData()
+    likes = Table('likes', meta, Column('timestamp', DateTime))
+    messages = Table('messages', meta, Column('timestamp', DateTime))
+
+    Index('ix_likes_timestamp', likes.c.timestamp).create(conn)
+    Index('ix_messages_timestamp', messages.c.timestamp).create(conn)
@@ -0,0 +1,16 @@
+"""users.celebrity: authors merged into timelines when read, rather than
+fanned out (see timeline.py).
+
+Nobody is marked at first, so everyone is fanned out to until the
+`maintain_timelines` job runs; run `flask update-celebrities` straight
+after upgrading to mark them at once.
+"""
+
+from sqlalchemy import Boolean, false
+
+
+def upgrade(conn):
+    boolean = Boolean().compile(dialect=conn.dialect)
+    default = false().compile(dialect=conn.dialect)
+    conn.execute(
+        f"ALTER TABLE users ADD COLUMN celebrity {boolean} NOT NULL DEFAULT {default}")
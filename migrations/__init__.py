@@ -0,0 +1,78 @@
+"""Versioned schema migrations.
+
+Each migration is a module in this package named `NNNN_description.py`
+with an `upgrade(conn)` function that changes the schema using the given
+SQLAlchemy connection. Migrations run in order, each in its own
+transaction, and the versions applied are recorded in `schema_migrations`.
+
+    flask db-upgrade      apply pending migrations
+    flask db-status       list migrations and whether they've been applied
+    flask explain-hot-queries
+                          check the hot queries are served by indexes
+
+Never edit a migration once it has been applied somewhere; add a new one.
+"""
+
+import importlib
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, select
+
+VERSIONS = Table(
+    'schema_migrations', MetaData(),
+    Column('version', String, primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def available():
+    """Names of all migrations, in the order they apply."""
+
+    here = os.path.dirname(__file__)
+
+    return sorted(name[:-3] for name in os.listdir(here)
+                  if re.match(r'\d{4}_\w+\.py$', name))
+
+
+def applied(engine):
+    """Names of migrations already applied to `engine`'s database."""
+
+    VERSIONS.create(engine, checkfirst=True)
+    return {version for version, in engine.execute(select([VERSIONS.c.version]))}
+
+
+def pending(engine):
+    """Names of migrations not yet applied, in order."""
+
+    done = applied(engine)
+    return [name for name in available() if name not in done]
+
+
+def upgrade(engine, report=print):
+    """Apply every pending migration. Returns the names applied."""
+
+    names = pending(engine)
+
+    for name in names:
+        migration = importlib.import_module(f'{__name__}.{name}')
+
+        with engine.begin() as conn:
+            migration.upgrade(conn)
+            conn.execute(VERSIONS.insert().values(
+                version=name, applied_at=datetime.utcnow()))
+
+        report(f"Applied {name}")
+
+    return names
+
+
+def reset(engine, report=print):
+    """Drop every table, then migrate from scratch (for seeding)."""
+
+    existing = MetaData()
+    existing.reflect(engine)
+    existing.drop_all(engine)
+
+    return upgrade(engine, report)
@@ -0,0 +1,89 @@
+"""EXPLAIN the hot queries from app.py and flag any that scan a table.
+
+Run with `flask explain-hot-queries`. On Postgres, sequential scans are
+turned off for the check, so a "Seq Scan" in a plan means no index can
+serve the query at all (rather than the planner preferring a scan of a
+small development table). On SQLite, any SCAN step is flagged.
+"""
+
+from datetime import datetime
+
+from models import db, User, Message
+import timeline
+import trending
+
+# any id will do: plans don't depend on which user it is
+SAMPLE_ID = 1
+
+
+def hot_queries(user_id=SAMPLE_ID):
+    """(name, query) for each query run on the busiest pages.
+
+    Built by the same functions the views use, so they can't drift apart.
+    """
+
+    user = User(id=user_id)
+    ids = [1, 2, 3]
+    since = datetime(2000, 1, 1)
+    likes, posts = trending.recent_queries(since)
+
+    return [
+        ('home timeline page', timeline.entries_query(user_id, 101)),
+        ('celebrities on the home timeline', timeline.pulled_query(user_id, ids, 101)),
+        ('profile messages page', timeline.user_messages_query(user_id, 101)),
+        ('following page', user.following_query(101, before=1000)),
+        ('followers page', user.followers_query(101, before=1000)),
+        ('viewer follows on a page', user.following_among_query(ids)),
+        ('likes page', Message.liked_by(user_id)),
+        ('liked messages on a page', user.liked_among_query(ids)),
+        ('login', User.by_username('someone')),
+        ('trending rebuild, likes', likes),
+        ('trending rebuild, messages', posts),
+    ]
+
+
+def _plan(conn, query):
+    """Lines of the query plan for `query`."""
+
+    compiled = query.statement.compile(dialect=conn.dialect)
+    params = compiled.params
+
+    if conn.dialect.positional:
+        params = [params[name] for name in compiled.positiontup]
+
+    if conn.dialect.name == 'postgresql':
+        rows = conn.execute('EXPLAIN ' + str(compiled), params)
+        return [line for line, in rows]
+
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in rows]
+
+
+def _scans(dialect, plan):
+    """Plan lines that read a whole table."""
+
+    if dialect == 'postgresql':
+        return [line for line in plan if 'Seq Scan' in line]
+
+    return [line for line in plan if line.startswith('SCAN')]
+
+
+def check():
+    """EXPLAIN each hot query; returns [(name, plan lines, scan lines)]."""
+
+    results = []
+
+    with db.engine.connect() as conn:
+        trans = conn.begin()
+
+        try:
+            if conn.dialect.name == 'postgresql':
+                conn.execute('SET LOCAL enable_seqscan = off')
+
+            for name, query in hot_queries():
+                plan = _plan(conn, query)
+                results.append((name, plan, _scans(conn.dialect.name, plan)))
+        finally:
+            trans.rollback()
+
+    return results
@@ -2,11 +2,13 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import PasswordHasher
+from routing import RoutingSQLAlchemy
+
+hasher = PasswordHasher()
+db = RoutingSQLAlchemy()
 
 
 class Follows(db.Model):
@@ -26,6 +28,12 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # the primary key only serves lookups by the followed user
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,9 +53,62 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    # NULL for likes made before it was recorded (and bulk-loaded ones)
+    timestamp = db.Column(
+        db.DateTime,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_likes_user_id_id', 'user_id', 'id'),
+        # for deleting a message's likes, and the cascade from messages
+        db.Index('ix_likes_message_id', 'message_id'),
+        # for rebuilding the trending board from recent likes
+        db.Index('ix_likes_timestamp', 'timestamp'),
+    )
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Like the message if the user hasn't, otherwise unlike it.
+
+        Each way is one DELETE or INSERT on `likes`, and the like counts
+        on the user and message move with it. Returns True if the message
+        is now liked.
+        """
+
+        unliked = (cls.query
+                   .filter_by(user_id=user_id, message_id=message_id)
+                   .delete(synchronize_session=False))
+
+        if unliked:
+            delta = -1
+        else:
+            # a concurrent request may have just liked it; that's fine
+            if db.session.get_bind().dialect.name == 'postgresql':
+                insert = postgresql.insert(cls.__table__).on_conflict_do_nothing()
+            else:
+                insert = cls.__table__.insert().prefix_with('OR IGNORE')
+
+            result = db.session.execute(
+                insert.values(user_id=user_id, message_id=message_id))
+            delta = result.rowcount
+
+        if delta:
+            User.adjust_counts(user_id, likes_count=delta)
+            (Message.query
+             .filter_by(id=message_id)
+             .update({Message.likes_count: Message.likes_count + delta},
+                     synchronize_session=False))
+
+        return not unliked
+
+
+# what a user card (templates/users/_card.html) shows
+CARD_COLUMNS = ['id', 'username', 'image_url', 'header_image_url', 'bio', 'version']
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +155,66 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts shown on profiles, kept up to date by the views
+    # that add and remove the rows they count (see `adjust_counts`).
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Bumped whenever the profile changes, so cached copies of anything
+    # showing it (fragments.py) go out of date.
+
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Set while the user has too many followers to fan their messages out
+    # to; they're merged into followers' timelines when read instead (see
+    # timeline.py).
+
+    celebrity = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # Set when the account is deleted. The user and their messages are
+    # hidden from then on, and their rows purged in the background
+    # (see purge.py).
+
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -118,17 +239,175 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    # set of followed user ids, once `following_ids` has loaded it
+    _following_ids = None
+
+    def following_ids(self):
+        """Ids of everyone this user follows, as a set.
+
+        Loaded with one query the first time it's called; after that
+        `is_following` answers from the set. Pages that check the follow
+        state of many users should call this first.
+        """
+
+        if self._following_ids is None:
+            rows = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id))
+            self._following_ids = {user_id for user_id, in rows}
+
+        return self._following_ids
+
+    def following_among(self, user_ids):
+        """Which of `user_ids` this user follows, as a set.
+
+        One primary key lookup per id in a single query, for pages listing
+        a few users, where loading `following_ids` could mean millions.
+        """
+
+        if not user_ids:
+            return set()
+
+        rows = self.following_among_query(user_ids)
+
+        return {user_id for user_id, in rows}
+
+    def following_among_query(self, user_ids):
+        """Query behind `following_among`."""
+
+        return (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+
+    def followers_page(self, limit, before=None, columns=None):
+        """Up to `limit` of this user's followers, most recent id first.
+
+        `before` is a follower id; only followers with lower ids are
+        returned. Loads only `columns` of each user (CARD_COLUMNS by
+        default).
+        """
+
+        return self.followers_query(limit, before, columns).all()
+
+    def following_page(self, limit, before=None, columns=None):
+        """Up to `limit` of the users this user follows; see `followers_page`."""
+
+        return self.following_query(limit, before, columns).all()
+
+    def followers_query(self, limit, before=None, columns=None):
+        """Query behind `followers_page`."""
+
+        return self._follow_query(Follows.user_being_followed_id,
+                                  Follows.user_following_id, limit, before, columns)
+
+    def following_query(self, limit, before=None, columns=None):
+        """Query behind `following_page`."""
+
+        return self._follow_query(Follows.user_following_id,
+                                  Follows.user_being_followed_id, limit, before, columns)
+
+    def _follow_query(self, own, other, limit, before, columns):
+        # a range scan of the follows index on (own, other), then one
+        # primary key lookup per user, however many follows there are
+        users = (User.active()
+                 .join(Follows, other == User.id)
+                 .filter(own == self.id)
+                 .options(db.load_only(*(columns or CARD_COLUMNS))))
+
+        if before:
+            users = users.filter(other < before)
+
+        return users.order_by(other.desc()).limit(limit)
+
+    def liked_ids(self, messages):
+        """Ids of the given `messages` this user has liked, as a set."""
+
+        message_ids = [msg.id for msg in messages]
+        if not message_ids:
+            return set()
+
+        return {message_id for message_id, in self.liked_among_query(message_ids)}
+
+    def liked_among_query(self, message_ids):
+        """Query for which of `message_ids` this user has liked."""
+
+        return (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.query.get((self.id, other_user.id)) is not None
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?
+
+        Uses the set from `following_ids` if it's been loaded, otherwise
+        a primary key lookup on `follows`.
+        """
+
+        if self._following_ids is not None:
+            return other_user.id in self._following_ids
+
+        return Follows.query.get((other_user.id, self.id)) is not None
+
+    @classmethod
+    def active(cls):
+        """Query of users whose accounts haven't been deleted."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def adjust_counts(cls, user_ids, **deltas):
+        """Add `deltas` to counter columns, e.g. `likes_count=-1`.
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        `user_ids` is a user id, a list of ids, or a query of ids to adjust
+        in bulk. This is a single UPDATE in the caller's transaction, so
+        concurrent requests can't lose each other's changes.
+        """
+
+        if isinstance(user_ids, int):
+            users = cls.query.filter(cls.id == user_ids)
+        elif isinstance(user_ids, list):
+            users = cls.query.filter(cls.id.in_(user_ids))
+        else:
+            users = cls.query.filter(cls.id.in_(user_ids.subquery()))
+
+        users.update(
+            {getattr(cls, name): getattr(cls, name) + delta
+             for name, delta in deltas.items()},
+            synchronize_session=False,
+        )
+
+    @classmethod
+    def reconcile_counts(cls):
+        """Recompute every counter column from the rows it counts.
+
+        Returns the number of users whose counts had drifted.
+        """
+
+        def count(key):
+            return (db.session
+                    .query(db.func.count())
+                    .filter(key == cls.id)
+                    .correlate(cls)
+                    .as_scalar())
+
+        actual = {
+            cls.messages_count: count(Message.user_id),
+            cls.following_count: count(Follows.user_following_id),
+            cls.followers_count: count(Follows.user_being_followed_id),
+            cls.likes_count: count(Likes.user_id),
+        }
+
+        drifted = db.or_(*(column != value for column, value in actual.items()))
+
+        return (cls.query
+                .filter(drifted)
+                .update(actual, synchronize_session=False))
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +416,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -149,6 +428,13 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def by_username(cls, username):
+        """Query for the user called `username`, unless their account has
+        been deleted."""
+
+        return cls.active().filter_by(username=username)
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -158,13 +444,18 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash used an old work factor, it's replaced with one at
+        the current factor; the caller commits it along with anything else.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.by_username(username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -188,7 +479,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -197,8 +488,181 @@ class Message(db.Model):
         nullable=False,
     )
 
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        # for rebuilding the trending board from recent messages
+        db.Index('ix_messages_timestamp', 'timestamp'),
+    )
+
+    @classmethod
+    def visible(cls):
+        """Query of messages whose authors' accounts haven't been deleted,
+        loading the authors along with them."""
+
+        return (cls.query
+                .join(cls.user)
+                .filter(User.deleted_at.is_(None))
+                .options(db.contains_eager(cls.user)))
+
+    @classmethod
+    def liked_by(cls, user_id):
+        """Query of visible messages `user_id` has liked, most recent like
+        first."""
+
+        return (cls.visible()
+                .join(Likes, Likes.message_id == cls.id)
+                .filter(Likes.user_id == user_id)
+                .order_by(Likes.id.desc()))
+
+    @classmethod
+    def reconcile_counts(cls):
+        """Recompute `likes_count` for messages where it has drifted."""
+
+        actual = (db.session
+                  .query(db.func.count())
+                  .filter(Likes.message_id == cls.id)
+                  .correlate(cls)
+                  .as_scalar())
+
+        return (cls.query
+                .filter(cls.likes_count != actual)
+                .update({cls.likes_count: actual}, synchronize_session=False))
+
+
+class TimelineEntry(db.Model):
+    """A message pushed onto a user's precomputed home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # copied from the message so a page of the timeline is one index range scan
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp', 'user_id', 'timestamp'),
+        # for removing a message from every timeline it's on
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+
+class Job(db.Model):
+    """A background job in the durable queue (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # keyword arguments, as JSON
+    args = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # idempotency key: a second job with the same key isn't queued
+    key = db.Column(
+        db.Text,
+        unique=True,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default='queued',
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    # when a queued job is due, or a running job's lease runs out
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+class AccountPurge(db.Model):
+    """Progress purging a deleted account's rows (see purge.py)."""
+
+    __tablename__ = 'account_purges'
+
+    # no foreign key: the user's row is the last thing purged
+    user_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # the kind of rows being deleted now
+    step = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    rows_deleted = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    started_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -208,3 +672,4 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+    hasher.init_app(app)
@@ -0,0 +1,50 @@
+"""Keyset (cursor) pagination helpers.
+
+Lists are paged on a (timestamp, id) key rather than with OFFSET, so the
+hundredth page costs the same index range scan as the first. The cursor
+passed around in `?before=` is the key of the last item on a page.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import literal, tuple_
+
+
+def encode_cursor(timestamp, item_id):
+    """Cursor string for the item keyed by (`timestamp`, `item_id`)."""
+
+    return f"{timestamp.isoformat()}_{item_id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (timestamp, id) key.
+
+    Returns None for no cursor; raises ValueError for a malformed one.
+    """
+
+    if not cursor:
+        return None
+
+    timestamp, _, item_id = cursor.rpartition('_')
+    return datetime.fromisoformat(timestamp), int(item_id)
+
+
+def before(timestamp_col, id_col, key):
+    """Filter clause selecting rows strictly older than `key`."""
+
+    timestamp, item_id = key
+    return tuple_(timestamp_col, id_col) < tuple_(literal(timestamp), literal(item_id))
+
+
+def split_page(rows, per_page, key):
+    """Split `per_page + 1` fetched rows into (page, next cursor).
+
+    The extra row only tells us there is an older page; `key` gets the
+    (timestamp, id) of a row.
+    """
+
+    if len(rows) <= per_page:
+        return rows, None
+
+    rows = rows[:per_page]
+    return rows, encode_cursor(*key(rows[-1]))
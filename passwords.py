@@ -0,0 +1,95 @@
+"""Password hashing in a pool of worker processes.
+
+bcrypt is deliberately slow: a few hundred milliseconds of CPU per hash
+at the default work factor. Running it in the request thread lets a burst
+of logins take every core away from everything else. Instead, hashes are
+computed in PASSWORD_HASH_WORKERS processes, with at most twice that many
+waiting, so logins queue up rather than piling onto the CPU.
+
+The work factor is BCRYPT_LOG_ROUNDS. Hashes made with a different one
+still verify, and `needs_rehash` says when to replace them.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+class PasswordHasher:
+    """Hashes and checks passwords, in worker processes if configured.
+
+    Set up like a Flask extension: create it, then call `init_app`. Until
+    then (or with PASSWORD_HASH_WORKERS = 0) hashing runs inline.
+    """
+
+    def __init__(self, app=None, workers=0, rounds=12):
+        self.workers = workers
+        self.rounds = rounds
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(workers, 1) * 2)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.shutdown()
+
+        self.workers = app.config.setdefault('PASSWORD_HASH_WORKERS', 0)
+        self.rounds = app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) * 2)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self._lock:
+            if self._executor is None:
+                # spawn, not fork: the app has threads and open connections
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+
+        with self._slots:
+            return self._executor.submit(fn, *args).result()
+
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured work factor."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+        if not password:
+            return False
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than ours?"""
+
+        # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+        return int(hashed.split('$')[2]) != self.rounds
+
+    def shutdown(self):
+        """Stop the worker processes (they restart on the next hash)."""
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
@@ -0,0 +1,204 @@
+"""Deleting accounts: a tombstone now, the rows later.
+
+Deleting a user with `db.session.delete(user)` has the ORM load their
+messages, likes and follows to cascade to them, then delete the lot in
+one transaction that holds locks on the busiest tables until it's done.
+Instead `tombstone` just sets `users.deleted_at`, which hides the user
+and their messages everywhere at once (see `User.active`).
+
+The rows go afterwards in the `purge_user` background job, up to
+PURGE_BATCH_SIZE at a time, each batch in its own short transaction.
+Each batch also takes what it deletes out of other users' counters.
+Progress, the step and the number of rows deleted so far, is kept in
+`account_purges`. Every batch deletes the rows it has dealt with, so
+running the purge again after an interruption carries on where it
+stopped; `flask purge-accounts` does that for any left unfinished.
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from models import db, AccountPurge, Follows, Likes, Message, TimelineEntry, User
+
+
+def tombstone(user):
+    """Mark `user` deleted, to be purged. Commit, then enqueue `purge_user`."""
+
+    user.deleted_at = datetime.utcnow()
+    db.session.add(AccountPurge(user_id=user.id, step=STEPS[0][0], rows_deleted=0))
+
+
+def _locked(query, limit):
+    return query.limit(limit).with_for_update().all()
+
+
+def _following(user_id, limit):
+    """Follows by the user, out of the followed users' follower counts."""
+
+    followed = [followed_id for followed_id, in _locked(
+        db.session
+        .query(Follows.user_being_followed_id)
+        .filter(Follows.user_following_id == user_id), limit)]
+
+    if followed:
+        User.adjust_counts(followed, followers_count=-1)
+        (Follows.query
+         .filter(Follows.user_following_id == user_id,
+                 Follows.user_being_followed_id.in_(followed))
+         .delete(synchronize_session=False))
+
+    return len(followed)
+
+
+def _followers(user_id, limit):
+    """Follows of the user, out of their followers' following counts."""
+
+    followers = [follower_id for follower_id, in _locked(
+        db.session
+        .query(Follows.user_following_id)
+        .filter(Follows.user_being_followed_id == user_id), limit)]
+
+    if followers:
+        User.adjust_counts(followers, following_count=-1)
+        (Follows.query
+         .filter(Follows.user_being_followed_id == user_id,
+                 Follows.user_following_id.in_(followers))
+         .delete(synchronize_session=False))
+
+    return len(followers)
+
+
+def _likes(user_id, limit):
+    """The user's likes, out of the liked messages' counts."""
+
+    likes = _locked(db.session
+                    .query(Likes.id, Likes.message_id)
+                    .filter(Likes.user_id == user_id), limit)
+
+    if likes:
+        (Message.query
+         .filter(Message.id.in_([message_id for _, message_id in likes]))
+         .update({Message.likes_count: Message.likes_count - 1},
+                 synchronize_session=False))
+        (Likes.query
+         .filter(Likes.id.in_([like_id for like_id, _ in likes]))
+         .delete(synchronize_session=False))
+
+    return len(likes)
+
+
+def _messages(user_id, limit):
+    """The user's messages, with their likes and timeline entries."""
+
+    message_ids = [message_id for message_id, in _locked(
+        db.session
+        .query(Message.id)
+        .filter(Message.user_id == user_id), limit)]
+
+    if not message_ids:
+        return 0
+
+    likers = Counter(liker_id for liker_id, in (
+        db.session
+        .query(Likes.user_id)
+        .filter(Likes.message_id.in_(message_ids))))
+
+    # one UPDATE per distinct number of likes lost
+    by_count = {}
+    for liker_id, lost in likers.items():
+        by_count.setdefault(lost, []).append(liker_id)
+    for lost, liker_ids in by_count.items():
+        User.adjust_counts(liker_ids, likes_count=-lost)
+
+    deleted = (Likes.query
+               .filter(Likes.message_id.in_(message_ids))
+               .delete(synchronize_session=False))
+    deleted += (TimelineEntry.query
+                .filter(TimelineEntry.message_id.in_(message_ids))
+                .delete(synchronize_session=False))
+    deleted += (Message.query
+                .filter(Message.id.in_(message_ids))
+                .delete(synchronize_session=False))
+
+    return deleted
+
+
+def _timeline(user_id, limit):
+    """The user's own home timeline."""
+
+    message_ids = [message_id for message_id, in _locked(
+        db.session
+        .query(TimelineEntry.message_id)
+        .filter(TimelineEntry.user_id == user_id), limit)]
+
+    if not message_ids:
+        return 0
+
+    return (TimelineEntry.query
+            .filter(TimelineEntry.user_id == user_id,
+                    TimelineEntry.message_id.in_(message_ids))
+            .delete(synchronize_session=False))
+
+
+def _user(user_id, limit):
+    return (User.query
+            .filter(User.id == user_id)
+            .delete(synchronize_session=False))
+
+
+# (step, function deleting up to `limit` rows and returning how many), in order
+STEPS = [
+    ('following', _following),
+    ('followers', _followers),
+    ('likes', _likes),
+    ('messages', _messages),
+    ('timeline', _timeline),
+    ('user', _user),
+]
+
+
+def purge_batch(user_id, limit):
+    """Delete the next batch of up to `limit` of a deleted account's rows,
+    and commit. Returns False once there is nothing left to delete.
+    """
+
+    # the lock keeps two workers from purging the same account at once
+    progress = AccountPurge.query.with_for_update().get(user_id)
+
+    if progress is None or progress.finished_at:
+        db.session.rollback()
+        return False
+
+    names = [name for name, _ in STEPS]
+    step = names.index(progress.step)
+    deleted = STEPS[step][1](user_id, limit)
+
+    if deleted:
+        progress.rows_deleted += deleted
+    elif step + 1 < len(STEPS):
+        progress.step = names[step + 1]
+    else:
+        progress.finished_at = datetime.utcnow()
+
+    db.session.commit()
+    return True
+
+
+def unfinished():
+    """Purges not yet finished, oldest first."""
+
+    return (AccountPurge.query
+            .filter(AccountPurge.finished_at.is_(None))
+            .order_by(AccountPurge.started_at)
+            .all())
+
+
+def status():
+    """Unfinished purges: where each has got to, for /metrics."""
+
+    return [{
+        'user_id': progress.user_id,
+        'step': progress.step,
+        'rows_deleted': progress.rows_deleted,
+        'started_at': progress.started_at.isoformat(),
+    } for progress in unfinished()]
@@ -0,0 +1,322 @@
+"""Who to follow: users followed by the people you follow.
+
+A candidate's score is the number of people the user follows who follow
+them ("mutual connections"), with ties going to whoever has the most
+followers overall. Someone who follows nobody yet, or whose follows lead
+nowhere new, gets the most followed users instead.
+
+Answering that in SQL is a self-join of `follows` per page view, so the
+whole graph is kept in memory instead, as a compressed sparse row (CSR)
+matrix in two NumPy arrays: the accounts user `u` follows are
+`indices[indptr[u]:indptr[u + 1]]`. Scoring a user gathers the rows of
+everyone they follow, RECOMMEND_BATCH_EDGES edges at a time, and counts
+them with `np.bincount`.
+
+Loading the graph scans `follows`, so it is only done every
+RECOMMEND_GRAPH_SECONDS: the first time in the request that needs it
+(others arriving meanwhile wait for that load rather than start their
+own), after that in a background thread while the old graph carries on
+serving. Follows and unfollows made through this process in between are
+kept on the side (`followed`, `unfollowed`) and counted in, so they
+show up straight away; other processes' show up at their next reload.
+
+Each user's top RECOMMEND_COUNT are cached for RECOMMEND_CACHE_SECONDS,
+least recently used first out beyond RECOMMEND_CACHE_SIZE users. A
+user's own follow or unfollow drops their entry. Others whose
+suggestions it changes (their followers) see it once theirs expire.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from flask import current_app
+
+from models import db, CARD_COLUMNS, Follows, User
+
+# how many of the most followed users are kept, for those with no mutuals
+POPULAR = 100
+
+
+class FollowGraph:
+    """Who follows whom, as CSR arrays indexed by user id."""
+
+    def __init__(self, followers, followed, loaded_at):
+        # `followers` comes sorted, so the rows are already in order
+        size = int(max(followers.max(initial=0), followed.max(initial=0))) + 1
+
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(followers, minlength=size), out=self.indptr[1:])
+        self.indices = followed
+
+        self.in_degree = np.bincount(followed, minlength=size)
+        self.popular = np.argsort(-self.in_degree, kind='stable')[:POPULAR]
+        self.popular = self.popular[self.in_degree[self.popular] > 0]
+
+        self.loaded_at = loaded_at
+
+    @property
+    def size(self):
+        return len(self.indptr) - 1
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def load(cls, chunk_size=100000):
+        """Read the whole `follows` table, `chunk_size` rows at a time."""
+
+        loaded_at = time.monotonic()
+        result = db.session.execute(
+            db.select([Follows.user_following_id, Follows.user_being_followed_id])
+            .order_by(Follows.user_following_id, Follows.user_being_followed_id))
+
+        chunks = []
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+
+        edges = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.int64)
+        return cls(edges[:, 0].copy(), edges[:, 1].copy(), loaded_at)
+
+    def following(self, user_id):
+        """Ids `user_id` follows, as loaded."""
+
+        if user_id >= self.size:
+            return self.indices[:0]
+        return self.indices[self.indptr[user_id]:self.indptr[user_id + 1]]
+
+    def gather(self, rows):
+        """The rows `rows` of the matrix, end to end, in one array."""
+
+        rows = rows[rows < self.size]
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+
+        # position i of row k is at starts[k] + i
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.indices[offsets + np.arange(lengths.sum())]
+
+
+class Recommender:
+    """The follow graph, the follows made since it loaded, and a TTL/LRU
+    cache of each user's suggestions."""
+
+    def __init__(self):
+        self.app = None
+        self.graph = None
+        self._lock = threading.Lock()
+        # held while loading a graph when there is none
+        self._load_lock = threading.Lock()
+        self._loading = False
+        self.clear()
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMMEND_COUNT', 5)
+        app.config.setdefault('RECOMMEND_CACHE_SECONDS', 600)
+        app.config.setdefault('RECOMMEND_CACHE_SIZE', 10000)
+        app.config.setdefault('RECOMMEND_GRAPH_SECONDS', 3600)
+        app.config.setdefault('RECOMMEND_BATCH_EDGES', 1000000)
+        self.app = app
+
+    def clear(self):
+        """Forget the graph, the follows since and all cached suggestions."""
+
+        with self._lock:
+            self.graph = None
+            # follower id -> {followed id: (True if followed else False, when)}
+            self._changes = {}
+            self._cache = OrderedDict()
+            self.hits = 0
+            self.misses = 0
+
+    def reload(self):
+        """Load the graph afresh, keeping changes made while it loaded."""
+
+        graph = FollowGraph.load()
+
+        with self._lock:
+            self.graph = graph
+            self._changes = {
+                follower_id: kept for follower_id, kept in (
+                    (follower_id, {followed_id: change
+                                   for followed_id, change in changes.items()
+                                   if change[1] >= graph.loaded_at})
+                    for follower_id, changes in self._changes.items())
+                if kept
+            }
+            self._loading = False
+
+        return graph
+
+    def _reload_in_background(self, app):
+        try:
+            with app.app_context():
+                self.reload()
+        finally:
+            self._loading = False
+
+    def current_graph(self):
+        """The graph, loading it first if there is none yet, and starting a
+        background reload if it is older than RECOMMEND_GRAPH_SECONDS."""
+
+        graph = self.graph
+
+        if graph is None:
+            with self._load_lock:
+                # another request may have loaded it while this one waited
+                graph = self.graph
+                if graph is None:
+                    graph = self.reload()
+            return graph
+
+        age = time.monotonic() - graph.loaded_at
+        if age >= current_app.config['RECOMMEND_GRAPH_SECONDS']:
+            with self._lock:
+                start, self._loading = not self._loading, True
+            if start:
+                threading.Thread(target=self._reload_in_background,
+                                 args=(self.app,),
+                                 daemon=True).start()
+
+        return graph
+
+    def _change(self, user_id, other_id, followed):
+        with self._lock:
+            self._changes.setdefault(user_id, {})[other_id] = (followed, time.monotonic())
+            self._cache.pop(user_id, None)
+
+    def followed(self, user_id, other_id):
+        """Count in `user_id` having just followed `other_id`."""
+
+        self._change(user_id, other_id, True)
+
+    def unfollowed(self, user_id, other_id):
+        """Count in `user_id` having just stopped following `other_id`."""
+
+        self._change(user_id, other_id, False)
+
+    def _changes_for(self, user_ids):
+        with self._lock:
+            return {user_id: dict(self._changes[user_id])
+                    for user_id in user_ids if user_id in self._changes}
+
+    def _following(self, graph, user_id):
+        """Ids `user_id` follows now, as loaded plus changes since."""
+
+        following = graph.following(user_id)
+        changes = self._changes_for([user_id]).get(user_id)
+
+        if changes:
+            added = [other_id for other_id, (now, _) in changes.items() if now]
+            removed = [other_id for other_id, (now, _) in changes.items() if not now]
+            following = np.union1d(following[~np.isin(following, removed)],
+                                   np.array(added, dtype=np.int64))
+
+        return following
+
+    def score(self, user_id, count):
+        """Ids of up to `count` users to suggest to `user_id`, best first."""
+
+        graph = self.current_graph()
+        following = self._following(graph, user_id)
+
+        scores = np.zeros(graph.size, dtype=np.int64)
+        batch_edges = current_app.config['RECOMMEND_BATCH_EDGES']
+
+        # the rows of everyone followed, a bounded number of edges at a time
+        rows = following[following < graph.size]
+        edges_before = np.cumsum(np.diff(graph.indptr)[rows])
+        start = 0
+        while start < len(rows):
+            done = edges_before[start - 1] if start else 0
+            end = max(start + 1, int(np.searchsorted(
+                edges_before, done + batch_edges, side='right')))
+            scores += np.bincount(graph.gather(rows[start:end]), minlength=graph.size)
+            start = end
+
+        # follows made or dropped since the graph loaded, by those followed
+        for changes in self._changes_for(following.tolist()).values():
+            for other_id, (now, _) in changes.items():
+                if other_id < graph.size:
+                    scores[other_id] += 1 if now else -1
+
+        excluded = np.append(following, user_id)
+        scores[excluded[excluded < graph.size]] = 0
+
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > count:
+            candidates = candidates[np.argpartition(-scores[candidates], count - 1)[:count]]
+
+        # most mutuals first, then most followers
+        ranked = candidates[np.lexsort((-graph.in_degree[candidates], -scores[candidates]))]
+
+        if len(ranked) < count:
+            popular = graph.popular[~np.isin(graph.popular, np.append(excluded, ranked))]
+            ranked = np.append(ranked, popular[:count - len(ranked)])
+
+        return ranked.tolist()
+
+    def top(self, user_id):
+        """Ids of the RECOMMEND_COUNT users to suggest to `user_id`, cached."""
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._cache.get(user_id)
+            if entry and entry[0] > now:
+                self._cache.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # a few spare, in case some turn out deleted
+        config = current_app.config
+        ids = self.score(user_id, 2 * config['RECOMMEND_COUNT'])
+
+        with self._lock:
+            self._cache[user_id] = (now + config['RECOMMEND_CACHE_SECONDS'], ids)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > config['RECOMMEND_CACHE_SIZE']:
+                self._cache.popitem(last=False)
+
+        return ids
+
+    def suggestions(self, user):
+        """Up to RECOMMEND_COUNT users for `user` to follow, with just the
+        columns their cards need."""
+
+        ids = self.top(user.id)
+        if not ids:
+            return []
+
+        users = {u.id: u for u in (User.active()
+                                   .filter(User.id.in_(ids))
+                                   .options(db.load_only(*CARD_COLUMNS)))}
+
+        return [users[user_id] for user_id in ids
+                if user_id in users][:current_app.config['RECOMMEND_COUNT']]
+
+    def stats(self):
+        graph = self.graph
+        with self._lock:
+            return {
+                'users': graph.size if graph else 0,
+                'follows': graph.edges if graph else 0,
+                'age_seconds': round(time.monotonic() - graph.loaded_at) if graph else None,
+                'changes': sum(len(changes) for changes in self._changes.values()),
+                'cached': len(self._cache),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+recommender = Recommender()
+
+
+def init_app(app):
+    recommender.init_app(app)
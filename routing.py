@@ -0,0 +1,106 @@
+"""Sending read-only requests to database replicas.
+
+With DATABASE_REPLICA_URLS set, each GET or HEAD request picks one of the
+replicas and the session runs its queries there. Anything that writes
+(a flush, or an INSERT, UPDATE or DELETE statement) goes to the primary,
+and so does every query after it in the same request. Other methods,
+CLI commands and code outside a request only use the primary.
+
+Replicas lag behind the primary, so a browser that has just written
+something reads from the primary for the next REPLICA_LAG_SECONDS: the
+time of its last write is kept in its session cookie. That way you see
+your own message straight after posting it, or the user you just
+followed in your list.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+
+# session cookie key for when this browser last wrote to the database
+WROTE_AT_KEY = '_db_wrote_at'
+
+READ_METHODS = {'GET', 'HEAD'}
+
+
+def replica_binds(app):
+    """Bind keys of the replicas configured for `app`."""
+
+    return [key for key in app.config['SQLALCHEMY_BINDS'] or {}
+            if key.startswith('replica')]
+
+
+def engines(app):
+    """{name: engine} for the primary and each replica."""
+
+    db = app.extensions['sqlalchemy'].db
+
+    found = {'primary': db.get_engine(app)}
+    for bind in replica_binds(app):
+        found[bind] = db.get_engine(app, bind=bind)
+
+    return found
+
+
+class RoutingSession(SignallingSession):
+    """Session querying the request's replica, and writing to the primary."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            _wrote()
+        else:
+            bind = has_request_context() and g.get('db_replica')
+            if bind:
+                return self.db.get_engine(self.app, bind=bind)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _wrote():
+    if has_request_context():
+        # later reads in this request must see the write too
+        g.db_replica = None
+        g.db_wrote = True
+
+
+def _choose_bind():
+    g.db_replica = None
+    g.db_wrote = False
+
+    binds = replica_binds(current_app)
+    if not binds or request.method not in READ_METHODS:
+        return
+
+    lag = current_app.config['REPLICA_LAG_SECONDS']
+    if time.time() - session.get(WROTE_AT_KEY, 0) < lag:
+        return
+
+    g.db_replica = random.choice(binds)
+
+
+def _note_write(response):
+    if not replica_binds(current_app):
+        return response
+
+    if g.get('db_wrote') or request.method not in READ_METHODS:
+        session[WROTE_AT_KEY] = time.time()
+
+    return response
+
+
+def init_app(app):
+    app.before_request(_choose_bind)
+    app.after_request(_note_write)
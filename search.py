@@ -0,0 +1,242 @@
+"""Search over usernames, bios and message text.
+
+Text is split into lowercase words, and a search matches documents that
+have a word starting with each search term ("wat" finds "water bottle").
+Results are ranked and come back a page at a time.
+
+On Postgres this is native full-text search over GIN-indexed tsvectors.
+Other databases (SQLite in development) get `InvertedIndex`, an in-process
+stand-in built from the tables on first use and kept up to date by the
+views that change users and messages.
+"""
+
+import re
+import threading
+from bisect import bisect_left
+
+from sqlalchemy import DDL, event
+
+from models import db, User, Message
+
+# Postgres documents; the GIN indexes below are on exactly these expressions
+USER_DOCUMENT = "to_tsvector('simple', username || ' ' || coalesce(bio, ''))"
+MESSAGE_DOCUMENT = "to_tsvector('simple', text)"
+
+event.listen(
+    User.__table__, 'after_create',
+    DDL(f"CREATE INDEX ix_users_search ON users USING gin (({USER_DOCUMENT}))")
+    .execute_if(dialect='postgresql'))
+
+event.listen(
+    Message.__table__, 'after_create',
+    DDL(f"CREATE INDEX ix_messages_search ON messages USING gin (({MESSAGE_DOCUMENT}))")
+    .execute_if(dialect='postgresql'))
+
+
+def words(text):
+    """Lowercase words in `text`, split the way Postgres' parser does."""
+
+    return re.findall(r'[^\W_]+', (text or '').lower())
+
+
+class InvertedIndex:
+    """In-process word index used when the database can't search itself.
+
+    Maps every word to the ids of the documents containing it, and keeps
+    the words sorted so a prefix is a contiguous run found by bisection.
+    """
+
+    def __init__(self, load):
+        """`load()` yields (id, text) for every document to index."""
+
+        self._load = load
+        self._lock = threading.Lock()
+        self._docs = None
+        self._postings = {}
+        self._words = []
+
+    def _ensure_loaded(self):
+        if self._docs is None:
+            self._docs = {}
+            for doc_id, text in self._load():
+                self._add(doc_id, text)
+
+    def _add(self, doc_id, text):
+        self._remove(doc_id)
+        doc_words = set(words(text))
+        self._docs[doc_id] = doc_words
+
+        for word in doc_words:
+            if word not in self._postings:
+                self._postings[word] = set()
+                self._words.insert(bisect_left(self._words, word), word)
+            self._postings[word].add(doc_id)
+
+    def _remove(self, doc_id):
+        for word in self._docs.pop(doc_id, ()):
+            self._postings[word].discard(doc_id)
+
+    def add(self, doc_id, text):
+        """Index (or re-index) document `doc_id`."""
+
+        with self._lock:
+            if self._docs is not None:
+                self._add(doc_id, text)
+
+    def remove(self, doc_id):
+        """Stop returning document `doc_id`."""
+
+        with self._lock:
+            if self._docs is not None:
+                self._remove(doc_id)
+
+    def _prefixed(self, term):
+        """Ids of documents with a word starting with `term`, and which
+        of those have `term` as a whole word."""
+
+        matches = set()
+        start = bisect_left(self._words, term)
+
+        for word in self._words[start:]:
+            if not word.startswith(term):
+                break
+            matches |= self._postings[word]
+
+        return matches, self._postings.get(term, set())
+
+    def search(self, terms, limit, offset):
+        """Ids of documents matching every term, best first."""
+
+        with self._lock:
+            self._ensure_loaded()
+
+            found = None
+            scores = {}
+
+            for term in terms:
+                matches, exact = self._prefixed(term)
+                found = matches if found is None else found & matches
+
+                for doc_id in exact:
+                    scores[doc_id] = scores.get(doc_id, 0) + 1
+
+            ranked = sorted(found or (),
+                            key=lambda doc_id: (scores.get(doc_id, 0), doc_id),
+                            reverse=True)
+
+            return ranked[offset:offset + limit]
+
+
+def _load_users():
+    rows = (db.session
+            .query(User.id, User.username, User.bio)
+            .filter(User.deleted_at.is_(None))
+            .yield_per(1000))
+    return ((user_id, f"{username} {bio or ''}") for user_id, username, bio in rows)
+
+
+def _load_messages():
+    return (db.session
+            .query(Message.id, Message.text)
+            .join(User, User.id == Message.user_id)
+            .filter(User.deleted_at.is_(None))
+            .yield_per(1000))
+
+
+user_index = InvertedIndex(_load_users)
+message_index = InvertedIndex(_load_messages)
+
+
+def _native():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def _tsquery(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _ranked(model, rows, document, terms, limit, offset):
+    """Page of `rows` (a query of `model`) whose `document` matches every
+    term (Postgres)."""
+
+    document = db.literal_column(document)
+    query = db.func.to_tsquery('simple', _tsquery(terms))
+
+    return (rows
+            .filter(document.op('@@')(query))
+            .order_by(db.func.ts_rank(document, query).desc(), model.id.desc())
+            .limit(limit)
+            .offset(offset))
+
+
+def _in_order(model, rows, index, terms, limit, offset):
+    """Page of `rows` (a query of `model`) matching every term in `index`.
+
+    Ids the index has that `rows` leaves out (an account deleted since,
+    perhaps by another process) are dropped from the index and the page
+    read again, so it isn't short of them.
+    """
+
+    while True:
+        ids = index.search(terms, limit, offset)
+        if not ids:
+            return []
+
+        found = {row.id: row for row in rows.filter(model.id.in_(ids))}
+        missing = [row_id for row_id in ids if row_id not in found]
+        if not missing:
+            return [found[row_id] for row_id in ids]
+
+        for row_id in missing:
+            index.remove(row_id)
+
+
+def search_users(text, limit, offset=0):
+    """Users whose username or bio matches `text`, best first."""
+
+    terms = words(text)
+    if not terms:
+        return []
+
+    if _native():
+        return _ranked(User, User.active(), USER_DOCUMENT, terms, limit, offset).all()
+
+    return _in_order(User, User.active(), user_index, terms, limit, offset)
+
+
+def search_messages(text, limit, offset=0):
+    """Messages whose text matches `text`, best first, with their authors."""
+
+    terms = words(text)
+    if not terms:
+        return []
+
+    if _native():
+        return _ranked(Message, Message.visible(), MESSAGE_DOCUMENT, terms,
+                       limit, offset).all()
+
+    return _in_order(Message, Message.visible(), message_index, terms, limit, offset)
+
+
+def index_user(user):
+    """Keep the in-process index in step after `user` is saved."""
+
+    user_index.add(user.id, f"{user.username} {user.bio or ''}")
+
+
+def index_message(msg):
+    """Keep the in-process index in step after `msg` is posted."""
+
+    message_index.add(msg.id, msg.text)
+
+
+def forget_message(message_id):
+    """Drop a deleted message from the in-process index."""
+
+    message_index.remove(message_id)
+
+
+def forget_user(user_id):
+    """Drop a deleted user from the in-process index."""
+
+    user_index.remove(user_id)
@@ -1,20 +1,25 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+    python seed.py                     rebuild the schema and load generator/
+    python seed.py --resume            carry on after a failed load
+    python seed.py --data-dir DIR      load DIR/users.csv etc. instead
+"""
 
+import argparse
 
-db.drop_all()
-db.create_all()
+from app import app, db
+import loader
+import migrations
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument('--data-dir', default='generator')
+parser.add_argument('--chunk-size', type=int, default=loader.CHUNK_SIZE)
+parser.add_argument('--resume', action='store_true',
+                    help="keep loaded rows and continue where the last run stopped")
+args = parser.parse_args()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+if not args.resume:
+    migrations.reset(db.engine)
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
-
-db.session.commit()
+with app.app_context():
+    loader.load(args.data_dir, args.chunk_size, args.resume)
@@ -0,0 +1,194 @@
+"""Per-request SQL statistics.
+
+Every statement run while handling a request is counted and timed, using
+SQLAlchemy's cursor events. For each request we keep the number of
+statements, total time in the database and the slowest few; these go out
+as response headers when SQL_STATS_HEADERS is on (outside production) and
+are added up per endpoint for `summary()`, served at /metrics.
+
+In strict mode (SQL_STRICT), a request that runs the same statement
+SQL_REPEAT_LIMIT or more times is logged as a likely N+1 query: that is
+what lazy-loading `msg.user` for each message on a page looks like.
+Statements are compared with their bind parameters left out, so loading
+user 1 and then user 2 counts as the same statement twice.
+
+A streamed page (see `stream_template` in app.py) runs most of its
+queries after the headers have gone, while the template renders. Its
+statistics are added up when the stream is closed, and it gets no
+headers, which could only count the queries run before the body.
+"""
+
+import heapq
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# how many of the slowest statements to keep, per request and overall
+SLOWEST = 5
+
+
+class RequestStats:
+    """SQL statements run by one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = []
+        self.shapes = {}
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement] = self.shapes.get(statement, 0) + 1
+
+        if len(self.slowest) < SLOWEST:
+            heapq.heappush(self.slowest, (seconds, statement))
+        else:
+            heapq.heappushpop(self.slowest, (seconds, statement))
+
+    def repeated(self, limit):
+        """{statement: times run} for statements run `limit` or more times."""
+
+        return {statement: times for statement, times in self.shapes.items()
+                if times >= limit}
+
+
+class Totals:
+    """Per-endpoint sums of RequestStats, shared by all threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+            self._slowest = []
+
+    def add(self, endpoint, stats, repeated):
+        with self._lock:
+            totals = self._endpoints.setdefault(endpoint, {
+                'requests': 0, 'queries': 0, 'seconds': 0.0,
+                'max_queries': 0, 'repeated': 0,
+            })
+            totals['requests'] += 1
+            totals['queries'] += stats.count
+            totals['seconds'] += stats.seconds
+            totals['max_queries'] = max(totals['max_queries'], stats.count)
+            totals['repeated'] += bool(repeated)
+
+            for seconds, statement in stats.slowest:
+                entry = (seconds, statement, endpoint)
+                if len(self._slowest) < SLOWEST:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heappushpop(self._slowest, entry)
+
+    def summary(self):
+        with self._lock:
+            endpoints = {
+                endpoint: {
+                    'requests': totals['requests'],
+                    'queries_per_request': round(totals['queries'] / totals['requests'], 2),
+                    'max_queries': totals['max_queries'],
+                    'db_ms_per_request': round(totals['seconds'] * 1000 / totals['requests'], 2),
+                    'requests_with_repeats': totals['repeated'],
+                }
+                for endpoint, totals in self._endpoints.items()
+            }
+            slowest = [
+                {'ms': round(seconds * 1000, 2), 'endpoint': endpoint,
+                 'statement': statement}
+                for seconds, statement, endpoint in sorted(self._slowest, reverse=True)
+            ]
+
+        return {'endpoints': endpoints, 'slowest': slowest}
+
+
+totals = Totals()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _started(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('sqlstats_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info['sqlstats_started'].pop()
+
+    if has_request_context() and 'sql' in g:
+        g.sql.record(statement, seconds)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _failed(context):
+    conn = context.connection
+    started = conn.info.get('sqlstats_started') if conn is not None else None
+    if started:
+        started.pop()
+
+
+def _start_request():
+    g.sql = RequestStats()
+
+
+def _finish(app, endpoint, stats):
+    """Log repeats and add `stats` to the totals; returns the repeats."""
+
+    config = app.config
+
+    repeated = {}
+    if config['SQL_STRICT']:
+        repeated = stats.repeated(config['SQL_REPEAT_LIMIT'])
+        for statement, times in repeated.items():
+            app.logger.warning(
+                "%s ran the same statement %d times (N+1 query?): %s",
+                endpoint, times, statement)
+
+    totals.add(endpoint or '(no endpoint)', stats, repeated)
+    return repeated
+
+
+def _finish_request(response):
+    stats = g.get('sql')
+    if stats is None:
+        return response
+
+    if response.is_streamed:
+        # g.sql stays put, so the template's queries are counted as it renders
+        app = current_app._get_current_object()
+        endpoint = request.endpoint
+        response.call_on_close(lambda: _finish(app, endpoint, stats))
+        return response
+
+    del g.sql
+    repeated = _finish(current_app, request.endpoint, stats)
+
+    if current_app.config['SQL_STATS_HEADERS']:
+        response.headers['X-SQL-Queries'] = str(stats.count)
+        response.headers['Server-Timing'] = f"db;dur={stats.seconds * 1000:.1f}"
+        if repeated:
+            response.headers['X-SQL-Repeated'] = str(max(repeated.values()))
+
+    return response
+
+
+def init_app(app):
+    """Collect statistics for every request to `app`."""
+
+    app.config.setdefault('SQL_STATS_HEADERS', False)
+    app.config.setdefault('SQL_STRICT', False)
+    app.config.setdefault('SQL_REPEAT_LIMIT', 3)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def summary():
+    """Per-endpoint statistics since startup, and the slowest statements."""
+
+    return totals.summary()
@@ -0,0 +1,85 @@
+"""Background tasks the views enqueue after committing (see jobs.py).
+
+Each may run some time after the request that queued it, and possibly
+more than once, so it re-reads what it needs and checks it still holds.
+"""
+
+import time
+
+from flask import current_app
+
+import jobs
+from jobs import task
+from models import db, Follows, Message, TimelineEntry
+import purge
+import timeline
+
+
+@task
+def fan_out(message_id):
+    """Push a newly posted message onto timelines."""
+
+    msg = Message.query.get(message_id)
+
+    # deleted since, or its author's account was
+    if msg is None or msg.user.deleted_at:
+        return
+
+    # fanned out by an earlier run: the author's entry goes in with the rest
+    if TimelineEntry.query.get((msg.user_id, msg.id)):
+        return
+
+    timeline.fan_out(msg)
+
+
+def _following(user_id, author_id):
+    return (db.session
+            .query(Follows)
+            .filter_by(user_following_id=user_id, user_being_followed_id=author_id)
+            .first()) is not None
+
+
+@task
+def backfill(user_id, author_id):
+    """Copy a newly followed author's messages onto the follower's timeline."""
+
+    # unfollowed again since
+    if not _following(user_id, author_id):
+        return
+
+    # clear out an earlier run's copies, and anything fanned out meanwhile
+    timeline.remove_author(user_id, author_id)
+    timeline.backfill(user_id, author_id)
+
+
+@task
+def remove_author(user_id, author_id):
+    """Take an unfollowed author's messages off the follower's timeline."""
+
+    # followed again since: the backfill queued then keeps them
+    if _following(user_id, author_id):
+        return
+
+    timeline.remove_author(user_id, author_id)
+
+
+@task
+def maintain_timelines():
+    """Mark and unmark celebrities, then trim timelines."""
+
+    timeline.update_celebrities()
+    timeline.trim()
+
+
+@task
+def purge_user(user_id):
+    """Delete a deleted account's rows, a batch at a time."""
+
+    batch_size = current_app.config['PURGE_BATCH_SIZE']
+    deadline = time.monotonic() + current_app.config['PURGE_JOB_SECONDS']
+
+    while purge.purge_batch(user_id, batch_size):
+        if time.monotonic() >= deadline:
+            # let other jobs have the worker; a new job carries on
+            jobs.enqueue('purge_user', user_id=user_id)
+            return
@@ -0,0 +1,136 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+
+class APITestCase(AppTestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        super().setUp()
+
+        author = User.signup('author', 'author@email.com', 'password', None)
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        User.reconcile_counts()
+        db.session.commit()
+
+        for n in range(3):
+            self.call('post', '/messages/new', self.author_id, data={'text': f'msg {n}'})
+
+        self.message_ids = [msg.id for msg in Message.query.order_by(Message.id)]
+
+    def call(self, method, url, user_id=None, **kwargs):
+        with self.client as c:
+            if user_id:
+                self.login(c, user_id)
+
+            return getattr(c, method)(url, **kwargs)
+
+    def test_login_required(self):
+        resp = app.test_client().get('/api/v1/timeline')
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn('error', resp.get_json())
+
+    def test_timeline_pages(self):
+        """The timeline comes a page at a time, newest first."""
+
+        self.configure(MESSAGES_PER_PAGE=2)
+
+        resp = self.call('get', '/api/v1/timeline', self.reader_id)
+        data = resp.get_json()
+
+        self.assertNotIn(b'\n', resp.data)
+        self.assertEqual([msg['text'] for msg in data['messages']], ['msg 2', 'msg 1'])
+        self.assertEqual(data['messages'][0]['author']['username'], 'author')
+        self.assertFalse(data['messages'][0]['liked'])
+
+        data = self.call('get', f"/api/v1/timeline?before={data['next']}",
+                         self.reader_id).get_json()
+        self.assertEqual([msg['text'] for msg in data['messages']], ['msg 0'])
+        self.assertIsNone(data['next'])
+
+    def test_fields(self):
+        """?fields= picks the fields returned."""
+
+        data = self.call('get', f'/api/v1/users/{self.author_id}/messages?fields=id,text',
+                         self.reader_id).get_json()
+        self.assertEqual(set(data['messages'][0]), {'id', 'text'})
+
+        resp = self.call('get', '/api/v1/timeline?fields=id,password', self.reader_id)
+        self.assertEqual(resp.status_code, 400)
+
+    def test_profile(self):
+        data = self.call('get', f'/api/v1/users/{self.author_id}', self.reader_id).get_json()
+
+        self.assertEqual(data['username'], 'author')
+        self.assertEqual(data['messages_count'], 3)
+        self.assertEqual(data['followers_count'], 1)
+        self.assertTrue(data['is_following'])
+        self.assertNotIn('password', data)
+
+        resp = self.call('get', '/api/v1/users/999999', self.reader_id)
+        self.assertEqual(resp.status_code, 404)
+
+    def test_follow_lists(self):
+        data = self.call('get', f'/api/v1/users/{self.author_id}/followers',
+                         self.reader_id).get_json()
+        self.assertEqual([user['username'] for user in data['users']], ['reader'])
+
+        data = self.call('get', f'/api/v1/users/{self.reader_id}/following?fields=id',
+                         self.reader_id).get_json()
+        self.assertEqual(data['users'], [{'id': self.author_id}])
+
+    def test_follow_list_pages(self):
+        self.configure(USERS_PER_PAGE=1)
+
+        other = User.signup('other', 'other@email.com', 'password', None)
+        db.session.commit()
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=other.id))
+        db.session.commit()
+
+        url = f'/api/v1/users/{self.author_id}/followers'
+        data = self.call('get', url, self.reader_id).get_json()
+        self.assertEqual([user['username'] for user in data['users']], ['other'])
+
+        data = self.call('get', f"{url}?before={data['next']}", self.reader_id).get_json()
+        self.assertEqual([user['username'] for user in data['users']], ['reader'])
+        self.assertIsNone(data['next'])
+
+    def test_like(self):
+        """Liking toggles, and you can't like your own messages."""
+
+        url = f'/api/v1/messages/{self.message_ids[0]}/like'
+
+        self.assertEqual(self.call('post', url, self.reader_id).get_json(),
+                         {'liked': True, 'likes_count': 1})
+        self.assertEqual(self.call('post', url, self.reader_id).get_json(),
+                         {'liked': False, 'likes_count': 0})
+
+        self.assertEqual(self.call('post', url, self.author_id).status_code, 403)
+        self.assertEqual(self.call('post', '/api/v1/messages/999999/like',
+                                   self.reader_id).status_code, 404)
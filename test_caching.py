@@ -0,0 +1,143 @@
+"""HTTP caching tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+import os
+from unittest import TestCase
+
+from flask import url_for
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import caching
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+
+class StaticCachingTestCase(TestCase):
+    """Fingerprinted static URLs."""
+
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_url_for(self):
+        """Static URLs carry a fingerprint of the file."""
+
+        with app.test_request_context():
+            url = url_for('static', filename='stylesheets/style.css')
+            digest = caching.fingerprint('stylesheets/style.css')
+
+        self.assertIn(f'?v={digest}', url)
+
+    def test_immutable(self):
+        """The current fingerprint is cached for good."""
+
+        with app.test_request_context():
+            url = url_for('static', filename='stylesheets/style.css')
+
+        resp = self.client.get(url)
+        self.assertIn('immutable', resp.headers['Cache-Control'])
+
+    def test_unversioned(self):
+        """Other static URLs are cached briefly, not marked no-store."""
+
+        resp = self.client.get('/static/images/default-pic.png')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+        self.assertNotIn('no-store', resp.headers['Cache-Control'])
+
+        resp = self.client.get('/static/images/default-pic.png?v=stale')
+        self.assertNotIn('immutable', resp.headers['Cache-Control'])
+
+
+class ConditionalGetTestCase(AppTestCase):
+    """ETags on profile and message pages."""
+
+    def setUp(self):
+        super().setUp()
+
+        author = User.signup('author', 'author@email.com', 'password', None)
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        msg = Message(text='hello', user_id=self.author_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.message_id = msg.id
+
+    def get(self, url, etag=None):
+        with self.client as c:
+            self.login(c, self.reader_id)
+
+            headers = {'If-None-Match': etag} if etag else {}
+            return c.get(url, headers=headers)
+
+    def test_profile_not_modified(self):
+        """A matching If-None-Match gets an empty 304."""
+
+        resp = self.get(f'/users/{self.author_id}')
+        etag = resp.headers['ETag']
+        self.assertEqual(resp.status_code, 200)
+
+        resp = self.get(f'/users/{self.author_id}', etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b'')
+
+    def test_profile_changes(self):
+        """Following the user changes the page, and so the ETag."""
+
+        etag = self.get(f'/users/{self.author_id}').headers['ETag']
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            c.post(f'/users/follow/{self.author_id}')
+
+        resp = self.get(f'/users/{self.author_id}', etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Unfollow', resp.get_data(as_text=True))
+
+    def test_message_not_modified(self):
+        """Message pages are tagged too; missing ones are 404s."""
+
+        etag = self.get(f'/messages/{self.message_id}').headers['ETag']
+
+        self.assertEqual(self.get(f'/messages/{self.message_id}', etag).status_code, 304)
+        self.assertEqual(self.get('/messages/999999').status_code, 404)
+
+    def test_new_build(self):
+        """A new build changes every ETag."""
+
+        etag = self.get(f'/users/{self.author_id}').headers['ETag']
+
+        self.configure(BUILD_VERSION='next')
+        resp = self.get(f'/users/{self.author_id}', etag)
+
+        self.assertEqual(resp.status_code, 200)
+
+    def test_flashes_not_tagged(self):
+        """A page showing flashed messages isn't cached."""
+
+        etag = self.get(f'/users/{self.author_id}').headers['ETag']
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.reader_id
+                sess['_flashes'] = [('success', 'Hi!')]
+
+            resp = c.get(f'/users/{self.author_id}', headers={'If-None-Match': etag})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('ETag', resp.headers)
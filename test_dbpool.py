@@ -0,0 +1,87 @@
+"""Connection pool tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_dbpool.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import dbpool
+
+db.create_all()
+
+URI = "postgresql:///warbler-test"
+
+
+def config(uri=URI, **settings):
+    base = {
+        'SQLALCHEMY_DATABASE_URI': uri,
+        'DB_POOL_SIZE': 1,
+        'DB_MAX_OVERFLOW': 0,
+        'DB_POOL_TIMEOUT': 1,
+        'DB_POOL_RECYCLE': 60,
+        'DB_POOL_PRE_PING': True,
+        'DB_STATEMENT_TIMEOUT_MS': 0,
+    }
+    base.update(settings)
+    return base
+
+
+class EngineOptionsTestCase(TestCase):
+    def test_sqlite(self):
+        """SQLite keeps Flask-SQLAlchemy's own pool choice."""
+
+        self.assertEqual(dbpool.engine_options(config('sqlite:///warbler.db')), {})
+
+    def test_statement_timeout(self):
+        """Statements running past DB_STATEMENT_TIMEOUT_MS are cancelled."""
+
+        engine = create_engine(
+            URI, **dbpool.engine_options(config(DB_STATEMENT_TIMEOUT_MS=100)))
+
+        with self.assertRaises(exc.OperationalError):
+            engine.execute('SELECT pg_sleep(1)')
+
+        engine.dispose()
+
+    def test_waits(self):
+        """Checkouts are timed, and running out of connections counted."""
+
+        engine = create_engine(URI, **dbpool.engine_options(config()))
+        conn = engine.connect()
+
+        status = dbpool.status(engine)
+        self.assertEqual(status['checked_out'], 1)
+        self.assertEqual(status['idle'], 0)
+
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+
+        conn.close()
+        engine.dispose()
+
+        status = dbpool.status(engine)
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['wait']['checkouts'], 2)
+        self.assertEqual(status['wait']['timeouts'], 1)
+        self.assertGreaterEqual(status['wait']['max_ms'], 1000)
+
+
+class ReadyTestCase(TestCase):
+    def test_ready(self):
+        resp = app.test_client().get('/health/ready')
+        data = resp.get_json()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(data['ready'])
+        self.assertEqual(data['db_pool']['primary']['pool'], 'TimedQueuePool')
+        self.assertIn('idle', data['db_pool']['primary'])
@@ -0,0 +1,87 @@
+"""Followers and following page tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_follow_pages.py
+
+
+import os
+import re
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowPagesTestCase(AppTestCase):
+    """Follow lists come a page at a time, in a fixed number of queries."""
+
+    def setUp(self):
+        super().setUp()
+
+        users = [User.signup(f'user{n}', f'user{n}@email.com', 'password', None)
+                 for n in range(6)]
+        db.session.commit()
+        self.ids = [user.id for user in users]
+        self.star_id, self.viewer_id = self.ids[0], self.ids[1]
+
+        # everyone follows the star; the viewer also follows user2
+        db.session.add_all(
+            [Follows(user_being_followed_id=self.star_id, user_following_id=user_id)
+             for user_id in self.ids[1:]]
+            + [Follows(user_being_followed_id=self.ids[2], user_following_id=self.viewer_id)])
+        User.reconcile_counts()
+        db.session.commit()
+
+        self.configure(USERS_PER_PAGE=2, SQL_STATS_HEADERS=True)
+
+    def get(self, url):
+        with self.client as c:
+            self.login(c, self.viewer_id)
+            return c.get(url)
+
+    def test_pages(self):
+        """Newest followers first; `before` walks through the rest."""
+
+        seen = []
+        url = f'/users/{self.star_id}/followers'
+
+        while url:
+            html = self.get(url).get_data(as_text=True)
+            seen += [int(n) for n in re.findall(r'<p>@user(\d+)</p>', html)]
+
+            more = re.search(r'followers\?before=(\d+)', html)
+            url = more and f'/users/{self.star_id}/followers?before={more.group(1)}'
+
+        self.assertEqual(seen, [5, 4, 3, 2, 1])
+
+    def test_follow_state(self):
+        """The viewer's follow buttons reflect who they follow."""
+
+        html = self.get(f'/users/{self.viewer_id}/following').get_data(as_text=True)
+
+        self.assertIn(f'/users/stop-following/{self.ids[2]}', html)
+        self.assertIn(f'/users/stop-following/{self.star_id}', html)
+
+        html = self.get(f'/users/{self.star_id}/followers?before={self.ids[4]}'
+                        ).get_data(as_text=True)
+
+        self.assertIn(f'/users/stop-following/{self.ids[2]}', html)
+        self.assertIn(f'/users/follow/{self.ids[3]}', html)
+
+    def test_queries_per_page(self):
+        """A page runs the same queries however many followers there are."""
+
+        self.get(f'/users/{self.viewer_id}')  # caches the viewer
+
+        first = int(self.get(f'/users/{self.star_id}/followers').headers['X-SQL-Queries'])
+        few = int(self.get(f'/users/{self.ids[2]}/followers').headers['X-SQL-Queries'])
+
+        self.assertEqual(first, few)
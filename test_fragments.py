@@ -0,0 +1,146 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from fragments import Fragment, FragmentCache
+import fragments
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+
+class FragmentCacheTestCase(TestCase):
+    """The LRU cache itself."""
+
+    def test_version(self):
+        """Entries only come back for the version they were stored at."""
+
+        cache = FragmentCache(100)
+        cache.put(('user', 1), 0, Fragment('<a>', '</a>'))
+
+        self.assertEqual(cache.get(('user', 1), 0), ('<a>', '</a>'))
+        self.assertIsNone(cache.get(('user', 1), 1))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_size_cap(self):
+        """The least recently used entries go first to stay under the cap."""
+
+        cache = FragmentCache(10)
+        cache.put('a', 0, Fragment('aaaa', ''))
+        cache.put('b', 0, Fragment('bbbb', ''))
+        cache.get('a', 0)
+        cache.put('c', 0, Fragment('cccc', ''))
+
+        self.assertIsNotNone(cache.get('a', 0))
+        self.assertIsNone(cache.get('b', 0))
+        self.assertIsNotNone(cache.get('c', 0))
+        self.assertEqual(cache.size, 8)
+
+        cache.put('d', 0, Fragment('d' * 11, ''))
+        self.assertIsNone(cache.get('d', 0))
+
+
+class FragmentViewTestCase(AppTestCase):
+    """Cached items on real pages."""
+
+    def setUp(self):
+        super().setUp()
+
+        author = User.signup('author', 'author@email.com', 'password', None)
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        db.session.add(Follows(user_being_followed_id=self.author_id,
+                               user_following_id=self.reader_id))
+        db.session.commit()
+
+        self.post(self.author_id, 'cached hello')
+        self.message_id = Message.query.one().id
+
+    def post(self, user_id, text):
+        with self.client as c:
+            self.login(c, user_id)
+            c.post('/messages/new', data={'text': text})
+
+    def home(self, user_id):
+        with self.client as c:
+            self.login(c, user_id)
+            return c.get('/').get_data(as_text=True)
+
+    def test_reused(self):
+        """The second page view renders the message from the cache."""
+
+        self.home(self.reader_id)
+        hits = fragments.cache.stats()['hits']
+        html = self.home(self.reader_id)
+
+        self.assertIn('cached hello', html)
+        self.assertGreater(fragments.cache.stats()['hits'], hits)
+
+    def test_like_button_per_viewer(self):
+        """Each viewer sees their own like state around the shared item."""
+
+        db.session.add(Likes(user_id=self.reader_id, message_id=self.message_id))
+        db.session.commit()
+
+        self.assertIn('btn-primary', self.home(self.reader_id))
+        self.assertNotIn('btn-primary', self.home(self.author_id))
+
+    def test_profile_edit(self):
+        """Changing a profile re-renders the author's messages."""
+
+        self.home(self.reader_id)
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post('/users/profile', data={
+                'username': 'renamed', 'email': 'author@email.com',
+                'password': 'password',
+            })
+
+        html = self.home(self.reader_id)
+        self.assertIn('@renamed', html)
+        self.assertNotIn('@author', html)
+
+    def test_delete_message(self):
+        """Deleting a message drops its item."""
+
+        self.home(self.reader_id)
+        self.assertIn(('message', self.message_id), fragments.cache._entries)
+
+        with self.client as c:
+            self.login(c, self.author_id)
+            c.post(f'/messages/{self.message_id}/delete')
+
+        self.assertNotIn(('message', self.message_id), fragments.cache._entries)
+
+    def test_user_cards(self):
+        """User cards are cached without the viewer's follow button."""
+
+        with self.client as c:
+            self.login(c, self.reader_id)
+            html = c.get('/users').get_data(as_text=True)
+            self.assertIn('Unfollow', html)
+
+            self.login(c, self.author_id)
+            html = c.get('/users').get_data(as_text=True)
+
+        self.assertIn('@reader', html)
+        self.assertIn(f'/users/follow/{self.reader_id}', html)
@@ -0,0 +1,202 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+import threading
+from datetime import datetime, timedelta
+
+from models import db, User, Follows, Job, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import jobs
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+done = []
+failures = {'left': 0}
+release = threading.Event()
+
+
+@jobs.task
+def record(value):
+    done.append(value)
+
+
+@jobs.task
+def flaky(value):
+    if failures['left']:
+        failures['left'] -= 1
+        raise RuntimeError('not yet')
+    done.append(value)
+
+
+@jobs.task
+def blocked(value):
+    release.wait(5)
+    done.append(value)
+
+
+class JobsTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+
+        done.clear()
+        failures['left'] = 0
+        release.clear()
+        jobs.queue._counts.clear()
+
+        self.configure(JOBS_RETRY_SECONDS=0, JOBS_MAX_ATTEMPTS=3)
+
+    def tearDown(self):
+        super().tearDown()
+        release.set()
+        jobs.queue.join(5)
+
+    def test_retries(self):
+        """A failing task is retried, up to JOBS_MAX_ATTEMPTS times."""
+
+        self.configure(JOBS_MODE='inline')
+
+        failures['left'] = 2
+        jobs.enqueue('flaky', value=1)
+        self.assertEqual(done, [1])
+
+        failures['left'] = 3
+        with self.assertRaises(RuntimeError):
+            jobs.enqueue('flaky', value=2)
+
+        counts = jobs.queue.stats()['tasks']['flaky']
+        self.assertEqual(counts['retried'], 4)
+        self.assertEqual(counts['done'], 1)
+        self.assertEqual(counts['failed'], 1)
+
+    def test_thread_keys(self):
+        """A job isn't queued twice under one key while it's pending."""
+
+        self.configure(JOBS_MODE='thread')
+
+        self.assertTrue(jobs.enqueue('blocked', key='once', value=1))
+        self.assertFalse(jobs.enqueue('blocked', key='once', value=2))
+        self.assertEqual(jobs.queue.stats()['depth']['queued']
+                         + jobs.queue.stats()['depth']['running'], 1)
+
+        release.set()
+        self.assertTrue(jobs.queue.join(5))
+        self.assertEqual(done, [1])
+
+        # finished, so the key is free again
+        self.assertTrue(jobs.enqueue('record', key='once', value=3))
+        jobs.queue.join(5)
+        self.assertEqual(done, [1, 3])
+
+    def test_durable(self):
+        """Durable jobs are rows, claimed and run by a worker."""
+
+        self.configure(JOBS_MODE='durable', JOBS_WORKERS=0)
+
+        self.assertTrue(jobs.enqueue('record', key='once', value=1))
+        self.assertFalse(jobs.enqueue('record', key='once', value=1))
+        self.assertEqual(jobs.queue.stats()['depth']['queued'], 1)
+
+        with app.app_context():
+            self.assertTrue(jobs.queue.work_one())
+            self.assertFalse(jobs.queue.work_one())
+
+        self.assertEqual(done, [1])
+        self.assertEqual(Job.query.one().status, 'done')
+        self.assertEqual(jobs.queue.stats()['depth']['queued'], 0)
+
+    def test_durable_failure(self):
+        """Durable jobs are retried, then left marked failed."""
+
+        self.configure(JOBS_MODE='durable', JOBS_WORKERS=0, JOBS_MAX_ATTEMPTS=2)
+
+        failures['left'] = 2
+        jobs.enqueue('flaky', value=1)
+
+        with app.app_context():
+            while jobs.queue.work_one():
+                pass
+
+        job = Job.query.one()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertIn('not yet', job.error)
+        self.assertEqual(jobs.queue.stats()['depth']['failed'], 1)
+
+    def test_durable_lease(self):
+        """A job whose lease ran out runs again, unless that was its last
+        attempt."""
+
+        self.configure(JOBS_MODE='durable', JOBS_WORKERS=0, JOBS_MAX_ATTEMPTS=2)
+
+        jobs.enqueue('record', key='again', value=1)
+        jobs.enqueue('record', key='last', value=2)
+
+        # both claimed by workers that died, one on its last attempt
+        past = datetime.utcnow() - timedelta(seconds=1)
+        for key, attempts in [('again', 1), ('last', 2)]:
+            Job.query.filter_by(key=key).update(
+                {'status': 'running', 'attempts': attempts, 'run_at': past})
+        db.session.commit()
+
+        with app.app_context():
+            while jobs.queue.work_one():
+                pass
+
+        self.assertEqual(done, [1])
+        statuses = {job.key: (job.status, job.attempts) for job in Job.query}
+        self.assertEqual(statuses, {'again': ('done', 2), 'last': ('failed', 2)})
+        self.assertEqual(jobs.queue.stats()['tasks']['record']['failed'], 1)
+
+    def test_prune(self):
+        """Done jobs are deleted once JOBS_KEEP_SECONDS have passed."""
+
+        self.configure(JOBS_MODE='durable', JOBS_WORKERS=0)
+
+        for value in [1, 2]:
+            jobs.enqueue('record', value=value)
+        with app.app_context():
+            while jobs.queue.work_one():
+                pass
+        jobs.enqueue('record', value=3)
+
+        Job.query.filter_by(args='{"value": 1}').update(
+            {'run_at': datetime.utcnow() - timedelta(days=2)})
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual(jobs.queue.prune(), 1)
+
+        self.assertEqual(sorted(job.args for job in Job.query),
+                         ['{"value": 2}', '{"value": 3}'])
+
+    def test_fan_out_after_commit(self):
+        """Posting a message fans it out in the background."""
+
+        self.configure(JOBS_MODE='thread')
+
+        author = User.signup('author', 'author@email.com', 'password', None)
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        reader_id = reader.id
+
+        db.session.add(Follows(user_being_followed_id=author.id,
+                               user_following_id=reader_id))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, author.id)
+            c.post('/messages/new', data={'text': 'hello'})
+
+        self.assertTrue(jobs.queue.join(5))
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=reader_id).count(), 1)
+        self.assertEqual(jobs.queue.stats()['tasks']['fan_out']['done'], 1)
@@ -0,0 +1,95 @@
+"""Bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import csv
+import os
+import tempfile
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import loader
+from testing import AppTestCase
+
+
+def write_csv(directory, name, header, rows):
+    with open(os.path.join(directory, name), 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+class LoaderTestCase(AppTestCase):
+    """Load small CSVs a couple of rows at a time."""
+
+    def setUp(self):
+        super().setUp()
+        loader.PROGRESS.drop(db.engine, checkfirst=True)
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+        write_csv(self.dir, 'users.csv',
+                  ['email', 'username', 'password', 'bio'],
+                  [[f'u{n}@test.com', f'u{n}', 'HASHED', ''] for n in range(1, 6)])
+        write_csv(self.dir, 'messages.csv',
+                  ['text', 'timestamp', 'user_id'],
+                  [[f'msg {n}', f'2020-01-0{n} 12:00:00', n] for n in range(1, 6)])
+
+    def tearDown(self):
+        super().tearDown()
+        self.tmp.cleanup()
+
+    def test_load(self):
+        """Rows get ids from their line number; counters and timelines follow."""
+
+        write_csv(self.dir, 'follows.csv',
+                  ['user_being_followed_id', 'user_following_id'],
+                  [[2, 1], [3, 1], [1, 2]])
+
+        with app.app_context():
+            loader.load(self.dir, chunk_size=2, report=lambda line: None)
+
+        u1 = User.query.get(1)
+        self.assertEqual(u1.username, 'u1')
+        self.assertIsNone(u1.bio)
+        self.assertEqual(u1.following_count, 2)
+        self.assertEqual(Message.query.get(4).user_id, 4)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=1).count(), 3)
+
+        # new rows carry on after the loaded ids
+        u6 = User.signup('u6', 'u6@test.com', 'password', None)
+        db.session.commit()
+        self.assertEqual(u6.id, 6)
+
+    def test_resume(self):
+        """A failed load picks up after the last committed chunk."""
+
+        follows = [[2, 1], [3, 1], [4, 1], [4, 1], [5, 1]]
+        write_csv(self.dir, 'follows.csv',
+                  ['user_being_followed_id', 'user_following_id'], follows)
+
+        with app.app_context():
+            # rows go straight to the driver, so its errors come back as-is
+            with self.assertRaises(db.engine.dialect.dbapi.IntegrityError):
+                loader.load(self.dir, chunk_size=2, report=lambda line: None)
+
+            self.assertEqual(Follows.query.count(), 2)
+            self.assertEqual(loader._progress(db.engine, 'follows.csv'), 2)
+
+            del follows[3]
+            write_csv(self.dir, 'follows.csv',
+                      ['user_being_followed_id', 'user_following_id'], follows)
+
+            loader.load(self.dir, chunk_size=2, resume=True,
+                        report=lambda line: None)
+
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Follows.query.count(), 4)
+        self.assertEqual(User.query.get(1).following_count, 4)
@@ -32,6 +32,10 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Run background jobs straight away, so tests see their effects
+
+app.config['JOBS_MODE'] = 'inline'
+
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -0,0 +1,140 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String,
+                        Table, Text, create_engine, inspect)
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import migrations
+from migrations import explain
+
+
+def schema(engine):
+    """{table: (columns, index names)} for the app's tables."""
+
+    inspector = inspect(engine)
+
+    return {
+        table: (sorted((col['name'], str(col['type']), col['nullable'])
+                       for col in inspector.get_columns(table)),
+                sorted(index['name'] for index in inspector.get_indexes(table)))
+        for table in inspector.get_table_names()
+        if table != 'schema_migrations'
+    }
+
+
+class MigrationsTestCase(TestCase):
+    """Migrating from scratch builds the schema the models describe."""
+
+    def test_matches_models(self):
+        """Migrated tables have the models' columns and indexes."""
+
+        migrated = create_engine('sqlite://')
+        migrations.upgrade(migrated, report=lambda line: None)
+
+        modelled = create_engine('sqlite://')
+        db.metadata.create_all(modelled)
+
+        self.assertEqual(schema(migrated), schema(modelled))
+
+    def test_upgrade_is_idempotent(self):
+        """Applied migrations are recorded and not run again."""
+
+        engine = create_engine('sqlite://')
+
+        self.assertEqual(migrations.upgrade(engine, report=lambda line: None),
+                         migrations.available())
+        self.assertEqual(migrations.pending(engine), [])
+        self.assertEqual(migrations.upgrade(engine, report=lambda line: None), [])
+
+
+def baseline(engine):
+    """The tables `db.create_all()` made before there were migrations."""
+
+    meta = MetaData()
+
+    Table('users', meta,
+          Column('id', Integer, primary_key=True),
+          Column('email', Text, nullable=False, unique=True),
+          Column('username', Text, nullable=False, unique=True),
+          Column('image_url', Text),
+          Column('header_image_url', Text),
+          Column('bio', Text),
+          Column('location', Text),
+          Column('password', Text, nullable=False))
+    Table('follows', meta,
+          Column('user_being_followed_id', Integer,
+                 ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+          Column('user_following_id', Integer,
+                 ForeignKey('users.id', ondelete='cascade'), primary_key=True))
+    Table('messages', meta,
+          Column('id', Integer, primary_key=True),
+          Column('text', String(140), nullable=False),
+          Column('timestamp', DateTime, nullable=False),
+          Column('user_id', Integer,
+                 ForeignKey('users.id', ondelete='CASCADE'), nullable=False))
+    Table('likes', meta,
+          Column('id', Integer, primary_key=True),
+          Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+          Column('message_id', Integer,
+                 ForeignKey('messages.id', ondelete='cascade'), unique=True))
+
+    meta.create_all(engine)
+
+
+class BaselineTestCase(TestCase):
+    """A database from before migrations is brought up to date."""
+
+    def test_upgrade_baseline(self):
+        """Counters, the likes constraint and new tables are all added."""
+
+        engine = create_engine('sqlite://')
+        baseline(engine)
+
+        for n in (1, 2, 3):
+            engine.execute(f"INSERT INTO users (id, email, username, password) "
+                           f"VALUES ({n}, 'u{n}@email.com', 'u{n}', 'x')")
+        engine.execute("INSERT INTO follows VALUES (1, 2)")
+        engine.execute("INSERT INTO messages VALUES (1, 'hello', '2020-01-01', 1)")
+        engine.execute("INSERT INTO likes VALUES (1, 2, 1)")
+
+        migrations.upgrade(engine, report=lambda line: None)
+
+        modelled = create_engine('sqlite://')
+        db.metadata.create_all(modelled)
+        self.assertEqual(schema(engine), schema(modelled))
+
+        # a second user can like the same message now
+        engine.execute("INSERT INTO likes (user_id, message_id) VALUES (3, 1)")
+
+        counts = engine.execute(
+            "SELECT id, messages_count, following_count, followers_count, likes_count "
+            "FROM users ORDER BY id").fetchall()
+        self.assertEqual([tuple(row) for row in counts],
+                         [(1, 1, 0, 1, 0), (2, 0, 1, 0, 1), (3, 0, 0, 0, 0)])
+        self.assertEqual(engine.execute("SELECT likes_count FROM messages").scalar(), 1)
+
+
+class ExplainTestCase(TestCase):
+    """The hot queries are all served by indexes."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def test_no_table_scans(self):
+        """None of the hot queries' plans scans a table."""
+
+        for name, plan, scans in explain.check():
+            self.assertEqual(scans, [], f"{name}: {plan}")
@@ -0,0 +1,154 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_purge.py
+
+
+import os
+
+from models import db, AccountPurge, Follows, Likes, Message, TimelineEntry, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import jobs
+import purge
+from testing import AppTestCase
+import timeline
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PurgeTestCase(AppTestCase):
+    """Deleting an account hides it at once and purges it in batches."""
+
+    def setUp(self):
+        super().setUp()
+
+        # leave purges to the tests
+        self.configure(JOBS_MODE='durable', JOBS_WORKERS=0)
+
+        gone = User.signup('gone', 'gone@email.com', 'password', None)
+        fan = User.signup('fan', 'fan@email.com', 'password', None)
+        idol = User.signup('idol', 'idol@email.com', 'password', None)
+        db.session.commit()
+        self.gone_id, self.fan_id, self.idol_id = gone.id, fan.id, idol.id
+
+        db.session.add_all([
+            Follows(user_being_followed_id=self.gone_id, user_following_id=self.fan_id),
+            Follows(user_being_followed_id=self.idol_id, user_following_id=self.gone_id),
+        ])
+        db.session.commit()
+
+        with app.app_context():
+            for user_id, text in [(self.gone_id, 'bye'), (self.gone_id, 'really'),
+                                  (self.idol_id, 'hello')]:
+                msg = Message(text=text, user_id=user_id)
+                db.session.add(msg)
+                db.session.flush()
+                timeline.fan_out(msg)
+            db.session.commit()
+
+        for user_id, text in [(self.fan_id, 'bye'), (self.fan_id, 'really'),
+                              (self.gone_id, 'hello')]:
+            Likes.toggle(user_id, Message.query.filter_by(text=text).one().id)
+        User.reconcile_counts()
+        db.session.commit()
+
+    def delete_account(self):
+        with self.client as c:
+            self.login(c, self.gone_id)
+            return c.post('/users/delete')
+
+    def get(self, url):
+        with self.client as c:
+            self.login(c, self.fan_id)
+            resp = c.get(url)
+            return resp.status_code, resp.get_data(as_text=True)
+
+    def test_no_login(self):
+        """A deleted account can't log in again."""
+
+        self.delete_account()
+
+        with self.client as c:
+            c.get('/logout')
+            resp = c.post('/login', data={'username': 'gone', 'password': 'password'},
+                          follow_redirects=True)
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('Invalid credentials.', html)
+            self.assertNotIn('Hello, gone!', html)
+            with c.session_transaction() as sess:
+                self.assertNotIn(CURR_USER_KEY, sess)
+
+    def test_hidden_at_once(self):
+        """The account and its messages vanish before anything is purged."""
+
+        self.delete_account()
+
+        self.assertIsNotNone(User.query.get(self.gone_id).deleted_at)
+        self.assertEqual(Message.query.filter_by(user_id=self.gone_id).count(), 2)
+
+        self.assertEqual(self.get(f'/users/{self.gone_id}')[0], 404)
+        self.assertNotIn('@gone', self.get('/users')[1])
+        self.assertNotIn('bye', self.get('/')[1])
+        self.assertNotIn('@gone', self.get(f'/users/{self.idol_id}/followers')[1])
+
+        msg_id = Message.query.filter_by(text='bye').one().id
+        self.assertEqual(self.get(f'/messages/{msg_id}')[0], 404)
+
+    def test_purge_in_batches(self):
+        """Batches delete everything, keeping other users' counts right."""
+
+        self.delete_account()
+
+        batches = 0
+        while purge.purge_batch(self.gone_id, 1):
+            batches += 1
+
+        self.assertGreater(batches, 8)
+        self.assertIsNone(User.query.get(self.gone_id))
+        self.assertEqual(Message.query.filter_by(user_id=self.gone_id).count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(TimelineEntry.query.filter(
+            TimelineEntry.user_id != self.idol_id).count(), 0)
+
+        # nothing had drifted from the rows actually there
+        self.assertEqual(User.reconcile_counts(), 0)
+        self.assertEqual(Message.reconcile_counts(), 0)
+
+        progress = AccountPurge.query.get(self.gone_id)
+        self.assertIsNotNone(progress.finished_at)
+        self.assertEqual(purge.status(), [])
+
+    def test_resume(self):
+        """An interrupted purge is finished by `flask purge-accounts`."""
+
+        self.delete_account()
+
+        for _ in range(3):
+            purge.purge_batch(self.gone_id, 1)
+
+        self.assertEqual(purge.status()[0]['step'], 'followers')
+
+        result = app.test_cli_runner().invoke(args=['purge-accounts'])
+
+        self.assertIn(f'Purged user {self.gone_id}', result.output)
+        self.assertIsNone(User.query.get(self.gone_id))
+
+    def test_job(self):
+        """Deleting the account queues the purge job."""
+
+        self.delete_account()
+
+        with app.app_context():
+            while jobs.queue.work_one():
+                pass
+
+        self.assertIsNone(User.query.get(self.gone_id))
+        self.assertEqual(User.query.get(self.fan_id).likes_count, 0)
@@ -0,0 +1,146 @@
+"""Who to follow tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommend.py
+
+
+import os
+import threading
+
+from models import db, User, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import purge
+from recommend import recommender
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+NAMES = ['viewer', 'bob', 'carol', 'dave', 'erin', 'frank']
+
+
+class RecommendTestCase(AppTestCase):
+    """Suggestions come from the people a user follows."""
+
+    def setUp(self):
+        super().setUp()
+
+        users = [User.signup(name, f'{name}@email.com', 'password', None)
+                 for name in NAMES]
+        db.session.commit()
+        self.ids = dict(zip(NAMES, (user.id for user in users)))
+
+        # viewer -> bob, carol; bob -> dave; carol -> dave, erin;
+        # dave -> frank; frank -> viewer
+        db.session.add_all(
+            [Follows(user_following_id=self.ids[follower],
+                     user_being_followed_id=self.ids[followed])
+             for follower, followed in [
+                 ('viewer', 'bob'), ('viewer', 'carol'), ('bob', 'dave'),
+                 ('carol', 'dave'), ('carol', 'erin'), ('dave', 'frank'),
+                 ('frank', 'viewer')]])
+        User.reconcile_counts()
+        db.session.commit()
+
+    def as_user(self, name, method, url):
+        with self.client as c:
+            self.login(c, self.ids[name])
+            return getattr(c, method)(url).get_data(as_text=True)
+
+    def top(self, name):
+        with app.app_context():
+            return recommender.top(self.ids[name])
+
+    def test_mutuals(self):
+        """Most mutual connections first, then the most followed."""
+
+        self.assertEqual(self.top('viewer'),
+                         [self.ids['dave'], self.ids['erin'], self.ids['frank']])
+
+        # follows nobody: the most followed users
+        with app.app_context():
+            self.assertEqual(recommender.score(self.ids['erin'], 1), [self.ids['dave']])
+
+    def test_sidebar(self):
+        """The home page suggests users, with follow buttons."""
+
+        html = self.as_user('viewer', 'get', '/')
+
+        self.assertIn('Who to follow', html)
+        self.assertIn(f'/users/follow/{self.ids["dave"]}', html)
+        self.assertNotIn(f'/users/follow/{self.ids["bob"]}', html)
+
+    def test_follow(self):
+        """Following a suggestion replaces it at once."""
+
+        self.top('viewer')
+        self.as_user('viewer', 'post', f'/users/follow/{self.ids["dave"]}')
+
+        # frank is now a mutual, through dave
+        self.assertEqual(self.top('viewer'), [self.ids['erin'], self.ids['frank']])
+
+        html = self.as_user('viewer', 'get', '/')
+        self.assertNotIn(f'/users/follow/{self.ids["dave"]}', html)
+
+    def test_followees_changes(self):
+        """Follows since the graph loaded count towards others' scores."""
+
+        self.configure(RECOMMEND_CACHE_SECONDS=0)
+        self.top('viewer')
+
+        self.as_user('bob', 'post', f'/users/follow/{self.ids["erin"]}')
+        self.as_user('carol', 'post', f'/users/stop-following/{self.ids["dave"]}')
+
+        self.assertEqual(self.top('viewer')[:2], [self.ids['erin'], self.ids['dave']])
+
+        # a reload reads them from the table, and drops them from the side
+        with app.app_context():
+            recommender.reload()
+        self.assertEqual(recommender.stats()['changes'], 0)
+        self.assertEqual(self.top('viewer')[:2], [self.ids['erin'], self.ids['dave']])
+
+    def test_cache(self):
+        """Suggestions are cached, for a bounded number of users."""
+
+        self.configure(RECOMMEND_CACHE_SIZE=2)
+
+        for name in ['viewer', 'bob', 'carol', 'viewer', 'carol']:
+            self.top(name)
+
+        stats = recommender.stats()
+        self.assertEqual((stats['cached'], stats['hits'], stats['misses']), (2, 1, 4))
+
+    def test_deleted(self):
+        """Deleted accounts aren't suggested."""
+
+        purge.tombstone(User.query.get(self.ids['dave']))
+        db.session.commit()
+
+        html = self.as_user('viewer', 'get', '/')
+
+        self.assertNotIn(f'/users/follow/{self.ids["dave"]}', html)
+        self.assertIn(f'/users/follow/{self.ids["erin"]}', html)
+
+    def test_cold_load(self):
+        """Requests arriving before there's a graph share one load."""
+
+        graphs = []
+
+        def load():
+            with app.app_context():
+                graphs.append(recommender.current_graph())
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(graphs), 4)
+        self.assertEqual(len({id(graph) for graph in graphs}), 1)
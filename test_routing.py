@@ -0,0 +1,114 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_routing.py
+#
+# They use a second database, warbler-test-replica, as the replica and
+# create it if it doesn't exist. "Replication" is done by the tests
+# copying rows across.
+
+
+import os
+
+from sqlalchemy import create_engine
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+REPLICA_URL = "postgresql:///warbler-test-replica"
+
+
+class ReplicaRoutingTestCase(AppTestCase):
+    """Reads go to the replica, writes and reads just after them don't."""
+
+    @classmethod
+    def setUpClass(cls):
+        server = create_engine("postgresql:///postgres", isolation_level='AUTOCOMMIT')
+        exists = server.execute(
+            "SELECT 1 FROM pg_database WHERE datname = 'warbler-test-replica'").scalar()
+        if not exists:
+            server.execute('CREATE DATABASE "warbler-test-replica"')
+        server.dispose()
+
+        app.config['SQLALCHEMY_BINDS'] = {'replica_0': REPLICA_URL}
+        cls.replica = db.get_engine(bind='replica_0')
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['SQLALCHEMY_BINDS'] = {}
+
+    def setUp(self):
+        super().setUp()
+        db.metadata.drop_all(self.replica)
+        db.metadata.create_all(self.replica)
+
+        author = User.signup('author', 'author@email.com', 'password', None)
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        self.author_id = author.id
+        self.reader_id = reader.id
+
+        self.replicate()
+
+    def replicate(self):
+        """Copy the primary's users and messages to the replica."""
+
+        for table in (User.__table__, Message.__table__):
+            rows = [dict(row) for row in db.engine.execute(table.select())]
+            self.replica.execute(table.delete())
+            if rows:
+                self.replica.execute(table.insert(), rows)
+
+    def call(self, method, url, **kwargs):
+        with self.client as c:
+            self.login(c, self.reader_id)
+
+            resp = getattr(c, method)(url, **kwargs)
+            # streamed pages must be read while the request is open
+            resp.get_data()
+            return resp
+
+    def test_reads_from_replica(self):
+        """GETs read the replica's rows."""
+
+        self.replica.execute(User.__table__.insert(), {
+            'username': 'lagging', 'email': 'lagging@email.com',
+            'password': 'x', 'id': 1000,
+        })
+
+        self.assertIn('@lagging', self.call('get', '/users').get_data(as_text=True))
+
+    def test_writes_to_primary(self):
+        """POSTs write to the primary, and the writer reads from it for a while."""
+
+        self.call('post', '/messages/new', data={'text': 'fresh'})
+
+        self.assertEqual(Message.query.filter_by(text='fresh').count(), 1)
+        self.assertIsNone(
+            self.replica.execute("SELECT id FROM messages WHERE text = 'fresh'").scalar())
+
+        # read your own writes, though the replica hasn't caught up
+        resp = self.call('get', f'/users/{self.reader_id}')
+        self.assertIn('fresh', resp.get_data(as_text=True))
+
+        self.configure(REPLICA_LAG_SECONDS=0)
+        resp = self.call('get', f'/users/{self.reader_id}')
+        self.assertNotIn('fresh', resp.get_data(as_text=True))
+
+    def test_ready(self):
+        """Readiness covers the replicas too."""
+
+        data = self.client.get('/health/ready').get_json()
+
+        self.assertTrue(data['ready'])
+        self.assertEqual(set(data['db_pool']), {'primary', 'replica_0'})
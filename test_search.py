@@ -0,0 +1,153 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import purge
+import search
+from search import InvertedIndex, words
+from testing import AppTestCase
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+
+class SearchViewTestCase(AppTestCase):
+    """Test the user and message search pages."""
+
+    def setUp(self):
+        """Create users and messages to search."""
+
+        super().setUp()
+
+        birder = User.signup('birder', 'birder@email.com', 'password', None)
+        birder.bio = 'Watching warblers since 1999'
+        User.signup('gardener', 'gardener@email.com', 'password', None)
+        db.session.commit()
+
+        db.session.add_all([
+            Message(text='Saw a yellow warbler today', user_id=birder.id),
+            Message(text='Warblers everywhere!', user_id=birder.id),
+            Message(text='Tomatoes are in', user_id=birder.id),
+        ])
+        db.session.commit()
+
+    def test_search_bio(self):
+        """Users are found by words in their bio."""
+
+        with self.client as c:
+            resp = c.get('/users?q=watch')
+
+            self.assertIn('@birder', str(resp.data))
+            self.assertNotIn('@gardener', str(resp.data))
+
+    def test_search_messages(self):
+        """Messages match on word prefixes, every term required."""
+
+        with self.client as c:
+            resp = c.get('/messages/search?q=warbler')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Saw a yellow warbler today', html)
+            self.assertIn('Warblers everywhere!', html)
+            self.assertNotIn('Tomatoes', html)
+
+            resp = c.get('/messages/search?q=yellow+warb')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('Saw a yellow warbler today', html)
+            self.assertNotIn('Warblers everywhere!', html)
+
+    def test_search_pages(self):
+        """Results come a page at a time."""
+
+        self.configure(SEARCH_PER_PAGE=1)
+
+        with self.client as c:
+            resp = c.get('/messages/search?q=warbler')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="list-group-item"'), 1)
+            self.assertIn('page=2', html)
+
+            resp = c.get('/messages/search?q=warbler&page=2')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(html.count('class="list-group-item"'), 1)
+            self.assertNotIn('page=3', html)
+
+
+    def test_index_deleted(self):
+        """The in-process index leaves out deleted accounts' messages
+        without coming up short."""
+
+        gone = User.signup('gone', 'gone@email.com', 'password', None)
+        db.session.commit()
+        db.session.add(Message(text='Warbler warbler warbler', user_id=gone.id))
+        db.session.commit()
+
+        index = InvertedIndex(search._load_messages)
+        self.assertEqual(len(index.search(['warbler'], 10, 0)), 3)
+
+        purge.tombstone(gone)
+        db.session.commit()
+
+        page = search._in_order(Message, Message.visible(), index, ['warbler'], 1, 0)
+        self.assertEqual([msg.text for msg in page], ['Saw a yellow warbler today'])
+        self.assertEqual(len(index.search(['warbler'], 10, 0)), 2)
+
+        # loaded afresh, it's never indexed
+        index = InvertedIndex(search._load_messages)
+        self.assertEqual(len(index.search(['warbler'], 10, 0)), 2)
+
+
+class InvertedIndexTestCase(TestCase):
+    """Test the in-process index used when the database can't search."""
+
+    def setUp(self):
+        docs = [
+            (1, 'Saw a yellow warbler'),
+            (2, 'warblers everywhere'),
+            (3, 'tomato_soup'),
+        ]
+        self.index = InvertedIndex(lambda: docs)
+
+    def test_words(self):
+        self.assertEqual(words('Hello, test_name!'), ['hello', 'test', 'name'])
+
+    def test_prefix_and_rank(self):
+        """Whole-word matches rank above prefix matches."""
+
+        self.assertEqual(self.index.search(['warbler'], 10, 0), [1, 2])
+        self.assertEqual(self.index.search(['warb', 'yel'], 10, 0), [1])
+        self.assertEqual(self.index.search(['soup'], 10, 0), [3])
+        self.assertEqual(self.index.search(['warbler'], 1, 1), [2])
+
+    def test_updates(self):
+        """Added and removed documents show up in results."""
+
+        self.index.search(['x'], 10, 0)
+        self.index.add(4, 'a warbler song')
+        self.index.remove(1)
+
+        self.assertEqual(self.index.search(['warbler'], 10, 0), [4, 2])
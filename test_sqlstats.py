@@ -0,0 +1,163 @@
+"""Per-request SQL statistics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_sqlstats.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import sqlstats
+from testing import AppTestCase
+import timeline
+
+db.create_all()
+
+
+class RequestStatsTestCase(TestCase):
+    """Counting statements within one request."""
+
+    def test_record(self):
+        """Keeps the count, total time, slowest and repeats."""
+
+        stats = sqlstats.RequestStats()
+        for n in range(8):
+            stats.record('SELECT users WHERE id = ?', n / 1000)
+        stats.record('SELECT messages', 1)
+
+        self.assertEqual(stats.count, 9)
+        self.assertAlmostEqual(stats.seconds, 1.028)
+        self.assertEqual(max(stats.slowest), (1, 'SELECT messages'))
+        self.assertEqual(len(stats.slowest), sqlstats.SLOWEST)
+        self.assertEqual(stats.repeated(3), {'SELECT users WHERE id = ?': 8})
+
+
+class SQLStatsViewTestCase(AppTestCase):
+    """Headers, strict mode and /metrics."""
+
+    def setUp(self):
+        super().setUp()
+        sqlstats.totals.reset()
+
+        reader = User.signup('reader', 'reader@email.com', 'password', None)
+        db.session.commit()
+        self.reader_id = reader.id
+
+        with app.app_context():
+            for n in range(5):
+                author = User.signup(f'author{n}', f'author{n}@email.com', 'password', None)
+                db.session.commit()
+                db.session.add(Follows(user_being_followed_id=author.id,
+                                       user_following_id=self.reader_id))
+                msg = Message(text=f'hello {n}', user_id=author.id)
+                db.session.add(msg)
+                db.session.commit()
+                timeline.fan_out(msg)
+                db.session.commit()
+
+        self.configure(SQL_STATS_HEADERS=True)
+
+    def get(self, url):
+        with self.client as c:
+            self.login(c, self.reader_id)
+
+            # a streamed page's statistics are finished when it's closed
+            resp = c.get(url)
+            resp.get_data()
+            resp.close()
+            return resp
+
+    def get_home(self):
+        return self.get('/')
+
+    def get_profile(self):
+        return self.get(f'/users/{self.reader_id}')
+
+    def test_headers(self):
+        """Query count and DB time are sent back with the page."""
+
+        resp = self.get_profile()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(int(resp.headers['X-SQL-Queries']), 0)
+        self.assertTrue(resp.headers['Server-Timing'].startswith('db;dur='))
+        self.assertNotIn('X-SQL-Repeated', resp.headers)
+
+    def test_no_headers(self):
+        """Headers can be turned off (as in production)."""
+
+        self.configure(SQL_STATS_HEADERS=False)
+
+        self.assertNotIn('X-SQL-Queries', self.get_profile().headers)
+
+    def test_strict_no_repeats(self):
+        """Authors on the home page are loaded together, not one by one."""
+
+        self.configure(SQL_STRICT=True)
+
+        with self.assertNoLogs(app.logger, 'WARNING'):
+            resp = self.get_home()
+
+        self.assertNotIn('X-SQL-Repeated', resp.headers)
+
+    def test_strict_flags_repeats(self):
+        """Statements run SQL_REPEAT_LIMIT times are flagged."""
+
+        self.configure(SQL_STRICT=True, SQL_REPEAT_LIMIT=1)
+
+        with self.assertLogs(app.logger, 'WARNING'):
+            self.get_home()
+
+        with self.assertLogs(app.logger, 'WARNING'):
+            resp = self.get_profile()
+
+        self.assertEqual(resp.headers['X-SQL-Repeated'], '1')
+
+    def test_streamed(self):
+        """A streamed page counts the queries its template runs, and sends
+        no headers that would leave them out."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        self.get_home()  # caches the reader
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            resp = self.get('/users')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        self.assertNotIn('X-SQL-Queries', resp.headers)
+
+        users = sqlstats.summary()['endpoints']['list_users']
+        self.assertEqual(users['max_queries'], len(statements))
+
+    def test_metrics(self):
+        """/metrics adds up statistics per endpoint."""
+
+        self.get_home()
+        self.get_home()
+
+        self.configure(METRICS_TOKEN='secret')
+
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+        self.assertEqual(self.client.get('/metrics', headers={
+            'Authorization': 'Bearer wrong'}).status_code, 404)
+
+        sql = self.client.get('/metrics', headers={
+            'Authorization': 'Bearer secret'}).get_json()['sql']
+
+        self.assertEqual(sql['endpoints']['homepage']['requests'], 2)
+        self.assertGreater(sql['endpoints']['homepage']['queries_per_request'], 0)
+        self.assertTrue(sql['slowest'])
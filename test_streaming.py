@@ -0,0 +1,63 @@
+"""Streamed page rendering tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_streaming.py
+
+
+import os
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from testing import AppTestCase
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StreamingTestCase(AppTestCase):
+    """Long lists are sent as they render."""
+
+    def setUp(self):
+        super().setUp()
+
+        for n in range(5):
+            User.signup(f'user{n}', f'user{n}@email.com', 'password', None)
+        db.session.commit()
+
+        self.user_id = User.query.filter_by(username='user0').one().id
+
+    def test_users_streamed(self):
+        """/users is streamed and lists everyone."""
+
+        with self.client as c:
+            self.login(c, self.user_id)
+
+            resp = c.get('/users')
+
+            self.assertTrue(resp.is_streamed)
+            html = resp.get_data(as_text=True)
+
+        for n in range(5):
+            self.assertIn(f'@user{n}', html)
+        self.assertNotIn('Sorry, no users found', html)
+
+    def test_no_users(self):
+        resp = self.client.get('/users?q=nobody')
+
+        self.assertIn('Sorry, no users found', resp.get_data(as_text=True))
+
+    def test_flash_shown_once(self):
+        """Flashed messages leave the session though it's saved early."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+                sess['_flashes'] = [('success', 'Hello there')]
+
+            self.assertIn('Hello there', c.get('/').get_data(as_text=True))
+            self.assertNotIn('Hello there', c.get('/').get_data(as_text=True))
@@ -0,0 +1,298 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+
+from sqlalchemy import event
+
+from models import db, User, Message, Follows, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import purge
+from testing import AppTestCase
+import timeline
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+
+class TimelineTestCase(AppTestCase):
+    """Test fan-out and reading of home timelines."""
+
+    def setUp(self):
+        """Create an author with one follower."""
+
+        super().setUp()
+
+        self.author = User.signup('author', 'author@email.com', 'password', None)
+        self.author.id = 100
+        self.follower = User.signup('follower', 'follower@email.com', 'password', None)
+        self.follower.id = 200
+        self.stranger = User.signup('stranger', 'stranger@email.com', 'password', None)
+        self.stranger.id = 300
+        db.session.commit()
+
+        db.session.add(Follows(user_being_followed_id=100, user_following_id=200))
+        User.reconcile_counts()
+        db.session.commit()
+
+    def post(self, user_id, text):
+        """Post `text` as `user_id` through the view."""
+
+        with self.client as c:
+            self.login(c, user_id)
+
+            return c.post('/messages/new', data={'text': text})
+
+    def home_texts(self, user_id):
+        """Texts on `user_id`'s home timeline, newest first."""
+
+        with app.app_context():
+            user = User.query.get(user_id)
+            return [msg.text for msg in timeline.home_timeline(user, 100)]
+
+    def test_fan_out(self):
+        """Posting pushes the message to the author and their followers."""
+
+        self.post(100, 'first')
+        self.post(100, 'second')
+
+        self.assertEqual(self.home_texts(200), ['second', 'first'])
+        self.assertEqual(self.home_texts(100), ['second', 'first'])
+        self.assertEqual(self.home_texts(300), [])
+
+    def test_celebrity_merged_on_read(self):
+        """Authors over the fan-out limit are pulled in when reading."""
+
+        self.mark_celebrities(0)
+
+        self.post(100, 'famous words')
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=200).count(), 0)
+        self.assertEqual(self.home_texts(200), ['famous words'])
+
+    def mark_celebrities(self, limit):
+        self.configure(TIMELINE_FANOUT_LIMIT=limit)
+
+        with app.app_context():
+            timeline.update_celebrities()
+            db.session.commit()
+
+        timeline._celebrities['expires'] = 0
+
+    def test_celebrity_unmarked(self):
+        """Messages posted while a celebrity stay once no longer one."""
+
+        self.mark_celebrities(0)
+        self.post(100, 'while famous')
+        self.assertEqual(self.home_texts(200), ['while famous'])
+
+        # still over the lower bound: left marked
+        self.mark_celebrities(1)
+        self.assertTrue(User.query.get(100).celebrity)
+
+        self.mark_celebrities(10000)
+
+        self.assertFalse(User.query.get(100).celebrity)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=200).count(), 1)
+        self.assertEqual(self.home_texts(200), ['while famous'])
+
+        self.post(100, 'back to normal')
+        self.assertEqual(self.home_texts(200), ['back to normal', 'while famous'])
+
+    def test_follow_and_unfollow(self):
+        """Following backfills the timeline; unfollowing clears it."""
+
+        self.post(100, 'before the follow')
+
+        with self.client as c:
+            self.login(c, 300)
+
+            c.post('/users/follow/100')
+            self.assertEqual(self.home_texts(300), ['before the follow'])
+
+            c.post('/users/stop-following/100')
+            self.assertEqual(self.home_texts(300), [])
+
+    def test_self_follow(self):
+        """Users can't follow themselves; an old self-follow doesn't break
+        fan-out."""
+
+        with self.client as c:
+            self.login(c, 100)
+
+            self.assertEqual(c.post('/users/follow/100').status_code, 403)
+
+        db.session.add(Follows(user_being_followed_id=100, user_following_id=100))
+        db.session.commit()
+
+        self.post(100, 'to myself')
+
+        self.assertEqual(self.home_texts(100), ['to myself'])
+        self.assertEqual(self.home_texts(200), ['to myself'])
+
+    def test_trim(self):
+        """Timelines are cut back to the configured length."""
+
+        for i in range(5):
+            self.post(100, f'message {i}')
+
+        self.configure(TIMELINE_MAX_LENGTH=2)
+
+        with app.app_context():
+            timeline.trim()
+            db.session.commit()
+
+        self.assertEqual(self.home_texts(200), ['message 4', 'message 3'])
+
+    def test_maintenance(self):
+        """Posting queues the trim once a period, without an operator."""
+
+        self.post(100, 'message 0')
+
+        for i in range(1, 4):
+            self.post(100, f'message {i}')
+
+        self.configure(TIMELINE_MAX_LENGTH=2)
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=200).count(), 4)
+
+        # queued once this period already
+        self.post(100, 'message 4')
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=200).count(), 5)
+
+        timeline._maintained['period'] = None
+        self.post(100, 'message 5')
+        self.assertEqual(self.home_texts(200), ['message 5', 'message 4'])
+
+    def test_pagination(self):
+        """Pages follow the `before` cursor down the timeline."""
+
+        for i in range(3):
+            self.post(100, f'message {i}')
+
+        self.configure(MESSAGES_PER_PAGE=2)
+
+        for url in ['/', '/users/100']:
+            with self.client as c:
+                self.login(c, 200)
+
+                resp = c.get(url)
+                html = resp.get_data(as_text=True)
+
+                self.assertIn('message 2', html)
+                self.assertIn('message 1', html)
+                self.assertNotIn('message 0', html)
+                self.assertIn('Older messages', html)
+
+                older = Message.query.filter_by(text='message 1').one()
+                resp = c.get(url, query_string={
+                    'before': f'{older.timestamp.isoformat()}_{older.id}'})
+                html = resp.get_data(as_text=True)
+
+                self.assertIn('message 0', html)
+                self.assertNotIn('message 1', html)
+                self.assertNotIn('Older messages', html)
+
+    def test_deleted_author_pagination(self):
+        """A deleted account's messages leave the page full, not short."""
+
+        for i in range(3):
+            self.post(100, f'message {i}')
+
+        db.session.add(Follows(user_being_followed_id=300, user_following_id=200))
+        db.session.commit()
+        for i in range(2):
+            self.post(300, f'gone {i}')
+
+        purge.tombstone(User.query.get(300))
+        db.session.commit()
+
+        self.configure(MESSAGES_PER_PAGE=2)
+
+        with self.client as c:
+            self.login(c, 200)
+
+            html = c.get('/').get_data(as_text=True)
+
+        self.assertIn('message 2', html)
+        self.assertIn('message 1', html)
+        self.assertNotIn('gone', html)
+        self.assertIn('Older messages', html)
+
+    def test_bad_cursor(self):
+        """A malformed cursor is a bad request."""
+
+        with self.client as c:
+            resp = c.get('/users/100?before=yesterday')
+            self.assertEqual(resp.status_code, 400)
+
+    def count_queries(self, url, user_id):
+        """Number of SQL statements run to serve `url` to `user_id`."""
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with self.client as c:
+            self.login(c, user_id)
+
+            event.listen(db.engine, 'before_cursor_execute', record)
+            try:
+                resp = c.get(url)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', record)
+
+            self.assertEqual(resp.status_code, 200)
+
+        return len(statements)
+
+    def test_home_query_count(self):
+        """Authors are loaded in one batch, not once per message."""
+
+        # someone to suggest: followed by the author the follower follows
+        db.session.add(Follows(user_being_followed_id=300, user_following_id=100))
+        db.session.commit()
+
+        self.post(100, 'from the author')
+        self.count_queries('/', 200)
+        few = self.count_queries('/', 200)
+
+        for i in range(10):
+            author = User.signup(f'author{i}', f'author{i}@email.com', 'password', None)
+            db.session.add(author)
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=author.id,
+                                   user_following_id=200))
+            db.session.commit()
+
+            self.post(author.id, f'message by author{i}')
+
+        many = self.count_queries('/', 200)
+
+        # timeline page, messages with authors, liked ids, suggested users
+        # (the current user is cached)
+        self.assertEqual(few, 4)
+        self.assertEqual(many, few)
@@ -0,0 +1,278 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
+
+import numpy as np
+
+from models import db, User, Message, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import purge
+from testing import AppTestCase
+import trending
+from trending import Leaderboard, POST_WEIGHT
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['JOBS_MODE'] = 'inline'
+
+HOUR = 3600
+
+
+class LeaderboardTestCase(TestCase):
+    """Scores decay, and the board stays in order."""
+
+    def test_decay(self):
+        """A like counts half as much a half-life later."""
+
+        board = Leaderboard(HOUR, 0)
+        board.add(1, 1, 0)
+        board.add(2, 1, HOUR)
+        board.add(3, 3, 0)
+
+        self.assertEqual(board.top(3), [3, 2, 1])
+        self.assertAlmostEqual(board.score(1, HOUR), 0.5)
+        self.assertAlmostEqual(board.score(2, HOUR), 1)
+
+        # taking likes away, down to nothing
+        board.add(3, -2.5, 0)
+        self.assertEqual(board.top(3), [2, 1, 3])
+        board.add(3, -1, 0)
+        self.assertEqual(board.top(3), [2, 1])
+
+    def test_rebase(self):
+        """Re-decaying keeps the order and drops what's faded."""
+
+        board = Leaderboard(HOUR, 0)
+        board.add(1, 1, 0)
+        board.add(2, 1, 20 * HOUR)
+        board.add(3, 2, 20 * HOUR)
+
+        board.rebase(20 * HOUR, min_score=0.01)
+
+        self.assertEqual(board.top(5), [3, 2])
+        self.assertAlmostEqual(board.score(3, 20 * HOUR), 2)
+
+    def test_build(self):
+        """A board built from arrays matches one built event by event."""
+
+        rng = np.random.default_rng(0)
+        ids = rng.integers(1, 50, 500)
+        likes = rng.choice([1.0, 2.0], 500)
+        times = rng.uniform(0, 10 * HOUR, 500)
+
+        built = Leaderboard.build(HOUR, 0, ids, likes, times)
+
+        added = Leaderboard(HOUR, 0)
+        for message_id, count, at in zip(ids.tolist(), likes, times):
+            added.add(message_id, count, at)
+
+        self.assertEqual(built.top(10), added.top(10))
+        self.assertEqual(len(built), len(added))
+
+
+    def test_top_kept(self):
+        """The top follows likes without picking it again from every score."""
+
+        rng = np.random.default_rng(0)
+        board = Leaderboard(HOUR, 0)
+        for message_id in range(1, 101):
+            board.add(message_id, rng.uniform(1, 10), 0)
+        board.top(10)
+
+        with mock.patch.object(board, '_best', wraps=board._best) as best:
+            for _ in range(500):
+                message_id = int(rng.integers(1, 120))
+                if rng.random() < 0.05:
+                    board.remove(message_id)
+                else:
+                    board.add(message_id, rng.choice([1.0, -1.0]), rng.uniform(0, HOUR))
+
+                expected = [message_id for message_id, _ in Leaderboard._best(board, 10)]
+                self.assertEqual(board.top(10), expected)
+
+        # only when a message dropped out of the top
+        self.assertLess(best.call_count, 100)
+
+
+    def test_size(self):
+        """Only the best `size` messages are kept."""
+
+        board = Leaderboard(HOUR, 0, size=2)
+        for message_id in range(1, 5):
+            board.add(message_id, message_id, 0)
+
+        # trimmed once events more than double it
+        self.assertEqual(len(board), 4)
+        board.add(5, 5, 0)
+        self.assertEqual(len(board), 2)
+        self.assertEqual(board.top(5), [5, 4])
+
+        # and when re-decayed
+        board.add(7, 1, 0)
+        board.rebase(HOUR)
+        self.assertEqual(board.top(5), [5, 4])
+        self.assertEqual(len(board), 2)
+
+        built = Leaderboard.build(HOUR, 0, np.arange(1, 6), np.arange(1.0, 6.0),
+                                  np.zeros(5), size=2)
+        self.assertEqual((built.top(5), len(built)), ([5, 4], 2))
+
+
+class TrendingTestCase(AppTestCase):
+    """The board follows likes and posts, and can be rebuilt."""
+
+    def setUp(self):
+        super().setUp()
+
+        fan = User.signup('fan', 'fan@email.com', 'password', None)
+        author = User.signup('author', 'author@email.com', 'password', None)
+        db.session.commit()
+        self.fan_id, self.author_id = fan.id, author.id
+
+    def as_user(self, user_id, method, url, **kwargs):
+        with self.client as c:
+            self.login(c, user_id)
+            return getattr(c, method)(url, **kwargs)
+
+    def post(self, text, ago=timedelta(0), user_id=None):
+        msg = Message(text=text, user_id=user_id or self.author_id,
+                      timestamp=datetime.utcnow() - ago)
+        db.session.add(msg)
+        db.session.commit()
+        return msg.id
+
+    def like(self, message_id, ago, user_id=None):
+        db.session.add(Likes(user_id=user_id or self.fan_id, message_id=message_id,
+                             timestamp=datetime.utcnow() - ago))
+        db.session.commit()
+
+    def test_events(self):
+        """Posts and likes move the board as they happen."""
+
+        self.as_user(self.author_id, 'post', '/messages/new', data={'text': 'first'})
+        self.as_user(self.author_id, 'post', '/messages/new', data={'text': 'second'})
+        first, second = (Message.query.filter_by(text=text).one().id
+                         for text in ['first', 'second'])
+
+        with app.app_context():
+            self.assertEqual(set(trending.board.top(10)), {first, second})
+
+        self.as_user(self.fan_id, 'post', f'/users/add_like/{first}')
+        with app.app_context():
+            self.assertEqual(trending.board.top(10), [first, second])
+
+        # unliked, and liked through the API
+        self.as_user(self.fan_id, 'post', f'/users/add_like/{first}')
+        self.as_user(self.fan_id, 'post', f'/api/v1/messages/{second}/like')
+        with app.app_context():
+            self.assertEqual(trending.board.top(10), [second, first])
+
+    def test_rebuild(self):
+        """Rebuilt from recent likes and posts, old ones left out."""
+
+        old = self.post('old', ago=timedelta(days=3))
+        recent = self.post('recent', ago=timedelta(hours=3))
+        fresh = self.post('fresh')
+
+        self.like(old, ago=timedelta(days=3))
+        self.like(old, ago=timedelta(days=3), user_id=self.author_id)
+        self.like(recent, ago=timedelta(hours=3))
+
+        with app.app_context():
+            # a like 3 hours (half a half-life) ago beats a post now
+            self.assertEqual(trending.board.top(10), [recent, fresh])
+
+    def test_rebuild_replay(self):
+        """Events a rebuild read anyway aren't counted twice."""
+
+        read = self.post('read')
+        self.like(read, ago=timedelta(0))
+        unliked = self.post('unliked')
+        missed = self.post('missed')
+
+        with app.app_context():
+            # committed before the rebuild reads, but recorded after it began
+            trending.board._rebuilding = True
+            trending.board.posted(read)
+            trending.board.liked(read, self.fan_id, True)
+            trending.board.liked(unliked, self.fan_id, True)
+            trending.board.liked(unliked, self.fan_id, False)
+            # recorded, but not committed in time to be read
+            trending.board.liked(missed, self.fan_id, True)
+
+            board = trending.board.rebuild()
+
+        now = time.time()
+        self.assertAlmostEqual(board.score(read, now), 1 + POST_WEIGHT, places=3)
+        self.assertAlmostEqual(board.score(unliked, now), POST_WEIGHT, places=3)
+        self.assertAlmostEqual(board.score(missed, now), 1 + POST_WEIGHT, places=3)
+
+    def test_hidden(self):
+        """Deleted messages and deleted authors' messages don't show."""
+
+        kept = self.post('kept')
+        deleted = self.post('deleted')
+        self.like(deleted, ago=timedelta(0))
+
+        self.as_user(self.author_id, 'post', f'/messages/{deleted}/delete')
+
+        other = User.signup('other', 'other@email.com', 'password', None)
+        db.session.commit()
+        other_id = other.id
+        gone = self.post('gone', user_id=other_id)
+        self.like(gone, ago=timedelta(0))
+
+        with app.app_context():
+            trending.board.top(10)
+        purge.tombstone(User.query.get(other_id))
+        db.session.commit()
+
+        with app.app_context():
+            self.assertEqual([msg.id for msg in trending.board.messages(10)], [kept])
+
+    def test_page(self):
+        """The trending page and API list the board."""
+
+        first = self.post('first')
+        second = self.post('second')
+        self.like(second, ago=timedelta(0))
+
+        html = self.as_user(self.fan_id, 'get', '/messages/trending').get_data(as_text=True)
+        self.assertLess(html.index('second'), html.index('first'))
+
+        data = self.as_user(self.fan_id, 'get', '/api/v1/messages/trending').get_json()
+        self.assertEqual([msg['id'] for msg in data['messages']], [second, first])
+        self.assertEqual(data['messages'][0]['liked'], True)
+
+    def test_cold_build(self):
+        """Requests arriving before there's a board share one build."""
+
+        self.post('first')
+        boards = []
+
+        def read():
+            with app.app_context():
+                trending.board.top(10)
+                boards.append(trending.board.leaderboard)
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+
+        self.assertEqual(len(boards), 4)
+        self.assertEqual(len({id(board) for board in boards}), 1)
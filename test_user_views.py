@@ -6,7 +6,8 @@
 
 
 import os
-from unittest import TestCase
+
+from flask import g
 
 from models import db, connect_db, Message, User, Likes, Follows
 from bs4 import BeautifulSoup
@@ -22,6 +23,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from passwords import PasswordHasher
+from testing import AppTestCase
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -33,17 +36,18 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Run background jobs straight away, so tests see their effects
+
+app.config['JOBS_MODE'] = 'inline'
+
 
-class UserViewTestCase(TestCase):
+class UserViewTestCase(AppTestCase):
     """Test views for users."""
 
     def setUp(self):
         """Setup test user and test data."""
 
-        db.drop_all()
-        db.create_all()
-
-        self.client = app.test_client()
+        super().setUp()
 
         self.testuser = User.signup(username='test_name', email='test@email.com', password='password', image_url='None')
         self.testuser_id = 6999
@@ -293,3 +297,211 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertNotIn('@user1', str(resp.data))
             self.assertIn('Access unauthorized', str(resp.data))
+
+    def test_follow_counts(self):
+        """Following and unfollowing keep both users' counters in step."""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            c.post(f'/users/follow/{self.u1_id}')
+            self.assertEqual(User.query.get(self.testuser_id).following_count, 1)
+            self.assertEqual(User.query.get(self.u1_id).followers_count, 1)
+
+            c.post(f'/users/stop-following/{self.u1_id}')
+            self.assertEqual(User.query.get(self.testuser_id).following_count, 0)
+            self.assertEqual(User.query.get(self.u1_id).followers_count, 0)
+
+    def test_reconcile_counts(self):
+        """Counters that drifted are recomputed from the real rows."""
+
+        self.setup_test_followers()
+
+        self.assertEqual(User.reconcile_counts(), 3)
+        db.session.commit()
+
+        testuser = User.query.get(self.testuser_id)
+        self.assertEqual(testuser.following_count, 2)
+        self.assertEqual(testuser.followers_count, 1)
+        self.assertEqual(User.reconcile_counts(), 0)
+
+    def test_users_page_follow_state(self):
+        """The users page shows which users the viewer already follows."""
+
+        self.setup_test_followers()
+        u3_id = self.u3.id
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get('/users')
+            html = str(resp.data)
+
+            self.assertIn(f'/users/stop-following/{self.u1_id}', html)
+            self.assertIn(f'/users/stop-following/{self.u2_id}', html)
+            self.assertNotIn(f'/users/stop-following/{self.testuser_id}', html)
+            self.assertIn(f'/users/follow/{u3_id}', html)
+
+    def test_is_following(self):
+        """Pair lookups and the loaded id set agree."""
+
+        self.setup_test_followers()
+
+        testuser = User.query.get(self.testuser_id)
+        u1 = User.query.get(self.u1_id)
+        u3 = User.query.get(self.u3.id)
+
+        self.assertTrue(testuser.is_following(u1))
+        self.assertFalse(testuser.is_following(u3))
+        self.assertTrue(testuser.is_followed_by(u1))
+        self.assertFalse(u3.is_followed_by(testuser))
+
+        self.assertEqual(testuser.following_ids(), {self.u1_id, self.u2_id})
+        self.assertTrue(testuser.is_following(u1))
+        self.assertFalse(testuser.is_following(u3))
+
+    def test_cached_current_user(self):
+        """The logged-in user comes from the cache until their profile changes."""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            c.get('/users')
+
+            User.query.filter_by(id=self.testuser_id).update({'bio': 'stale'})
+            db.session.commit()
+
+            c.get('/users')
+            self.assertNotEqual(g.user.bio, 'stale')
+
+            resp = c.post('/users/profile', data={
+                'username': 'test_name',
+                'email': 'test@email.com',
+                'bio': 'fresh',
+                'password': 'password',
+            })
+            self.assertEqual(resp.status_code, 302)
+
+            c.get('/users')
+            self.assertEqual(g.user.bio, 'fresh')
+
+    def test_deleted_message_likers(self):
+        """Deleting a liked message refreshes its likers' cached counts."""
+
+        msg = Message(text='liked', user_id=self.testuser_id)
+        db.session.add(msg)
+        db.session.commit()
+        message_id = msg.id
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f'/users/add_like/{message_id}')
+            c.get('/users')
+            self.assertEqual(g.user.likes_count, 1)
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f'/messages/{message_id}/delete')
+
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.get('/users')
+            self.assertEqual(g.user.likes_count, 0)
+
+    def test_follow_refreshes_followed(self):
+        """Following and unfollowing refresh the followed user's cached
+        follower count."""
+
+        def followers_count():
+            with self.client as c:
+                self.login(c, self.u2_id)
+                c.get('/users')
+                return g.user.followers_count
+
+        before = followers_count()
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f'/users/follow/{self.u2_id}')
+
+        self.assertEqual(followers_count(), before + 1)
+
+        with self.client as c:
+            self.login(c, self.testuser_id)
+            c.post(f'/users/stop-following/{self.u2_id}')
+
+        self.assertEqual(followers_count(), before)
+
+    def test_static_skips_user(self):
+        """Static files don't look up the logged-in user."""
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            c.get('/static/stylesheets/style.css')
+            self.assertIsNone(g.user)
+
+    def test_toggle_like(self):
+        """Liking twice unlikes, and several users can like one message."""
+
+        msg = Message(id=3000, text='Likeable', user_id=self.u1_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        for user_id in [self.testuser_id, self.u2_id]:
+            with self.client as c:
+                with c.session_transaction() as session:
+                    session[CURR_USER_KEY] = user_id
+
+                resp = c.post('/users/add_like/3000')
+                self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(Likes.query.filter_by(message_id=3000).count(), 2)
+        self.assertEqual(Message.query.get(3000).likes_count, 2)
+        self.assertEqual(User.query.get(self.testuser_id).likes_count, 1)
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            c.post('/users/add_like/3000')
+
+        db.session.expire_all()
+        self.assertEqual(Likes.query.filter_by(message_id=3000).count(), 1)
+        self.assertEqual(Message.query.get(3000).likes_count, 1)
+        self.assertEqual(User.query.get(self.testuser_id).likes_count, 0)
+
+    def test_like_own_message(self):
+        """Users can't like their own messages."""
+
+        msg = Message(id=3001, text='Mine', user_id=self.testuser_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post('/users/add_like/3001')
+            self.assertEqual(resp.status_code, 403)
+            self.assertEqual(Likes.query.count(), 0)
+
+    def test_login_rehash(self):
+        """Logging in upgrades a hash made with an old work factor."""
+
+        old_hash = PasswordHasher(rounds=4).hash('password')
+        User.query.filter_by(id=self.u1_id).update({'password': old_hash})
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.post('/login', data={'username': 'user1', 'password': 'password'})
+            self.assertEqual(resp.status_code, 302)
+
+        new_hash = User.query.get(self.u1_id).password
+        self.assertNotEqual(new_hash, old_hash)
+        self.assertTrue(new_hash.startswith(f"$2b${app.config['BCRYPT_LOG_ROUNDS']:02}$"))
+        self.assertTrue(User.authenticate('user1', 'password'))
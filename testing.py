@@ -0,0 +1,52 @@
+"""Shared set-up for tests that use the app and its database.
+
+Import it after setting DATABASE_URL, as the test modules do before
+importing app.
+"""
+
+from unittest import TestCase
+
+from app import app, CURR_USER_KEY
+from models import db
+import fragments
+import identity
+import recommend
+import timeline
+import trending
+
+
+def reset():
+    """Empty the database and forget everything kept in memory from it."""
+
+    db.drop_all()
+    db.create_all()
+    identity._cache.clear()
+    fragments.cache.clear()
+    recommend.recommender.clear()
+    trending.board.clear()
+    timeline._celebrities['expires'] = 0
+    timeline._maintained['period'] = None
+
+
+class AppTestCase(TestCase):
+    """A test starting from an empty database, with a test client."""
+
+    def setUp(self):
+        reset()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def configure(self, **settings):
+        """Change app.config settings until the end of the test."""
+
+        for name, value in settings.items():
+            self.addCleanup(app.config.__setitem__, name, app.config[name])
+            app.config[name] = value
+
+    def login(self, client, user_id):
+        """Log `client` in as `user_id`, within `with client:`."""
+
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
@@ -0,0 +1,338 @@
+"""Precomputed home timelines for Warbler.
+
+Posting a message pushes its id onto the timeline of every follower (fan-out
+on write), so reading a home page is one range scan over `timeline_entries`
+instead of an `IN (...)` query across everyone the user follows.
+
+Authors marked `celebrity` are not fanned out; their messages are pulled
+in and merged when the timeline is read. The `maintain_timelines` job,
+queued every TIMELINE_MAINTAIN_SECONDS by posting, marks authors with
+more than TIMELINE_FANOUT_LIMIT followers. It unmarks them only once they
+are down below DEMOTE_FRACTION of that, so a follower or two coming and
+going doesn't flip them back and forth, and in the same transaction fans
+out their recent messages, which were never fanned out. The same job
+trims timelines to TIMELINE_MAX_LENGTH, as fan-out only ever appends.
+"""
+
+import time
+
+from flask import current_app
+from sqlalchemy import func, literal, tuple_
+
+import jobs
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import before as older_than
+
+# celebrities are unmarked below this fraction of TIMELINE_FANOUT_LIMIT
+DEMOTE_FRACTION = 0.9
+
+_celebrities = {'ids': frozenset(), 'expires': 0}
+
+# the TIMELINE_MAINTAIN_SECONDS period maintenance was last queued in
+_maintained = {'period': None}
+
+
+def celebrity_ids():
+    """Ids of authors marked as celebrities, for merging on read.
+
+    This is a scan of `users`, so the result is kept for
+    CELEBRITY_CACHE_SECONDS; being a celebrity changes slowly. Writes
+    read the mark from the author's row instead.
+    """
+
+    now = time.monotonic()
+
+    if now >= _celebrities['expires']:
+        rows = (db.session
+                .query(User.id)
+                .filter(User.celebrity)
+                .all())
+
+        _celebrities['ids'] = frozenset(user_id for user_id, in rows)
+        _celebrities['expires'] = now + current_app.config['CELEBRITY_CACHE_SECONDS']
+
+    return _celebrities['ids']
+
+
+def fan_out(msg):
+    """Push `msg` onto its author's timeline and those of their followers.
+
+    Must be called after the message is flushed (so it has an id); the
+    inserts join the caller's transaction.
+    """
+
+    entries = TimelineEntry.__table__
+
+    db.session.execute(entries.insert().values(
+        user_id=msg.user_id,
+        message_id=msg.id,
+        timestamp=msg.timestamp,
+    ))
+
+    # from the row, not celebrity_ids(): either a demotion's fan-out finds
+    # this message, or this finds the demotion
+    if msg.user.celebrity:
+        return
+
+    followers = (db.session
+                 .query(Follows.user_following_id,
+                        literal(msg.id),
+                        literal(msg.timestamp, db.DateTime))
+                 .filter(Follows.user_being_followed_id == msg.user_id,
+                         # the author's entry is already in
+                         Follows.user_following_id != msg.user_id))
+
+    db.session.execute(entries.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], followers))
+
+
+def backfill(user_id, author_id):
+    """Copy `author_id`'s recent messages onto `user_id`'s timeline.
+
+    Used when a new follow is added. Celebrity messages are merged at read
+    time, so there is nothing to copy for them.
+    """
+
+    # a user's own messages are always on their timeline
+    if author_id == user_id:
+        return
+
+    if db.session.query(User.celebrity).filter(User.id == author_id).scalar():
+        return
+
+    recent = (db.session
+              .query(literal(user_id), Message.id, Message.timestamp)
+              .filter(Message.user_id == author_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(current_app.config['TIMELINE_MAX_LENGTH']))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], recent))
+
+
+def remove_author(user_id, author_id):
+    """Drop `author_id`'s messages from `user_id`'s timeline (on unfollow)."""
+
+    authored = (db.session
+                .query(Message.id)
+                .filter(Message.user_id == author_id))
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == user_id,
+             TimelineEntry.message_id.in_(authored.subquery()))
+     .delete(synchronize_session=False))
+
+
+def rebuild(user_id):
+    """Recompute `user_id`'s timeline from scratch."""
+
+    TimelineEntry.query.filter_by(user_id=user_id).delete()
+
+    celebrities = db.session.query(User.id).filter(User.celebrity)
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user_id,
+                        ~Follows.user_being_followed_id.in_(celebrities.subquery())))
+
+    fanned_out = Message.user_id.in_(followed.subquery())
+
+    recent = (db.session
+              .query(literal(user_id), Message.id, Message.timestamp)
+              .filter((Message.user_id == user_id) | fanned_out)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(current_app.config['TIMELINE_MAX_LENGTH']))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], recent))
+
+
+def _fan_out_recent(author_id):
+    """Put `author_id`'s newest TIMELINE_MAX_LENGTH messages on their
+    followers' timelines, where they aren't already."""
+
+    recent = (db.session
+              .query(Message.id, Message.timestamp)
+              .filter(Message.user_id == author_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(current_app.config['TIMELINE_MAX_LENGTH'])
+              .subquery())
+
+    on_timeline = (db.session
+                   .query(TimelineEntry.message_id)
+                   .filter(TimelineEntry.user_id == Follows.user_following_id,
+                           TimelineEntry.message_id == recent.c.id))
+
+    missing = (db.session
+               .query(Follows.user_following_id, recent.c.id, recent.c.timestamp)
+               .filter(Follows.user_being_followed_id == author_id,
+                       Follows.user_following_id != author_id,
+                       ~on_timeline.exists()))
+
+    db.session.execute(TimelineEntry.__table__.insert().from_select(
+        ['user_id', 'message_id', 'timestamp'], missing))
+
+
+def update_celebrities():
+    """Mark authors over TIMELINE_FANOUT_LIMIT followers as celebrities,
+    and unmark those now below DEMOTE_FRACTION of it, fanning out their
+    recent messages. Returns (marked, unmarked).
+
+    Joins the caller's transaction.
+    """
+
+    limit = current_app.config['TIMELINE_FANOUT_LIMIT']
+
+    marked = (User.query
+              .filter(~User.celebrity, User.followers_count > limit)
+              .update({User.celebrity: True}, synchronize_session=False))
+
+    demoted = (db.session
+               .query(User.id)
+               .filter(User.celebrity, User.followers_count < limit * DEMOTE_FRACTION)
+               .all())
+
+    unmarked = 0
+    for author_id, in demoted:
+        # only if still marked: another worker may have got here first
+        if (User.query
+                .filter(User.id == author_id, User.celebrity)
+                .update({User.celebrity: False}, synchronize_session=False)):
+            _fan_out_recent(author_id)
+            unmarked += 1
+
+    return marked, unmarked
+
+
+def schedule_maintenance():
+    """Queue `maintain_timelines`, if it hasn't been queued in this
+    TIMELINE_MAINTAIN_SECONDS period."""
+
+    period = int(time.time() // current_app.config['TIMELINE_MAINTAIN_SECONDS'])
+
+    if _maintained['period'] != period:
+        _maintained['period'] = period
+        # keyed by the period, so it's queued once across processes too
+        jobs.enqueue('maintain_timelines', key=f'maintain_timelines:{period}')
+
+
+def trim():
+    """Cut every timeline down to its newest TIMELINE_MAX_LENGTH entries.
+
+    Fan-out only ever appends, so this is run by `maintain_timelines`
+    (or `flask trim-timelines`) rather than on each write.
+    """
+
+    rank = (func.row_number()
+            .over(partition_by=TimelineEntry.user_id,
+                  order_by=(TimelineEntry.timestamp.desc(),
+                            TimelineEntry.message_id.desc()))
+            .label('rank'))
+
+    ranked = (db.session
+              .query(TimelineEntry.user_id, TimelineEntry.message_id, rank)
+              .subquery())
+
+    stale = (db.session
+             .query(ranked.c.user_id, ranked.c.message_id)
+             .filter(ranked.c.rank > current_app.config['TIMELINE_MAX_LENGTH']))
+
+    return (TimelineEntry
+            .query
+            .filter(tuple_(TimelineEntry.user_id, TimelineEntry.message_id)
+                    .in_(stale.subquery()))
+            .delete(synchronize_session=False))
+
+
+def entries_query(user_id, limit, before=None):
+    """Query for the (timestamp, message id) of the newest `limit` entries
+    on `user_id`'s precomputed timeline, older than `before`."""
+
+    # messages by deleted accounts drop out (until they're purged) before
+    # the limit, so a page isn't short of them
+    entries = (db.session
+               .query(TimelineEntry.timestamp, TimelineEntry.message_id)
+               .join(Message, Message.id == TimelineEntry.message_id)
+               .join(User, User.id == Message.user_id)
+               .filter(TimelineEntry.user_id == user_id,
+                       User.deleted_at.is_(None)))
+
+    if before:
+        entries = entries.filter(older_than(TimelineEntry.timestamp,
+                                            TimelineEntry.message_id,
+                                            before))
+
+    return (entries
+            .order_by(TimelineEntry.timestamp.desc(),
+                      TimelineEntry.message_id.desc())
+            .limit(limit))
+
+
+def pulled_query(user_id, celebrities, limit, before=None):
+    """Query for the (timestamp, message id) of the newest `limit`
+    messages by those of `celebrities` that `user_id` follows."""
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user_id,
+                        Follows.user_being_followed_id.in_(sorted(celebrities))))
+
+    pulled = (db.session
+              .query(Message.timestamp, Message.id)
+              .join(User, User.id == Message.user_id)
+              .filter(Message.user_id.in_(followed.subquery()),
+                      User.deleted_at.is_(None)))
+
+    if before:
+        pulled = pulled.filter(older_than(Message.timestamp, Message.id, before))
+
+    return pulled.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+
+def home_timeline(user, limit, before=None):
+    """Newest `limit` messages for `user`'s home page.
+
+    Reads the precomputed timeline and merges in messages from any
+    celebrities `user` follows. `before` is a (timestamp, id) key; only
+    messages older than it are returned.
+    """
+
+    entries = entries_query(user.id, limit, before).all()
+
+    celebrities = celebrity_ids()
+    if celebrities:
+        entries += pulled_query(user.id, celebrities, limit, before).all()
+
+        # an author may have been fanned out to before becoming a celebrity
+        entries = sorted(set(entries), reverse=True)[:limit]
+
+    ids = [message_id for _, message_id in entries]
+    if not ids:
+        return []
+
+    # authors come back in the same query, not one lazy load per message
+    messages = Message.visible().filter(Message.id.in_(ids))
+
+    messages = {msg.id: msg for msg in messages}
+    return [messages[message_id] for message_id in ids if message_id in messages]
+
+
+def user_messages_query(user_id, limit, before=None):
+    """Query for the newest `limit` messages written by `user_id`, older
+    than `before`."""
+
+    messages = Message.query.filter(Message.user_id == user_id)
+
+    if before:
+        messages = messages.filter(older_than(Message.timestamp, Message.id, before))
+
+    return (messages
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(limit))
+
+
+def user_messages(user_id, limit, before=None):
+    """Newest `limit` messages written by `user_id`, older than `before`."""
+
+    return user_messages_query(user_id, limit, before).all()
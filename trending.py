@@ -0,0 +1,453 @@
+"""Trending messages: a leaderboard of likes, decayed over time.
+
+A message's score is its likes, each worth less the older it is: a like
+made TRENDING_HALF_LIFE_SECONDS ago counts half, one made twice that
+long ago a quarter, and so on. Posting a message counts as POST_WEIGHT
+of a like, so new messages have a way on.
+
+Working that out from `likes` per request means reading every recent
+like, so the board is kept in memory. Scores are kept in "forward decay"
+form: rather than every score shrinking as time passes, each new like is
+worth more, 2 ** ((t - epoch) / half life). Scores then keep their order
+however much time passes, so the board only changes when a like or post
+comes in, and each of those is one dict update. The top K is picked with
+a heap when first read and then kept in order as likes come in; it is
+only picked again when a message drops out of it, as some other message
+may then belong in its place. Every TRENDING_DECAY_SECONDS the epoch moves up to now, which scales every
+score down by the same factor (so nothing overflows), and scores below
+MIN_SCORE of a like are dropped.
+
+The board holds at most TRENDING_SIZE messages, the best scoring: it is
+cut back to that many when re-decayed, or sooner if events double it. A
+message cut from the board starts from nothing if it is liked again,
+until the next rebuild counts its likes.
+
+toggle_like and messages_add record their events once committed. The
+board is rebuilt from the last TRENDING_WINDOW_SECONDS of `likes` and
+`messages` the first time it is needed, after a restart (requests
+arriving meanwhile wait for that one build), and then every
+TRENDING_REBUILD_SECONDS in a background thread, which also brings in
+other processes' events. Events recorded while a rebuild is reading are
+replayed onto the new board, leaving out the posts and likes it read
+anyway: whether it saw them depends on when they were committed, which
+is known by the rows themselves, not by the clock.
+
+An unlike takes off what a like made now would be worth, not what the
+original like is still worth (its time goes with the row); the next
+rebuild puts that right.
+"""
+
+import bisect
+import heapq
+import math
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+
+from models import db, Likes, Message, User
+
+# a new message counts as this many likes
+POST_WEIGHT = 1.0
+
+# scores below this many likes are dropped when the board is re-decayed
+MIN_SCORE = 0.01
+
+
+class Leaderboard:
+    """Message ids by decayed score, the best `size` of them kept."""
+
+    def __init__(self, half_life, epoch, size=None):
+        self.rate = math.log(2) / half_life
+        self.epoch = epoch
+        self.size = size
+        self.scores = {}
+        # the best _k as (-score, id), best first; None until next read
+        self._top = None
+        self._k = 0
+
+    def __len__(self):
+        return len(self.scores)
+
+    def weight(self, at):
+        """What a like at time `at` (in seconds) adds to a score."""
+
+        return math.exp(self.rate * (at - self.epoch))
+
+    def add(self, message_id, likes, at):
+        """Add `likes` (negative to take away) made at time `at`."""
+
+        old = self.scores.get(message_id, 0)
+        new = old + likes * self.weight(at)
+
+        if new > 0:
+            self.scores[message_id] = new
+        else:
+            self.scores.pop(message_id, None)
+
+        if self._top is not None:
+            self._move(message_id, old, new)
+
+        if self.size and len(self.scores) > 2 * self.size:
+            self._trim(self.size)
+
+    def remove(self, message_id):
+        """Take `message_id` off the board; returns its score."""
+
+        score = self.scores.pop(message_id, 0)
+
+        if self._top is not None:
+            self._move(message_id, score, 0)
+
+        return score
+
+    def _move(self, message_id, old, new):
+        """Keep the top in order as `message_id`'s score goes from `old`
+        to `new` (0 when off the board)."""
+
+        top = self._top
+        key = (-new, message_id)
+
+        i = bisect.bisect_left(top, (-old, message_id)) if old > 0 else len(top)
+        if i < len(top) and top[i] == (-old, message_id):
+            last = top[-1]
+            del top[i]
+            # messages on the board outside the top, all scoring below it
+            outside = len(self.scores) - (new > 0) - len(top)
+
+            if new > 0 and (key <= last or not outside):
+                bisect.insort(top, key)
+            elif outside:
+                # it has dropped out, and one of those may now belong in
+                # its place: pick the top again when next read
+                self._top = None
+        elif new > 0:
+            if len(top) < self._k:
+                # the top holds every message on the board
+                bisect.insort(top, key)
+            elif key < top[-1]:
+                bisect.insort(top, key)
+                top.pop()
+
+    def _best(self, k):
+        # best score first, then lowest id
+        return heapq.nlargest(k, self.scores.items(),
+                              key=lambda item: (item[1], -item[0]))
+
+    def _trim(self, size):
+        self.scores = dict(self._best(size))
+        self._top = None
+
+    def top(self, k):
+        """Ids of the `k` best scoring messages."""
+
+        if self._top is None or self._k < k:
+            self._k = k
+            self._top = [(-score, message_id) for message_id, score in self._best(k)]
+
+        return [message_id for _, message_id in self._top[:k]]
+
+    def score(self, message_id, now):
+        """`message_id`'s score at time `now`, in likes."""
+
+        return self.scores.get(message_id, 0) / self.weight(now)
+
+    def rebase(self, now, min_score=MIN_SCORE):
+        """Move the epoch up to `now`, dropping scores below `min_score`
+        and all but the best `size`.
+
+        Every score shrinks by the same factor, so the order stands.
+        """
+
+        factor = 1 / self.weight(now)
+        self.epoch = now
+
+        self.scores = {message_id: score * factor
+                       for message_id, score in self.scores.items()
+                       if score * factor >= min_score}
+        self._top = None
+
+        if self.size and len(self.scores) > self.size:
+            self._trim(self.size)
+
+    @classmethod
+    def build(cls, half_life, epoch, message_ids, likes, times, size=None):
+        """A board of events given as arrays: the message, how many likes
+        it's worth and when (in seconds)."""
+
+        board = cls(half_life, epoch, size)
+
+        if len(message_ids):
+            ids, slots = np.unique(message_ids, return_inverse=True)
+            totals = np.bincount(
+                slots, weights=likes * np.exp(board.rate * (times - epoch)))
+
+            keep = totals > 0
+            ids, totals = ids[keep], totals[keep]
+
+            if size and len(ids) > size:
+                best = np.lexsort((ids, -totals))[:size]
+                ids, totals = ids[best], totals[best]
+
+            board.scores = dict(zip(ids.tolist(), totals.tolist()))
+
+        return board
+
+
+def _seconds(timestamps):
+    """Naive UTC datetimes as seconds since the Unix epoch."""
+
+    return np.array(timestamps, dtype='datetime64[us]').astype(np.int64) / 1e6
+
+
+def _recent(query, chunk_size=100000):
+    """(message ids, user ids, times) from `query`'s (message id, user id,
+    timestamp) rows, `chunk_size` rows at a time."""
+
+    message_ids, user_ids, times = [], [], []
+
+    result = db.session.execute(query.statement)
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        message_ids.append(np.array([row[0] for row in rows], dtype=np.int64))
+        user_ids.append(np.array([row[1] for row in rows], dtype=np.int64))
+        times.append(_seconds([row[2] for row in rows]))
+
+    if not message_ids:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+    return tuple(np.concatenate(arrays) for arrays in (message_ids, user_ids, times))
+
+
+def _pairs(user_ids, message_ids):
+    """(user, message) pairs as one int64 each, for np.isin."""
+
+    return (np.asarray(user_ids, dtype=np.int64) << 32) | np.asarray(message_ids, dtype=np.int64)
+
+
+def recent_queries(since):
+    """Queries for the (message id, user id, timestamp) of likes and of
+    posts since `since`, by users not deleted."""
+
+    likes = (db.session
+             .query(Likes.message_id, Likes.user_id, Likes.timestamp)
+             .join(Message, Message.id == Likes.message_id)
+             .join(User, User.id == Message.user_id)
+             .filter(Likes.timestamp >= since, User.deleted_at.is_(None)))
+    posts = (db.session
+             .query(Message.id, Message.user_id, Message.timestamp)
+             .join(User, User.id == Message.user_id)
+             .filter(Message.timestamp >= since, User.deleted_at.is_(None)))
+
+    return likes, posts
+
+
+def recent_events(since):
+    """Likes and posts since `since`, by users not deleted, each as
+    (message ids, user ids, times) arrays."""
+
+    likes, posts = recent_queries(since)
+    return _recent(likes), _recent(posts)
+
+
+class Trending:
+    """The leaderboard, kept up to date from events and rebuilt from the
+    tables now and then."""
+
+    def __init__(self):
+        self.app = None
+        self._lock = threading.Lock()
+        # held while building the board when there is none
+        self._build_lock = threading.Lock()
+        self.clear()
+
+    def init_app(self, app):
+        app.config.setdefault('TRENDING_COUNT', 50)
+        app.config.setdefault('TRENDING_SIZE', 10000)
+        app.config.setdefault('TRENDING_HALF_LIFE_SECONDS', 6 * 3600)
+        app.config.setdefault('TRENDING_WINDOW_SECONDS', 48 * 3600)
+        app.config.setdefault('TRENDING_DECAY_SECONDS', 300)
+        app.config.setdefault('TRENDING_REBUILD_SECONDS', 600)
+        self.app = app
+
+    def clear(self):
+        """Forget the board, to be rebuilt when next needed."""
+
+        with self._lock:
+            self.leaderboard = None
+            self.rebuilt_at = None
+            self._rebuilding = False
+            # (time, message id, user id or None for a post, likes)
+            # recorded during a rebuild
+            self._events = []
+
+    def rebuild(self):
+        """Build the board afresh from the tables."""
+
+        config = current_app.config
+
+        with self._lock:
+            self._rebuilding = True
+
+        try:
+            started = time.time()
+            since = datetime.utcfromtimestamp(started - config['TRENDING_WINDOW_SECONDS'])
+
+            likes, posts = recent_events(since)
+            leaderboard = Leaderboard.build(
+                config['TRENDING_HALF_LIFE_SECONDS'], started,
+                np.concatenate([likes[0], posts[0]]),
+                np.concatenate([np.ones(len(likes[0])), np.full(len(posts[0]), POST_WEIGHT)]),
+                np.concatenate([likes[2], posts[2]]),
+                size=config['TRENDING_SIZE'])
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+                self._events = []
+            raise
+
+        with self._lock:
+            self._replay(leaderboard, likes, posts)
+
+            self.leaderboard = leaderboard
+            self.rebuilt_at = started
+            self._rebuilding = False
+            self._events = []
+
+        return leaderboard
+
+    def _replay(self, leaderboard, likes, posts):
+        """Add the events recorded during a rebuild that it didn't read.
+
+        An event is recorded once committed, which may be before or after
+        the rebuild's reads started, so which ones they saw is told from
+        `likes` and `posts`, the rows they returned.
+        """
+
+        events = self._events
+        if not events:
+            return
+
+        liked = [(user_id, message_id) for _, message_id, user_id, _ in events
+                 if user_id is not None]
+        pairs = _pairs([user_id for user_id, _ in liked],
+                       [message_id for _, message_id in liked])
+        read_likes = set(pairs[np.isin(pairs, _pairs(likes[1], likes[0]))].tolist())
+
+        posted = np.array([message_id for _, message_id, user_id, _ in events
+                           if user_id is None], dtype=np.int64)
+        read_posts = set(posted[np.isin(posted, posts[0])].tolist())
+
+        # whether each (user, message) like is on the board so far
+        present = {}
+
+        for at, message_id, user_id, likes in events:
+            if user_id is None:
+                if message_id not in read_posts:
+                    leaderboard.add(message_id, likes, at)
+                continue
+
+            pair = (user_id << 32) | message_id
+            if present.setdefault(pair, pair in read_likes) != (likes > 0):
+                present[pair] = likes > 0
+                leaderboard.add(message_id, likes, at)
+
+    def _rebuild_in_background(self, app):
+        with app.app_context():
+            self.rebuild()
+
+    def _maybe_rebuild(self, now):
+        """Start a background rebuild if one is due and none is running."""
+
+        config = self.app.config
+
+        with self._lock:
+            due = (self.leaderboard is not None and not self._rebuilding
+                   and now - self.rebuilt_at >= config['TRENDING_REBUILD_SECONDS'])
+            if due:
+                self._rebuilding = True
+
+        if due:
+            threading.Thread(target=self._rebuild_in_background,
+                             args=(self.app,), daemon=True).start()
+
+    def _record(self, message_id, user_id, likes):
+        now = time.time()
+
+        with self._lock:
+            if self._rebuilding:
+                self._events.append((now, message_id, user_id, likes))
+            if self.leaderboard is not None:
+                self.leaderboard.add(message_id, likes, now)
+
+        self._maybe_rebuild(now)
+
+    def liked(self, message_id, user_id, liked):
+        """Record `user_id`'s like (or with `liked` False, unlike) of
+        `message_id`, just committed."""
+
+        self._record(message_id, user_id, 1.0 if liked else -1.0)
+
+    def posted(self, message_id):
+        """Record a message just posted."""
+
+        self._record(message_id, None, POST_WEIGHT)
+
+    def forget(self, message_id):
+        """Take a deleted message off the board."""
+
+        with self._lock:
+            if self.leaderboard is not None:
+                self.leaderboard.remove(message_id)
+
+    def top(self, k):
+        """Ids of the `k` messages trending most, best first."""
+
+        now = time.time()
+
+        if self.leaderboard is None:
+            with self._build_lock:
+                # another request may have built it while this one waited
+                if self.leaderboard is None:
+                    self.rebuild()
+
+        with self._lock:
+            leaderboard = self.leaderboard
+            if now - leaderboard.epoch >= current_app.config['TRENDING_DECAY_SECONDS']:
+                leaderboard.rebase(now)
+            ids = leaderboard.top(k)
+
+        self._maybe_rebuild(now)
+        return ids
+
+    def messages(self, k):
+        """The `k` messages trending most, best first, leaving out any
+        deleted since they were scored."""
+
+        # a few spare, in case some turn out deleted
+        ids = self.top(2 * k)
+        if not ids:
+            return []
+
+        messages = {msg.id: msg for msg in Message.visible().filter(Message.id.in_(ids))}
+        return [messages[message_id] for message_id in ids if message_id in messages][:k]
+
+    def stats(self):
+        with self._lock:
+            leaderboard = self.leaderboard
+            return {
+                'messages': len(leaderboard) if leaderboard else 0,
+                'age_seconds': (round(time.time() - self.rebuilt_at)
+                                if self.rebuilt_at else None),
+                'rebuilding': self._rebuilding,
+            }
+
+
+board = Trending()
+
+
+def init_app(app):
+    board.init_app(app)